@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+# NL→SQL compile cache. Generation runs at temperature 0, so the same question against the
+# same model, dialect, schema snapshot and prompt gives the same SQL; only SQL that passed
+# validation is stored. An in-memory LRU sits in front of a SQLite file that survives restarts.
+# The schema hash is part of every key; entries for older schemas are pruned when a new
+# snapshot is installed, not when a request still holding an older snapshot comes by.
+
+_SPACE_RE = re.compile(r"\s+")
+
+def normalize_question(question: str) -> str:
+    q = unicodedata.normalize("NFKC", question).lower()
+    q = _SPACE_RE.sub(" ", q).strip()
+    return q.rstrip(" ?.!;")
+
+def cache_key(question: str, model: str, dialect: str, schema_hash: str, prompt_version: str) -> str:
+    parts = [normalize_question(question), model, dialect, schema_hash, prompt_version]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+class CompileCache:
+    def __init__(self, path: str, max_memory: int = 2048, max_rows: int = 100_000, table: str = "compile_cache"):
+        self.path = path
+        self.table = table
+        self.max_memory = max_memory
+        self.max_rows = max_rows
+        self._mem: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._schema_hash: Optional[str] = None
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "purged": 0}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            " key TEXT PRIMARY KEY, schema_hash TEXT, value TEXT, created_at REAL, used_at REAL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_used ON {table}(used_at)")
+        self._conn.commit()
+
+    def prune(self, schema_hash: str) -> None:
+        """Drop entries compiled against any schema snapshot other than schema_hash."""
+        if schema_hash == self._schema_hash:
+            return
+        with self._lock:
+            if schema_hash == self._schema_hash:
+                return
+            self._schema_hash = schema_hash
+            self._mem = OrderedDict((k, v) for k, v in self._mem.items() if v["schema_hash"] == schema_hash)
+            cur = self._conn.execute(f"DELETE FROM {self.table} WHERE schema_hash != ?", (schema_hash,))
+            self._conn.commit()
+            self.stats["purged"] += max(cur.rowcount, 0)
+
+    def get(self, key: str) -> Optional[Tuple[Dict[str, Any], str]]:
+        """(stored value, "memory" | "disk") or None."""
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit is not None:
+                self._mem.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return hit["value"], "memory"
+            row = self._conn.execute(f"SELECT schema_hash, value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            value = json.loads(row[1])
+            self._remember(key, {"schema_hash": row[0], "value": value})
+            self._conn.execute(f"UPDATE {self.table} SET used_at = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.stats["disk_hits"] += 1
+            return value, "disk"
+
+    def put(self, key: str, schema_hash: str, value: Dict[str, Any]) -> None:
+        now = time.time()
+        with self._lock:
+            self._remember(key, {"schema_hash": schema_hash, "value": value})
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, schema_hash, value, created_at, used_at) VALUES (?,?,?,?,?)",
+                (key, schema_hash, json.dumps(value), now, now),
+            )
+            self.stats["stores"] += 1
+            if self.stats["stores"] % 256 == 0:
+                self._conn.execute(
+                    f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_rows,),
+                )
+            self._conn.commit()
+
+    def _remember(self, key: str, entry: Dict[str, Any]) -> None:
+        self._mem[key] = entry
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_memory:
+            self._mem.popitem(last=False)
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+            return {**self.stats, "memory_entries": len(self._mem), "disk_entries": rows}
@@ -5,10 +5,34 @@ class Settings(BaseSettings):
     DEFAULT_MODEL: str = "pacozaa/defog-llama3-sqlcoder-8b"
     ALLOWED_MODELS: str = "llama-3-sqlcoder-8b:latest,sqlcoder-best:latest,pacozaa/defog-llama3-sqlcoder-8b"
     SCHEMA_PATH: str = "./schema/schema.yaml"
+    # schema.yaml is checked for changes at most this often
+    SCHEMA_RELOAD_INTERVAL_S: float = 2.0
     SHOTS_PATH: str = "./schema/shots.yaml"
     LIMIT_MAX: int = 200
     LIMIT_MAX_CAP: int = 2000
     OLLAMA_TIMEOUT: float = 60.0
+    OLLAMA_MAX_CONNECTIONS: int = 16
+    # /nl2sql/compile-batch: max questions per request and max model calls in flight per batch
+    # (match OLLAMA_NUM_PARALLEL on the model server)
+    BATCH_MAX_ITEMS: int = 100
+    BATCH_CONCURRENCY: int = 4
+    # Hedged generation (opt-in): "off", "delay" (start the next model after HEDGE_DELAY_S without a
+    # valid result) or "fanout" (start all at once); up to HEDGE_MAX_MODELS models, in HEDGE_MODELS
+    # order (default: ALLOWED_MODELS order) after the requested one
+    HEDGE_MODE: str = "off"
+    HEDGE_DELAY_S: float = 3.0
+    HEDGE_MAX_MODELS: int = 2
+    HEDGE_MODELS: str = ""
+    # Validated SQL per (question, model, dialect, schema hash, prompt version)
+    COMPILE_CACHE_ENABLED: bool = True
+    COMPILE_CACHE_PATH: str = "./cache/compile.sqlite"
+    COMPILE_CACHE_MAX_MEMORY: int = 2048
+    COMPILE_CACHE_MAX_ROWS: int = 100000
+    # Parameterized templates (same question up to numbers/dates/status words), stored alongside
+    TEMPLATE_CACHE_ENABLED: bool = True
+    # Schema linking: at most this many tables per prompt; a table needs this score to be picked
+    SCHEMA_LINK_MAX_TABLES: int = 6
+    SCHEMA_LINK_MIN_SCORE: float = 1.5
 
     model_config = SettingsConfigDict(env_file=".env", env_prefix="", extra="ignore")
 
@@ -17,6 +41,16 @@ settings = Settings()
 def allowed_models() -> set[str]:
     return {m.strip() for m in settings.ALLOWED_MODELS.split(",") if m.strip()}
 
+def hedge_models(primary: str) -> list[str]:
+    """primary first, then the hedge candidates, at most HEDGE_MAX_MODELS."""
+    order = settings.HEDGE_MODELS or settings.ALLOWED_MODELS
+    allowed = allowed_models()
+    out = [primary]
+    for m in (m.strip() for m in order.split(",")):
+        if m and m in allowed and m not in out:
+            out.append(m)
+    return out[:max(1, settings.HEDGE_MAX_MODELS)]
+
 
 
 
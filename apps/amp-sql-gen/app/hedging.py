@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+# Hedged generation: race several models for one question and keep the first result that
+# validates. "delay" starts the next model only if the current ones have not produced a valid
+# result within delay_s (or all of them failed); "fanout" starts them all at once. Losers are
+# cancelled.
+
+class HedgeStats:
+    def __init__(self, window: int = 500):
+        self.window = window
+        self._lock = threading.Lock()
+        self._models: Dict[str, Dict[str, Any]] = {}
+        self.races = 0
+        self.hedged = 0  # races where more than one model was started
+
+    def _m(self, model: str) -> Dict[str, Any]:
+        m = self._models.get(model)
+        if m is None:
+            m = {"started": 0, "wins": 0, "invalid": 0, "errors": 0, "cancelled": 0,
+                 "latency_ms": deque(maxlen=self.window)}
+            self._models[model] = m
+        return m
+
+    def record(self, model: str, outcome: str, latency_ms: Optional[float] = None):
+        with self._lock:
+            m = self._m(model)
+            m[outcome] += 1
+            if latency_ms is not None and outcome in ("wins", "invalid"):
+                m["latency_ms"].append(latency_ms)
+
+    def race(self, started: int):
+        with self._lock:
+            self.races += 1
+            self.hedged += started > 1
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            models = {}
+            for name, m in self._models.items():
+                lat = sorted(m["latency_ms"])
+                models[name] = {
+                    **{k: v for k, v in m.items() if k != "latency_ms"},
+                    "win_rate": round(m["wins"] / m["started"], 4) if m["started"] else 0.0,
+                    "p50_ms": round(lat[len(lat) // 2]) if lat else None,
+                    "p95_ms": round(lat[min(len(lat) - 1, int(len(lat) * 0.95))]) if lat else None,
+                }
+            return {"races": self.races, "hedged": self.hedged, "models": models}
+
+stats = HedgeStats()
+
+async def race(models: List[str], run: Callable[[str], Awaitable[Any]], accept: Callable[[Any], bool],
+               mode: str = "delay", delay_s: float = 2.0) -> Tuple[str, Any]:
+    """
+    (model, result) of the first run(model) that accept()s. When none does, the first result
+    that did not raise is returned (in models order), else the first model's exception is raised.
+    """
+    pending: Dict[asyncio.Task, Tuple[str, float]] = {}
+    outcomes: Dict[str, Tuple[bool, Any]] = {}  # model -> (raised, result or exception)
+    queue = list(models)
+
+    def start_next():
+        model = queue.pop(0)
+        stats.record(model, "started")
+        pending[asyncio.ensure_future(run(model))] = (model, time.perf_counter())
+
+    start_next()
+    if mode == "fanout":
+        while queue:
+            start_next()
+    try:
+        while pending:
+            timeout = delay_s if queue else None
+            done, _ = await asyncio.wait(list(pending), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                start_next()  # slow: hedge with the next model
+                continue
+            for task in done:
+                model, t0 = pending.pop(task)
+                latency = (time.perf_counter() - t0) * 1000
+                exc = task.exception()
+                if exc is None and accept(task.result()):
+                    stats.record(model, "wins", latency)
+                    return model, task.result()
+                stats.record(model, "errors" if exc is not None else "invalid", latency)
+                outcomes[model] = (exc is not None, exc if exc is not None else task.result())
+            if not pending and queue:
+                start_next()  # everything in flight failed: try the next model right away
+    finally:
+        stats.race(len(models) - len(queue))
+        for task, (model, _) in pending.items():
+            task.cancel()
+            stats.record(model, "cancelled")
+    for model in models:
+        if model in outcomes and not outcomes[model][0]:
+            return model, outcomes[model][1]
+    _, exc = outcomes[next(m for m in models if m in outcomes)]
+    raise exc
@@ -0,0 +1,123 @@
+import math
+import re
+from collections import defaultdict, deque
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+# Question-aware schema linking: pick the tables a question is about (by table/column names,
+# descriptions and optional keywords from schema.yaml), add the join paths that connect them,
+# and render only that subset, so the prompt stays the same size as schema.yaml grows.
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "in", "on", "at", "to", "for", "by", "with", "from", "who",
+    "whose", "which", "what", "that", "this", "is", "are", "was", "were", "be", "been", "have", "has",
+    "had", "not", "no", "any", "all", "me", "my", "show", "list", "get", "find", "give", "their", "them",
+    "they", "than", "more", "less", "per", "each", "within", "last", "days", "day", "week", "month",
+    "year", "e", "g", "i", "s", "t",
+}
+
+# Where a question word can hit: table-name words count most, description words least
+_W_TABLE, _W_KEYWORD, _W_COLUMN, _W_DESC = 3.0, 3.0, 2.0, 1.0
+
+def _stem(tok: str) -> str:
+    if len(tok) > 4:
+        for suf in ("ing", "ed", "es", "s"):
+            if tok.endswith(suf) and len(tok) - len(suf) >= 3:
+                return tok[: -len(suf)]
+    return tok
+
+def tokenize(text: str) -> List[str]:
+    return [_stem(t) for t in _TOKEN_RE.findall(str(text).lower().replace("_", " ")) if t not in _STOPWORDS]
+
+class SchemaLinker:
+    def __init__(self, tables: List[Dict[str, Any]], joins: List[Tuple[str, str]],
+                 core_tables: Iterable[str] = (), max_tables: int = 6, min_score: float = 1.5):
+        self.tables = [t for t in tables if t.get("name")]
+        self.names = [t["name"] for t in self.tables]
+        self.core = [t for t in core_tables if t in self.names]
+        self.max_tables = max_tables
+        self.min_score = min_score
+        self.joins = joins
+        # adjacency list: table -> {neighbour table}
+        self.graph: Dict[str, Set[str]] = defaultdict(set)
+        for left, right in joins:
+            lt, rt = left.split(".", 1)[0], right.split(".", 1)[0]
+            if lt != rt:
+                self.graph[lt].add(rt)
+                self.graph[rt].add(lt)
+        # token -> {table: weight}, keeping the best place each token appears per table
+        self.index: Dict[str, Dict[str, float]] = defaultdict(dict)
+        for t in self.tables:
+            name = t["name"]
+            fields = [(_W_TABLE, [name]), (_W_KEYWORD, t.get("keywords") or []),
+                      (_W_COLUMN, t.get("columns") or []), (_W_DESC, [t.get("description") or ""])]
+            col_desc = t.get("columns_description")
+            if isinstance(col_desc, dict):
+                fields.append((_W_DESC, [str(v) for v in col_desc.values()]))
+            for weight, texts in fields:
+                for text in texts:
+                    for tok in tokenize(text):
+                        if self.index[tok].get(name, 0.0) < weight:
+                            self.index[tok][name] = weight
+        n = max(len(self.tables), 1)
+        # Tokens present in every table (id, created, user ...) carry no signal
+        self.idf = {tok: math.log((n + 1) / (len(hits) + 0.5)) - math.log((n + 1) / (n + 0.5))
+                    for tok, hits in self.index.items()}
+        self._prefix_keys = sorted(k for k in self.index if len(k) >= 5)
+
+    def score(self, question: str) -> Dict[str, float]:
+        scores: Dict[str, float] = defaultdict(float)
+        for tok in set(tokenize(question)):
+            matches = [(tok, 1.0)] if tok in self.index else []
+            if not matches and len(tok) >= 5:
+                # withdraw ~ withdrawal, deposit ~ deposited
+                matches = [(k, 0.5) for k in self._prefix_keys if k.startswith(tok) or tok.startswith(k)]
+            for key, factor in matches:
+                idf = self.idf.get(key, 0.0)
+                for table, weight in self.index[key].items():
+                    scores[table] += weight * idf * factor
+        return dict(scores)
+
+    def _path(self, src: str, targets: Set[str]) -> List[str]:
+        """Shortest join path from src to any table in targets (BFS over the join graph)."""
+        prev = {src: None}
+        queue = deque([src])
+        while queue:
+            cur = queue.popleft()
+            if cur in targets:
+                path = []
+                while cur is not None:
+                    path.append(cur)
+                    cur = prev[cur]
+                return path
+            for nxt in sorted(self.graph.get(cur, ())):
+                if nxt not in prev:
+                    prev[nxt] = cur
+                    queue.append(nxt)
+        return [src]
+
+    def link(self, question: str) -> List[str]:
+        """Relevant tables for question, connected through join paths, in schema order."""
+        scores = self.score(question)
+        ranked = sorted((t for t, s in scores.items() if s >= self.min_score), key=lambda t: (-scores[t], t))
+        if not ranked and not self.core:
+            ranked = sorted(scores, key=lambda t: (-scores[t], t)) or list(self.names)
+        selected: List[str] = list(self.core)
+        for table in ranked:
+            if table in selected:
+                continue
+            if len(selected) >= self.max_tables:
+                break
+            if selected:
+                path = [t for t in self._path(table, set(selected)) if t not in selected]
+            else:
+                path = [table]
+            if len(selected) + len(path) > self.max_tables:
+                continue
+            selected.extend(path)
+        chosen = set(selected)
+        return [n for n in self.names if n in chosen]
+
+    def joins_for(self, tables: Iterable[str]) -> List[Tuple[str, str]]:
+        chosen = set(tables)
+        return [(l, r) for l, r in self.joins if l.split(".", 1)[0] in chosen and r.split(".", 1)[0] in chosen]
@@ -1,6 +1,8 @@
+import hashlib
 import httpx
 import yaml
 import re
+from typing import Iterable, Optional
 from .config import settings
 from .move_join import move_joins_before_where
 
@@ -10,137 +12,9 @@ SYSTEM_PROMPT=("""
 You are an expert MySQL data analyst and SQL generator for MySQL database. Your job is to write highly accurate SQL query to answer my business request You must adhere strictly to MySQL syntax.
 
 Database Schema
-Below is the complete schema for our business network database. Carefully use these table structures, column definitions, and join relationships as the only valid source of truth when deriving JOINs and WHERE conditions.
-
-# Reference Table Structures (DDL Overview)
-## Use these DDLs as the authoritative source for data types, keys, and relationships.
-
-
-## Table: user_payran
-#### Main user table — The user_payran table serves as the core user profile and business activity record within the system
-
-CREATE TABLE user_payran (
-  id BIGINT UNSIGNED PRIMARY KEY COMMENT 'Primary identifier (bigint UNSIGNED).',
-  user_id BIGINT UNSIGNED COMMENT 'User identifier referenced by related tables (bigint UNSIGNED).',
-  member_id BIGINT UNSIGNED COMMENT 'Member reference ID (bigint UNSIGNED).',
-  sponsor_id BIGINT UNSIGNED COMMENT 'Direct sponsor’s user_id (bigint UNSIGNED).',
-  sponsor_ids TEXT COMMENT 'Serialized/upline chain (blob or text).',
-  personal_sponsor_id BIGINT UNSIGNED COMMENT 'Personal sponsor’s user_id (bigint UNSIGNED).',
-  personal_sponsor_ids TEXT COMMENT 'Serialized personal sponsor chain (blob or text).',
-  gender ENUM('male','female') COMMENT 'Gender of the user.',
-  birthdate DATE COMMENT 'Date of birth (date).',
-  status VARCHAR(32) COMMENT 'Account status: active, deleted, suspended, abandoned, lockout.',
-  rank TINYINT COMMENT 'User rank (tinyint).',
-  level TINYINT COMMENT 'Network depth level (tinyint).',
-  customer TINYINT COMMENT 'Customer type flag (tinyint).',
-  abv DECIMAL(64,24) COMMENT 'Accumulated Business Volume — represents the user’s own total purchase or sales value (personal sales).',
-  pgv DECIMAL(64,24) COMMENT 'Personal Group Volume — represents the total sales volume generated by the user’s direct downline members (group sales).',
-  qbv DECIMAL(64,24) COMMENT 'Qualification Business Volume — represents the sales volume used to determine the user’s qualification status.',
-  tsv DECIMAL(64,24) COMMENT 'Team Sales Volume — represents the combined total of the user’s personal sales (ABV) plus all downline members’ sales.',
-  wtsv DECIMAL(64,24) COMMENT 'Weekly Team Sales Volume — the total sales volume generated by the user and their downline within the current week.',
-  qualification_period_start DATE COMMENT 'Start date of qualification period (date).',
-  qualification_period_end DATE COMMENT 'End date of qualification period (date).',
-  kyc_status VARCHAR(255) COMMENT 'Indicates the current verification state of the user\'s KYC process Possible values include : approved, pending, submitted, dropped, rejected',
-  reg_site INT UNSIGNED COMMENT 'Registration source site (int UNSIGNED).',
-  created_at TIMESTAMP COMMENT 'Record creation timestamp.',
-  updated_at TIMESTAMP COMMENT 'Record update timestamp.',
-  registered_at TIMESTAMP COMMENT 'User registration timestamp.'
-);
-
-
-## Table: user_teamsite_license
-#### The user_teamsite_license table stores information about licenses or subscriptions assigned to users within the system.
-##### ‘Active license’ → end > NOW(); ‘Expired’ → end <= NOW().
-
-CREATE TABLE user_teamsite_license (
-  id BIGINT UNSIGNED PRIMARY KEY COMMENT 'Primary key (bigint UNSIGNED).',
-  user_id BIGINT UNSIGNED COMMENT 'FK → user_payran.user_id (bigint UNSIGNED).',
-  gift_code_id BIGINT UNSIGNED COMMENT 'Related gift code (bigint UNSIGNED).',
-  type INT COMMENT 'License type (int).',
-  start TIMESTAMP COMMENT 'Start timestamp.',
-  end TIMESTAMP COMMENT 'End/expiry timestamp.',
-  created_at TIMESTAMP COMMENT 'Created timestamp.',
-  updated_at TIMESTAMP COMMENT 'Updated timestamp.',
-  CONSTRAINT fk_user_teamsite_license_user FOREIGN KEY (user_id) REFERENCES user_payran(user_id)
-);
-
-
-## Table: member_paths
-#### The member_paths table defines the hierarchical structure of users, mapping relationships between uplines (ancestors) and downlines (descendants)
-
-CREATE TABLE member_paths (
-  ancestor_id INT COMMENT 'Ancestor/upline user_id (int).',
-  descendant_id INT COMMENT 'Descendant/downline user_id (int).',
-  depth INT COMMENT 'Distance between ancestor and descendant (0 = same user).',
-  CONSTRAINT fk_member_paths_ancestor FOREIGN KEY (ancestor_id) REFERENCES user_payran(user_id),
-  CONSTRAINT fk_member_paths_descendant FOREIGN KEY (descendant_id) REFERENCES user_payran(user_id)
-);
-
-
-## Table: deposits
-#### The deposits table records all deposit transactions made by users.
-
-CREATE TABLE deposits (
-  id BIGINT UNSIGNED PRIMARY KEY COMMENT 'Primary key (bigint UNSIGNED).',
-  user_id BIGINT UNSIGNED COMMENT 'FK → user_payran.user_id (bigint UNSIGNED).',
-  currency_id BIGINT UNSIGNED COMMENT 'Currency ID (bigint UNSIGNED).',
-  amount DECIMAL(64,2) COMMENT 'Deposit amount (decimal(64,2)).',
-  exchange_rate DECIMAL(64,20) COMMENT 'Exchange rate (decimal(64,20)).',
-  exchange_amount DECIMAL(64,2) COMMENT 'Converted amount (decimal(64,2)).',
-  account_type VARCHAR(64) COMMENT 'Source account type (varchar).',
-  business_name VARCHAR(255) COMMENT 'Business name/source (varchar).',
-  deposit_option_id BIGINT UNSIGNED COMMENT 'Deposit option ID (bigint UNSIGNED).',
-  status TINYINT COMMENT '0=pending, 1=approved, 2=rejected (tinyint).',
-  reference_no VARCHAR(191) COMMENT 'Reference number (varchar(191)).',
-  created_at TIMESTAMP COMMENT 'Created timestamp.',
-  updated_at TIMESTAMP COMMENT 'Updated timestamp.',
-  CONSTRAINT fk_deposits_user FOREIGN KEY (user_id) REFERENCES user_payran(user_id)
-);
-
-
-## Table: withdrawals
-#### The withdrawals table manages withdrawal requests and processing details for users.
-
-CREATE TABLE withdrawals (
-  id BIGINT UNSIGNED PRIMARY KEY COMMENT 'Primary key (bigint UNSIGNED).',
-  user_id BIGINT UNSIGNED COMMENT 'FK → user_payran.user_id (bigint UNSIGNED).',
-  wallet_id BIGINT UNSIGNED COMMENT 'Wallet/source ID (bigint UNSIGNED).',
-  amount DECIMAL(64,2) COMMENT 'Requested amount (decimal).',
-  withdrawal_fee DECIMAL(64,2) COMMENT 'Fee amount (decimal).',
-  received_amount DECIMAL(64,2) COMMENT 'Net received amount (decimal).',
-  blockchain VARCHAR(128) COMMENT 'Blockchain name if crypto (varchar).',
-  transaction_hash VARCHAR(255) COMMENT 'Blockchain tx hash (varchar).',
-  status TINYINT COMMENT '0=pending, 1=completed, 2=rejected… (tinyint).',
-  approved_by BIGINT UNSIGNED COMMENT 'Approver admin user (bigint UNSIGNED).',
-  pre_approved_by BIGINT UNSIGNED COMMENT 'Pre-approver admin user (bigint UNSIGNED).',
-  reference_no VARCHAR(191) COMMENT 'Reference (varchar(191)).',
-  created_at TIMESTAMP COMMENT 'Created timestamp.',
-  updated_at TIMESTAMP COMMENT 'Updated timestamp.',
-  CONSTRAINT fk_withdrawals_user FOREIGN KEY (user_id) REFERENCES user_payran(user_id)
-);
-
-
-## Table: users
-#### The users table contains login and session-related details for each account.
-
-CREATE TABLE users (
-  id BIGINT UNSIGNED PRIMARY KEY COMMENT 'Primary key (bigint UNSIGNED).',
-  external_id BIGINT UNSIGNED COMMENT 'External identifier (bigint UNSIGNED).',
-  last_login_at TIMESTAMP COMMENT 'Timestamp of the last login (timestamp).',
-  remember_token VARCHAR(191) COMMENT 'Remember token for the session (varchar(191)).',
-  created_at TIMESTAMP COMMENT 'Account creation timestamp.',
-  updated_at TIMESTAMP COMMENT 'Last account update timestamp.',
-  CONSTRAINT fk_users_user_payran FOREIGN KEY (id) REFERENCES user_payran(user_id)
-);
-
-## Table Relationships (Joins)
-
--member_paths.descendant_id = user_payran.id
--user_teamsite_license.user_id = user_payran.user_id
--users.id = user_payran.user_id
--deposits.user_id = user_payran.user_id
--withdrawals.user_id = user_payran.user_id
+Below is the part of our business network database schema relevant to this request. Carefully use these table structures, column definitions, and join relationships as the only valid source of truth when deriving JOINs and WHERE conditions.
 
+{SCHEMA}
 
 Base Query (Fixed Structure)
 
@@ -149,10 +23,7 @@ Always build on the following query skeleton. Only modify {{Additional CONDITION
 SELECT up.id, up.member_id, up.sponsor_id AS parentId, up.status, up.registered_at, up.rank, up.tsv, mp.depth
 FROM member_paths mp
 JOIN user_payran up ON up.id = mp.descendant_id
-LEFT JOIN users u ON u.id = up.user_id
-LEFT JOIN user_teamsite_license utl ON utl.user_id = up.user_id
-LEFT JOIN deposits d ON d.user_id = up.user_id
-LEFT JOIN withdrawals w ON w.user_id = up.user_id
+{BASE_JOINS}
 WHERE mp.ancestor_id = ? AND {{Additional CONDITION}};
 
 - GOAL  
@@ -168,6 +39,27 @@ Date/interval syntax (STRICT MySQL):
 - For other day counts, replace X with the integer; never quote the unit.   
 
 ###  Examples (schema-only reference)
+{EXAMPLES}
+
+Respond ONLY with:
+<SQL>
+[final SQL here]
+</SQL>
+               
+""")
+
+# Optional joins of the base query skeleton, by table; only tables linked to the question are listed
+BASE_JOINS = {
+    "users": "LEFT JOIN users u ON u.id = up.user_id",
+    "user_teamsite_license": "LEFT JOIN user_teamsite_license utl ON utl.user_id = up.user_id",
+    "deposits": "LEFT JOIN deposits d ON d.user_id = up.user_id",
+    "withdrawals": "LEFT JOIN withdrawals w ON w.user_id = up.user_id",
+}
+
+# (tables an example needs besides member_paths/user_payran, example text); an example is
+# shown only when all of its tables were linked to the question
+EXAMPLES = [
+    ({"users"}, """
 Example — Users not logged in within the last 7 days
 Query purpose: find downline users (for a given ancestor) who have not logged in during the past 7 days.
 Why the JOIN: users holds last_login_at, so we must JOIN users u ON u.id = up.user_id to access that column.
@@ -191,7 +83,8 @@ JOIN users u ON u.id = up.user_id
 WHERE mp.ancestor_id = ? AND (
   u.last_login_at < CURRENT_DATE - INTERVAL 7 DAY
 )
-
+"""),
+    (set(), """
 Example A — Uses only user_payran: Active users of rank >= 5
 -Query purpose: return downline users who are active and have rank >= 5.
 -Why NO extra JOIN: all needed columns (status, rank) are in user_payran (up), so no other tables required.
@@ -213,7 +106,8 @@ JOIN user_payran up ON up.id = mp.descendant_id
 WHERE mp.ancestor_id = ? AND (
   up.status = 'active' AND up.rank >= 5
 )
-
+"""),
+    (set(), """
 Example B — No filter possible from schema wording: Users who prefer dark mode
 Query purpose: placeholder for questions that cannot be expressed with the provided schema.
 Why (TRUE): the schema contains no column for “preference” or “dark mode”, so we must not guess — the safe fallback is WHERE ... AND (TRUE) (which returns the unfiltered downline).
@@ -232,8 +126,8 @@ SELECT
 FROM member_paths mp
 JOIN user_payran up ON up.id = mp.descendant_id
 WHERE mp.ancestor_id = ? AND (TRUE)
-
-
+"""),
+    ({"user_teamsite_license"}, """
 Example C — License required (INNER JOIN, schema-mapped): Users with an active license
 Query purpose: find downline users who have a currently active license.
 Why the JOIN: license details are in user_teamsite_license so we JOIN user_teamsite_license utl ON utl.user_id = up.user_id.
@@ -256,8 +150,8 @@ JOIN user_teamsite_license utl ON utl.user_id = up.user_id
 WHERE mp.ancestor_id = ? AND (
   utl.end > UTC_TIMESTAMP()
 )
-
-
+"""),
+    ({"deposits"}, """
 Example D — “Never deposited” (LEFT JOIN + absence): Users with no deposits ever
 Query purpose: find downline users who have no deposit records.
 Why LEFT JOIN: LEFT JOIN deposits dep ON dep.user_id = up.user_id lets us detect absence by checking dep.id IS NULL.
@@ -280,8 +174,8 @@ LEFT JOIN deposits dep ON dep.user_id = up.user_id
 WHERE mp.ancestor_id = ? AND (
   dep.id IS NULL
 )
-
-
+"""),
+    ({"withdrawals"}, """
 Example E — Withdrawals in last 30 days: Completed withdrawal in the last 30 days
 Query purpose: find downline users who completed a withdrawal within the past 30 days.
 Why the JOIN: withdrawal records are in withdrawals, so use JOIN withdrawals wd ON wd.user_id = up.user_id.
@@ -304,15 +198,15 @@ JOIN withdrawals wd ON wd.user_id = up.user_id
 WHERE mp.ancestor_id = ? AND (
   wd.status = 1 AND wd.created_at >= UTC_TIMESTAMP() - INTERVAL 30 DAY
 )
-               
-Example H — Users who didn’t purchase anything (LEFT JOIN + absence)
-Query purpose: find downline users who have no purchase records.
-Why the JOIN: purchase table stores user purchases, so we LEFT JOIN purchase p ON p.user_id = up.user_id and check for absence.
-Filter logic: p.id IS NULL — means no purchase row exists for that user.
-
-Task: Users who didn’t purchase anything
-
-Desired query:
+"""),
+    ({"deposits"}, """
+Example H — No approved deposit (LEFT JOIN + absence, filter in ON): Users without an approved deposit
+Query purpose: find downline users who have no approved deposit (pending or rejected deposits do not count).
+Why LEFT JOIN: LEFT JOIN deposits dep ON dep.user_id = up.user_id AND dep.status = 1 matches only approved deposits, so users with none keep a NULL row.
+Filter logic: dep.id IS NULL — status 1 means approved (per schema); the status check sits in the ON clause, not in WHERE, or the absence test would never match.
+In Example H  No approved deposit (LEFT JOIN + absence, filter in ON):
+Task: Users without an approved deposit
+desired query :-
 SELECT
   up.id,
   up.member_id,
@@ -324,21 +218,34 @@ SELECT
   mp.depth
 FROM member_paths mp
 JOIN user_payran up ON up.id = mp.descendant_id
-LEFT JOIN purchase p ON p.user_id = up.user_id
-WHERE mp.ancestor_id = ? AND p.id IS NULL;
-             
-Respond ONLY with:
-<SQL>
-[final SQL here]
-</SQL>
-               
-""")
-
-
-def build_messages(question: str, dialect: str, schema_text: str):
+LEFT JOIN deposits dep ON dep.user_id = up.user_id AND dep.status = 1
+WHERE mp.ancestor_id = ? AND (
+  dep.id IS NULL
+)
+"""),
+]
+
+# Part of the compile cache key: any edit to the prompt, examples or generation options
+# makes previously cached SQL unreachable
+GEN_OPTIONS = {"temperature": 0, "num_ctx": 4048, "num_predict": 256}
+PROMPT_VERSION = hashlib.sha256(
+    (SYSTEM_PROMPT + repr(BASE_JOINS) + repr(EXAMPLES) + repr(sorted(GEN_OPTIONS.items()))).encode("utf-8")
+).hexdigest()[:12]
+
+def build_messages(question: str, dialect: str, schema_text: str, tables: Optional[Iterable[str]] = None):
+    """
+    schema_text is the linked schema block; tables (the linked table names) also select the
+    skeleton joins and examples to show. tables=None keeps every join and example.
+    """
+    linked = set(tables) if tables is not None else None
+    joins = [j for t, j in BASE_JOINS.items() if linked is None or t in linked]
+    examples = [e.strip() for need, e in EXAMPLES if linked is None or need <= linked]
     sys = SYSTEM_PROMPT.format(
         DIALECT=dialect,
-        QUESTION=question
+        QUESTION=question,
+        SCHEMA=schema_text,
+        BASE_JOINS="\n".join(joins),
+        EXAMPLES="\n\n".join(examples),
     )
     user = f"Task: {question}"
     return [
@@ -346,27 +253,43 @@ def build_messages(question: str, dialect: str, schema_text: str):
         {"role": "user", "content": user},
     ]
 
-async def generate_sql(model: str, question: str, dialect: str, schema_text: str) -> str:
+# One pooled client for all requests: batches and concurrent compiles reuse keep-alive connections
+_client: Optional[httpx.AsyncClient] = None
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=settings.OLLAMA_BASE_URL,
+            timeout=settings.OLLAMA_TIMEOUT,
+            limits=httpx.Limits(max_connections=settings.OLLAMA_MAX_CONNECTIONS,
+                                max_keepalive_connections=settings.OLLAMA_MAX_CONNECTIONS),
+        )
+    return _client
+
+async def aclose() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+async def generate_sql(model: str, question: str, dialect: str, schema_text: str,
+                       tables: Optional[Iterable[str]] = None) -> str:
     payload = {
         "model": model,
-        "messages": build_messages(question, dialect, schema_text),
+        "messages": build_messages(question, dialect, schema_text, tables),
         "stream": False,
         # Keep responses tight and predictable
-        "options": {
-            "temperature": 0,
-            "num_ctx": 4048,
-            "num_predict": 256
-        },
+        "options": dict(GEN_OPTIONS),
         # Keep the model hot between calls
         "keep_alive": "15m",
     }
 
     # print( payload.get('messages') )
 
-    async with httpx.AsyncClient(base_url=settings.OLLAMA_BASE_URL, timeout=settings.OLLAMA_TIMEOUT) as client:
-        r = await client.post("/api/chat", json=payload)
-        r.raise_for_status()
-        data = r.json()
+    r = await _get_client().post("/api/chat", json=payload)
+    r.raise_for_status()
+    data = r.json()
     content = (data.get("message") or {}).get("content", "")
 
     #content = normalize_sql( content )
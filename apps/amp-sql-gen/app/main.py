@@ -1,35 +1,68 @@
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
-from typing import Optional, Dict, Any
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, List, Literal, Tuple
 from . import __version__
-from .config import settings, allowed_models
-from .schema import SchemaRegistry
+from .config import settings, allowed_models, hedge_models
+from .schema import SchemaRegistry, SchemaSnapshot
+from .cache import CompileCache, cache_key, normalize_question
+from .templates import TemplateCache
+from . import hedging
 from .validator import validate_sql
-from .llm import generate_sql
+from .llm import generate_sql, PROMPT_VERSION, aclose as close_llm_client
 from .postproc import extract_sql
+import asyncio
 import httpx
+import json
+import time
 import traceback
 
-app = FastAPI(title="Amp_SQL_Gen", version=__version__)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await close_llm_client()
 
-schema = SchemaRegistry(settings.SCHEMA_PATH)
+app = FastAPI(title="Amp_SQL_Gen", version=__version__, lifespan=lifespan)
+
+schema = SchemaRegistry(settings.SCHEMA_PATH, link_max_tables=settings.SCHEMA_LINK_MAX_TABLES,
+                        link_min_score=settings.SCHEMA_LINK_MIN_SCORE,
+                        check_interval_s=settings.SCHEMA_RELOAD_INTERVAL_S)
+
+compile_cache = CompileCache(settings.COMPILE_CACHE_PATH, max_memory=settings.COMPILE_CACHE_MAX_MEMORY,
+                             max_rows=settings.COMPILE_CACHE_MAX_ROWS) if settings.COMPILE_CACHE_ENABLED else None
+template_cache = TemplateCache(settings.COMPILE_CACHE_PATH) if settings.TEMPLATE_CACHE_ENABLED else None
+# Prune entries of older schemas only when a new snapshot is installed: in-flight requests may
+# still hold (and cache under) the previous one
+for _cache in (compile_cache, template_cache):
+    if _cache is not None:
+        schema.subscribe(lambda snap, c=_cache: c.prune(snap.hash))
 
 class CompileRequest(BaseModel):
     question: str = Field(..., min_length=3, description="Natural language question/task")
     dialect: Optional[str] = Field(default=None, description="SQL dialect eg. 'mysql'")
     model: Optional[str] = Field(default=None, description="Model tag, e.g., 'llama-3-sqlcoder-8b:latest'")
+    hedge: Optional[Literal["off", "delay", "fanout"]] = Field(default=None, description="Race other allowed models (default HEDGE_MODE)")
+
+class CompileBatchRequest(BaseModel):
+    items: List[CompileRequest] = Field(..., min_length=1, description="Questions, each with its own model/dialect")
+    concurrency: Optional[int] = Field(default=None, ge=1, description="Model calls in flight (capped at BATCH_CONCURRENCY)")
 
 class CompileResponse(BaseModel):
     sql: str
     model: str
     validators: Dict[str, Any]
     explanation: Optional[str] = None
+    cache: str = Field(default="miss", description="'memory' / 'disk' when served from the compile cache, "
+                                                   "'template' when filled from a cached SQL template, 'miss', or 'off'")
 
 @app.get("/healthz")
 async def healthz():
-    schema.reload_if_changed()
-    return {"status": "ok test", "service": "Amp_SQL_Gen", "version": __version__}
+    return {"status": "ok test", "service": "Amp_SQL_Gen", "version": __version__,
+            "schema_hash": schema.current().hash,
+            "compile_cache": compile_cache.info() if compile_cache is not None else None,
+            "template_cache": template_cache.info() if template_cache is not None else None,
+            "hedging": hedging.stats.info()}
 
 @app.get("/version")
 async def version():
@@ -37,29 +70,29 @@ async def version():
 
 @app.get("/schema")
 async def schema_info():
-    schema.reload_if_changed()
-    return {"path": settings.SCHEMA_PATH, "dialect": schema.dialect, "tables": sorted(schema.tables)}
+    snap = schema.current()
+    return {"path": settings.SCHEMA_PATH, "dialect": snap.dialect, "tables": sorted(snap.tables), "hash": snap.hash}
 
-@app.post("/nl2sql/compile", response_model=CompileResponse)
-async def nl2sql_compile(body: CompileRequest):
-    schema.reload_if_changed()
-
-    mdl = (body.model or settings.DEFAULT_MODEL).strip()
-    if mdl not in allowed_models():
-        raise HTTPException(status_code=400, detail=f"Unsupported model. Allowed: {', '.join(sorted(allowed_models()))}")
+def _validated_ok(v: Dict[str, Any]) -> bool:
+    return bool(v.get("parse_ok") and v.get("select_only") and v.get("tables_ok"))
 
-    dialect = (body.dialect or schema.dialect or "mysql").lower()
-    # limit_max = settings.LIMIT_MAX
+async def _generate(question: str, mdl: str, dialect: str, snap: SchemaSnapshot) -> Tuple[str, Dict[str, Any]]:
+    """One model generation: linked prompt -> raw output -> extracted SQL -> validators."""
+    # Only the tables the question is about (plus the joins between them) go into the prompt
+    linked_tables, schema_text = snap.link(question)
     try:
         print("sql")
         raw = await generate_sql(
             model=mdl,
-            question=body.question,
+            question=question,
             dialect=dialect,
-            schema_text=schema.render_for_prompt(),
+            schema_text=schema_text,
+            tables=linked_tables,
         )
         if not raw:
             raise HTTPException(status_code=502, detail="Empty output from model.")
+    except HTTPException:
+        raise
     except httpx.HTTPStatusError as e:
         status = e.response.status_code if e.response else "N/A"
         preview = e.response.text[:500] if e.response else ""
@@ -73,16 +106,129 @@ async def nl2sql_compile(body: CompileRequest):
     if not sql:
         raise HTTPException(status_code=502, detail="Failed to extract SQL from model output.")
 
-    v = validate_sql(sql, dialect=dialect, allowed_tables=schema.tables)
+    v = validate_sql(sql, dialect=dialect, allowed_tables=snap.tables)
     if v.get("parse_ok") and not v.get("limit_ok") and v.get("select_only", False):
         candidate = sql.rstrip().rstrip(";")
-        v2 = validate_sql(candidate, dialect=dialect, allowed_tables=schema.tables)
+        v2 = validate_sql(candidate, dialect=dialect, allowed_tables=snap.tables)
         if v2.get("parse_ok") and v2.get("limit_ok"):
             sql = candidate
             v = v2
+    return sql, v
+
+async def _compile(question: str, model: Optional[str], dialect: Optional[str], snap: SchemaSnapshot,
+                   gate: Optional[asyncio.Semaphore] = None, hedge: Optional[str] = None) -> CompileResponse:
+    """Cache -> template -> model(s). gate, if given, bounds the model calls (cache hits skip it)."""
+    mdl = (model or settings.DEFAULT_MODEL).strip()
+    if mdl not in allowed_models():
+        raise HTTPException(status_code=400, detail=f"Unsupported model. Allowed: {', '.join(sorted(allowed_models()))}")
+
+    dialect = (dialect or snap.dialect or "mysql").lower()
+    # limit_max = settings.LIMIT_MAX
+
+    mode = hedge or settings.HEDGE_MODE
+    models = hedge_models(mdl) if mode in ("delay", "fanout") else [mdl]
+
+    # Cached SQL is keyed on the model that wrote it and served only to requests whose
+    # candidates include that model (requested model first)
+    def key_for(m: str) -> str:
+        return cache_key(question, m, dialect, snap.hash, PROMPT_VERSION)
+
+    if compile_cache is not None:
+        for m in models:
+            hit = compile_cache.get(key_for(m))
+            if hit:
+                value, source = hit
+                return CompileResponse(**value, cache=source)
 
     explanation = None
-    return CompileResponse(sql=sql, model=mdl, validators=v, explanation=explanation)
+    if template_cache is not None:
+        # Same question up to its literals: substitute them into the cached AST and re-validate.
+        # Templates are stored under the model that wrote the SQL; a hedged request accepts any
+        # of its candidates' (requested model first), as the race itself would.
+        for m in models:
+            filled = template_cache.lookup(question, snap.value_words, m, dialect, snap.hash, PROMPT_VERSION)
+            if not filled:
+                continue
+            v = validate_sql(filled, dialect=dialect, allowed_tables=snap.tables)
+            if _validated_ok(v):
+                if compile_cache is not None:
+                    compile_cache.put(key_for(m), snap.hash, {"sql": filled, "model": m, "validators": v, "explanation": explanation})
+                return CompileResponse(sql=filled, model=m, validators=v, explanation=explanation, cache="template")
+
+    async def run(m: str) -> Tuple[str, Dict[str, Any]]:
+        if gate is None:
+            return await _generate(question, m, dialect, snap)
+        async with gate:
+            return await _generate(question, m, dialect, snap)
+
+    if len(models) > 1:
+        # First candidate that validates wins; the rest are cancelled
+        winner, (sql, v) = await hedging.race(models, run, lambda r: _validated_ok(r[1]),
+                                              mode=mode, delay_s=settings.HEDGE_DELAY_S)
+    else:
+        winner = mdl
+        sql, v = await run(mdl)
+
+    if _validated_ok(v):
+        if compile_cache is not None:
+            compile_cache.put(key_for(winner), snap.hash, {"sql": sql, "model": winner, "validators": v, "explanation": explanation})
+        if template_cache is not None:
+            template_cache.learn(question, snap.value_words, sql, winner, dialect, snap.hash, PROMPT_VERSION)
+    return CompileResponse(sql=sql, model=winner, validators=v, explanation=explanation,
+                           cache="miss" if compile_cache is not None else "off")
+
+@app.post("/nl2sql/compile", response_model=CompileResponse)
+async def nl2sql_compile(body: CompileRequest):
+    # One snapshot for the whole request, even if schema.yaml is reloaded meanwhile
+    return await _compile(body.question, body.model, body.dialect, schema.current(), hedge=body.hedge)
+
+@app.post("/nl2sql/compile-batch")
+async def nl2sql_compile_batch(body: CompileBatchRequest):
+    """
+    NDJSON, one line per item in completion order: {"index", "question", "ok", ...CompileResponse}
+    or {"index", "question", "ok": false, "error": {"status", "detail"}}, then a {"summary"} line.
+    Identical items (normalized question, model, dialect, hedge mode) are compiled once.
+    """
+    if len(body.items) > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Too many items (max {settings.BATCH_MAX_ITEMS}).")
+    snap = schema.current()
+    groups: Dict[Tuple[str, str, str, str], List[int]] = {}
+    for i, item in enumerate(body.items):
+        mdl = (item.model or settings.DEFAULT_MODEL).strip()
+        dialect = (item.dialect or snap.dialect or "mysql").lower()
+        hedge = item.hedge or settings.HEDGE_MODE
+        groups.setdefault((normalize_question(item.question), mdl, dialect, hedge), []).append(i)
+    gate = asyncio.Semaphore(min(body.concurrency or settings.BATCH_CONCURRENCY, settings.BATCH_CONCURRENCY))
+
+    async def run(indexes: List[int]) -> Tuple[List[int], Dict[str, Any]]:
+        item = body.items[indexes[0]]
+        try:
+            res = await _compile(item.question, item.model, item.dialect, snap, gate, hedge=item.hedge)
+            return indexes, {"ok": True, **res.model_dump()}
+        except HTTPException as e:
+            return indexes, {"ok": False, "error": {"status": e.status_code, "detail": e.detail}}
+        except Exception as e:
+            print("BATCH ITEM ERROR:", e)
+            return indexes, {"ok": False, "error": {"status": 502, "detail": f"Unhandled error: {e.__class__.__name__}"}}
+
+    async def lines():
+        start = time.perf_counter()
+        tasks = [asyncio.create_task(run(indexes)) for indexes in groups.values()]
+        failed = 0
+        try:
+            for fut in asyncio.as_completed(tasks):
+                indexes, out = await fut
+                failed += 0 if out["ok"] else len(indexes)
+                for i in indexes:
+                    yield json.dumps({"index": i, "question": body.items[i].question, **out}, default=str) + "\n"
+            yield json.dumps({"summary": {"items": len(body.items), "unique": len(groups), "failed": failed,
+                                          "elapsed_ms": int((time.perf_counter() - start) * 1000)}}) + "\n"
+        finally:
+            # client went away: stop generating for the rest
+            for t in tasks:
+                t.cancel()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 @app.exception_handler(Exception)
 async def unhandled_exception(request: Request, exc: Exception):
@@ -1,84 +1,201 @@
+import hashlib
 import os
-from typing import Any, Dict, List, Set, Tuple
+import re
+import threading
+import time
+from types import MappingProxyType
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Mapping, Optional, Tuple
 import yaml
+from .linking import SchemaLinker
+
+class SchemaSnapshot:
+    """
+    One parsed version of schema.yaml, never modified after construction: readers hold a
+    reference for the whole request while a reload builds and swaps in a new snapshot.
+    """
+    __slots__ = ("dialect", "timezone", "tables", "tables_lower", "columns", "joins", "graph",
+                 "hash", "prompt_text", "value_words", "_blocks", "_linker")
+
+    def __init__(self, data: Dict[str, Any], raw: bytes, link_max_tables: int = 6, link_min_score: float = 1.5):
+        table_defs = [t for t in data.get("tables", []) if t.get("name")]
+        joins = []
+        for j in data.get("joins", []):
+            left = j.get("left")
+            right = j.get("right")
+            if left and right:
+                joins.append((left, right))
+        self.dialect: str = str(data.get("dialect", "mysql")).lower()
+        self.timezone: str = str(data.get("timezone", "UTC"))
+        self.tables: FrozenSet[str] = frozenset(t["name"] for t in table_defs)
+        self.tables_lower: FrozenSet[str] = frozenset(t.lower() for t in self.tables)
+        # lowercase table -> lowercase column names
+        self.columns: Mapping[str, FrozenSet[str]] = MappingProxyType({
+            t["name"].lower(): frozenset(str(c).lower() for c in t.get("columns", [])) for t in table_defs
+        })
+        self.joins: Tuple[Tuple[str, str], ...] = tuple(joins)
+        # enumerated column values named in columns_description (active, pending, male ...) ->
+        # the lowercase (table, column) pairs that hold them
+        self.value_words: Mapping[str, FrozenSet[Tuple[str, str]]] = _value_words(table_defs)
+        self.hash: str = hashlib.sha256(raw).hexdigest()[:16]
+        self._linker = SchemaLinker(table_defs, joins, core_tables=data.get("core_tables") or [],
+                                    max_tables=link_max_tables, min_score=link_min_score)
+        # adjacency list over the joins: table -> neighbour tables
+        self.graph: Mapping[str, FrozenSet[str]] = MappingProxyType(
+            {t: frozenset(n) for t, n in self._linker.graph.items()})
+        # Per-table prompt lines, rendered once; a linked subset just picks blocks
+        self._blocks: Mapping[str, str] = MappingProxyType({t["name"]: _render_table(t) for t in table_defs})
+        self.prompt_text: str = self._render(None)
+
+    def _render(self, only: Optional[FrozenSet[str]]) -> str:
+        lines: List[str] = [
+            f"dialect: {self.dialect}",
+            f"timezone: {self.timezone}",
+            "tables:",
+        ]
+        lines.extend(block for name, block in self._blocks.items() if only is None or name in only)
+        joins = self.joins if only is None else self._linker.joins_for(only)
+        if joins:
+            lines.append("joins:")
+            for left, right in joins:
+                lines.append(f"  - {left} = {right}")
+        return "\n".join(lines)
+
+    def render_for_prompt(self, tables: Optional[Iterable[str]] = None) -> str:
+        """Schema text for the prompt; only the given tables (and joins among them) if passed."""
+        if tables is None:
+            return self.prompt_text
+        return self._render(frozenset(tables))
+
+    def link(self, question: str) -> Tuple[List[str], str]:
+        """Tables relevant to question (plus the joins connecting them) and their prompt text."""
+        tables = self._linker.link(question)
+        return tables, self.render_for_prompt(tables)
+
+_CODE_RE = re.compile(r"\b\d+\s*=\s*([a-z][a-z_]*)")
+_QUOTED_RE = re.compile(r"'([a-z][a-z_]*)'")
+_PAREN_RE = re.compile(r"\([^)]*\)")
+_WORD_RE = re.compile(r"[a-z][a-z_]*")
+
+def _value_words(table_defs: List[Dict[str, Any]]) -> Mapping[str, FrozenSet[Tuple[str, str]]]:
+    words: Dict[str, set] = {}
+    for t in table_defs:
+        col_desc = t.get("columns_description")
+        if not isinstance(col_desc, dict):
+            continue
+        for col, text in col_desc.items():
+            text = str(text).lower()
+            found = set(_QUOTED_RE.findall(text))
+            codes = _CODE_RE.findall(text)  # "0=pending, 1=approved, 2=rejected"
+            if len(codes) >= 2:
+                found.update(codes)
+            # "Account status: active, deleted, suspended (varchar)."
+            for segment in text.split(":")[1:]:
+                items = [i.strip(" .") for i in _PAREN_RE.sub("", segment).split(",")]
+                if len(items) >= 2 and all(_WORD_RE.fullmatch(i) for i in items):
+                    found.update(items)
+            for word in found:
+                words.setdefault(word, set()).add((t["name"].lower(), str(col).lower()))
+    return MappingProxyType({w: frozenset(cols) for w, cols in words.items()})
+
+def _render_table(t: Dict[str, Any]) -> str:
+    name = t["name"]
+    cols = t.get("columns", [])
+    desc = t.get("description")  # optional table-level description
+    col_desc = t.get("columns_description", {})  # optional dict
+
+    # Always keep the single-line columns output
+    joined_cols = ", ".join(str(c) for c in cols)
+    lines = [f"  - {name}({joined_cols})"]
+
+    # Add table description if provided
+    if desc:
+        lines.append(f"    # {desc}")
+
+    # Add each column description if present
+    if isinstance(col_desc, dict):
+        for col_name, col_text in col_desc.items():
+            safe_text = str(col_text).replace("\n", " ")  # remove any hard line breaks
+            lines.append(f"    # {col_name}: {safe_text}")
+    return "\n".join(lines)
 
 class SchemaRegistry:
-    def __init__(self, path: str):
+    """
+    Holds the current SchemaSnapshot. schema.yaml is stat'ed at most once per check_interval_s;
+    a changed file is parsed into a new snapshot and swapped in with a single assignment.
+    """
+
+    def __init__(self, path: str, link_max_tables: int = 6, link_min_score: float = 1.5,
+                 check_interval_s: float = 2.0):
         self.path = path
+        self.link_max_tables = link_max_tables
+        self.link_min_score = link_min_score
+        self.check_interval_s = check_interval_s
+        self._snapshot = SchemaSnapshot({}, b"", link_max_tables, link_min_score)
         self._mtime = 0.0
-        self._data: Dict[str, Any] = {}
-        self._tables: Set[str] = set()
-        self._joins: List[Tuple[str, str]] = []
-        self._dialect = "mysql"
-        self._timezone = "UTC"
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[SchemaSnapshot], None]] = []
         self.reload_if_changed(force=True)
 
+    def subscribe(self, fn: Callable[[SchemaSnapshot], None]) -> None:
+        """Call fn(snapshot) with the current snapshot now and with every new one swapped in."""
+        self._listeners.append(fn)
+        fn(self._snapshot)
+
+    def current(self) -> SchemaSnapshot:
+        """The snapshot to use for one request (checks the file if the interval has passed)."""
+        if time.monotonic() >= self._next_check:
+            self.reload_if_changed()
+        return self._snapshot
+
     @property
     def dialect(self) -> str:
-        return self._dialect
+        return self.current().dialect
 
     @property
     def timezone(self) -> str:
-        return self._timezone
+        return self.current().timezone
 
     @property
-    def tables(self) -> Set[str]:
-        return self._tables
+    def tables(self) -> FrozenSet[str]:
+        return self.current().tables
 
     def reload_if_changed(self, force: bool = False) -> None:
-        try:
-            mtime = os.path.getmtime(self.path)
-        except FileNotFoundError:
+        # One reloader at a time; concurrent callers keep reading the current snapshot
+        if not self._lock.acquire(blocking=force):
             return
-        if force or mtime != self._mtime:
-            with open(self.path, "r", encoding="utf-8") as f:
-                data = yaml.safe_load(f) or {}
-            self._data = data
+        try:
+            self._next_check = time.monotonic() + self.check_interval_s
+            try:
+                mtime = os.path.getmtime(self.path)
+            except FileNotFoundError:
+                return
+            if not force and mtime == self._mtime:
+                return
             self._mtime = mtime
-            self._dialect = str(data.get("dialect", "mysql")).lower()
-            self._timezone = str(data.get("timezone", "UTC"))
-            self._tables = {t.get("name") for t in data.get("tables", []) if t.get("name")}
-            self._joins = []
-            for j in data.get("joins", []):
-                left = j.get("left")
-                right = j.get("right")
-                if left and right:
-                    self._joins.append((left, right))
-
-    def render_for_prompt(self) -> str:
-    
-        lines: List[str] = [
-            f"dialect: {self._dialect}",
-            f"timezone: {self._timezone}",
-            "tables:",
-        ]
+            with open(self.path, "rb") as f:
+                raw = f.read()
+            old = self._snapshot
+            if not force and hashlib.sha256(raw).hexdigest()[:16] == old.hash:
+                return  # touched, not changed
+            try:
+                data = yaml.safe_load(raw.decode("utf-8")) or {}
+            except yaml.YAMLError as e:
+                if force:
+                    raise
+                print(f"schema reload failed, keeping {old.hash}: {e}")
+                return
+            self._snapshot = SchemaSnapshot(data, raw, self.link_max_tables, self.link_min_score)
+            for fn in self._listeners:
+                try:
+                    fn(self._snapshot)
+                except Exception as e:
+                    print(f"schema listener failed: {e.__class__.__name__}: {e}")
+        finally:
+            self._lock.release()
 
-        for t in self._data.get("tables", []):
-            name = t.get("name")
-            cols = t.get("columns", [])
-            desc = t.get("description")  # optional table-level description
-            col_desc = t.get("columns_description", {})  # optional dict
+    def link(self, question: str) -> Tuple[List[str], str]:
+        return self.current().link(question)
 
-            if not name:
-                continue
-
-            # Always keep the single-line columns output
-            joined_cols = ", ".join(cols)
-            lines.append(f"  - {name}({joined_cols})")
-
-            # Add table description if provided
-            if desc:
-                lines.append(f"    # {desc}")
-
-            # Add each column description if present
-            if isinstance(col_desc, dict):
-                for col_name, col_text in col_desc.items():
-                    safe_text = str(col_text).replace("\n", " ")  # remove any hard line breaks
-                    lines.append(f"    # {col_name}: {safe_text}")
-
-        if self._joins:
-            lines.append("joins:")
-            for left, right in self._joins:
-                lines.append(f"  - {left} = {right}")
-
-        return "\n".join(lines)
+    def render_for_prompt(self, tables: Optional[Iterable[str]] = None) -> str:
+        return self.current().render_for_prompt(tables)
@@ -0,0 +1,244 @@
+import hashlib
+import itertools
+import re
+import threading
+from collections import OrderedDict
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, FrozenSet, Iterable, List, Mapping, NamedTuple, Optional, Tuple
+import sqlglot
+from sqlglot import exp
+from .cache import CompileCache, normalize_question
+from .validator import sqlglot_dialect
+
+# Parameterized templates: "top 5 users by tsv in the last 30 days" and "top 10 users by tsv in
+# the last 7 days" share the skeleton "top <num> users by tsv in the last <num> days". The first
+# validated compile is parsed with sqlglot, the question's literals are bound to the SQL literal
+# nodes holding the same values (typed slots), and later questions with the same skeleton get
+# their literals substituted into a copy of the AST instead of a model call. A status slot is
+# tied to the column it is compared with, and only takes words enumerated for that column.
+
+_LITERAL_RE = re.compile(
+    r"(?P<date>\b\d{4}-\d{2}-\d{2}\b)"
+    r"|(?P<num>(?<![\w.])\d+(?:\.\d+)?(?![\w.]))"
+    r"|(?P<word>\b[a-z][a-z_]*\b)"
+)
+_RANK_WORDS = {"rank", "level"}
+_MAX_STATUS_SPLIT = 3
+
+ValueWords = Mapping[str, FrozenSet[Tuple[str, str]]]  # word -> {(table, column)}
+
+class Literal(NamedTuple):
+    kind: str  # "num" | "rank" | "date" | "status"
+    value: str
+
+def extract_literals(question: str, value_words: ValueWords) -> Tuple[List[Any], List[Literal]]:
+    """
+    Split the normalized question into text and literal indexes: numbers (typed "rank" right
+    after rank/level), ISO dates, and status words known from the schema's column descriptions.
+    """
+    q = normalize_question(question)
+    parts: List[Any] = []
+    lits: List[Literal] = []
+    pos, prev_word = 0, ""
+    for m in _LITERAL_RE.finditer(q):
+        if m.group("word"):
+            word = m.group("word")
+            if word not in value_words:
+                prev_word = word
+                continue
+            lit = Literal("status", word)
+        elif m.group("date"):
+            lit = Literal("date", m.group("date"))
+        else:
+            lit = Literal("rank" if prev_word in _RANK_WORDS else "num", m.group("num"))
+        parts.append(q[pos:m.start()])
+        parts.append(len(lits))
+        lits.append(lit)
+        pos, prev_word = m.end(), ""
+    parts.append(q[pos:])
+    return parts, lits
+
+def skeleton(parts: List[Any], lits: List[Literal], inline: Iterable[int] = ()) -> str:
+    """Question text with literals replaced by <kind>; literals in inline keep their text."""
+    inline = set(inline)
+    out = []
+    for p in parts:
+        if isinstance(p, int):
+            out.append(lits[p].value if p in inline else f"<{lits[p].kind}>")
+        else:
+            out.append(p)
+    return "".join(out)
+
+def _inline_choices(lits: List[Literal]) -> List[Tuple[int, ...]]:
+    """
+    Status words only become slots when the SQL holds them as string literals ("active"), not
+    when they map to codes ("pending" -> status = 0); a lookup tries each split, all-slots first.
+    """
+    status = [i for i, lit in enumerate(lits) if lit.kind == "status"]
+    if len(status) > _MAX_STATUS_SPLIT:
+        return [(), tuple(status)]
+    combos = itertools.chain.from_iterable(itertools.combinations(status, n) for n in range(len(status) + 1))
+    return list(combos)
+
+def _same_value(lit: Literal, node: exp.Literal) -> bool:
+    if lit.kind in ("num", "rank"):
+        try:
+            return Decimal(lit.value) == Decimal(str(node.this))
+        except InvalidOperation:
+            return False
+    return node.is_string and str(node.this).lower() == lit.value
+
+def _literal_nodes(expr: exp.Expression) -> List[exp.Literal]:
+    return list(expr.find_all(exp.Literal))
+
+def _compared_columns(node: exp.Literal, aliases: Dict[str, str]) -> FrozenSet[Tuple[str, str]]:
+    """(table, column) pairs the literal may be compared with (col = 'x', col <> 'x', col IN (...))."""
+    parent = node.parent
+    if isinstance(parent, exp.In) and node is not parent.this:
+        col = parent.this
+    elif isinstance(parent, (exp.EQ, exp.NEQ)):
+        col = parent.left if parent.right is node else parent.right
+    else:
+        return frozenset()
+    if not isinstance(col, exp.Column):
+        return frozenset()
+    name = col.name.lower()
+    if col.table:
+        table = aliases.get(col.table.lower())
+        return frozenset([(table, name)]) if table else frozenset()
+    return frozenset((table, name) for table in set(aliases.values()))
+
+def bind_slots(sql: str, dialect: str, lits: List[Literal], value_words: ValueWords
+               ) -> Optional[Tuple[Tuple[int, ...], List[Tuple[int, int]], List[Optional[Tuple[str, str]]]]]:
+    """
+    (inlined status literal indexes, [(literal index, SQL literal node index)], column of each
+    slot (status slots only)) or None when the SQL cannot be parameterized safely: a number/date
+    that is not in the SQL exactly once, two slots with the same value or node, or nothing to
+    bind. A status word only binds to a literal compared with a column it is enumerated for.
+    """
+    try:
+        expr = sqlglot.parse_one(sql, read=sqlglot_dialect(dialect))
+    except Exception:
+        return None
+    nodes = _literal_nodes(expr)
+    aliases = {t.alias_or_name.lower(): t.name.lower() for t in expr.find_all(exp.Table)}
+    slots: List[Tuple[int, int]] = []
+    columns: List[Optional[Tuple[str, str]]] = []
+    inline: List[int] = []
+    for i, lit in enumerate(lits):
+        if lit.kind == "status":
+            known = value_words.get(lit.value, frozenset())
+            matches = []
+            for j, node in enumerate(nodes):
+                cols = _compared_columns(node, aliases) & known if _same_value(lit, node) else frozenset()
+                if len(cols) == 1:
+                    matches.append((j, next(iter(cols))))
+            if len(matches) == 1:
+                slots.append((i, matches[0][0]))
+                columns.append(matches[0][1])
+            else:
+                inline.append(i)
+            continue
+        matches = [j for j, node in enumerate(nodes) if _same_value(lit, node)]
+        if len(matches) == 1:
+            slots.append((i, matches[0]))
+            columns.append(None)
+        else:
+            return None
+    if len(inline) > _MAX_STATUS_SPLIT and len(inline) != sum(lit.kind == "status" for lit in lits):
+        return None  # lookups only try all-or-nothing splits past this many status words
+    used = [lits[i].value for i, _ in slots]
+    if not slots or len(set(used)) != len(used) or len({j for _, j in slots}) != len(slots):
+        return None
+    return tuple(inline), slots, columns
+
+def fill(expr: exp.Expression, slots: List[Tuple[int, int]], lits: List[Literal], dialect: str) -> str:
+    out = expr.copy()
+    nodes = _literal_nodes(out)
+    for i, j in slots:
+        node = nodes[j]
+        value = lits[i].value
+        node.replace(exp.Literal.string(value) if node.is_string else exp.Literal.number(value))
+    return out.sql(dialect=sqlglot_dialect(dialect))
+
+class TemplateCache:
+    """Templates persisted (SQL text + slots) through a CompileCache table; parsed ASTs kept in an LRU."""
+
+    def __init__(self, path: str, max_memory: int = 1024, max_rows: int = 20_000):
+        self.store = CompileCache(path, max_memory=max_memory, max_rows=max_rows, table="sql_templates")
+        self.max_memory = max_memory
+        self._ast: "OrderedDict[str, exp.Expression]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "learned": 0, "not_parameterizable": 0}
+
+    @staticmethod
+    def _key(skel: str, model: str, dialect: str, schema_hash: str, prompt_version: str) -> str:
+        return hashlib.sha256("\x1f".join([skel, model, dialect, schema_hash, prompt_version]).encode("utf-8")).hexdigest()
+
+    def _parsed(self, key: str, sql: str, dialect: str) -> exp.Expression:
+        with self._lock:
+            expr = self._ast.get(key)
+            if expr is not None:
+                self._ast.move_to_end(key)
+                return expr
+        expr = sqlglot.parse_one(sql, read=sqlglot_dialect(dialect))
+        with self._lock:
+            self._ast[key] = expr
+            while len(self._ast) > self.max_memory:
+                self._ast.popitem(last=False)
+        return expr
+
+    def lookup(self, question: str, value_words: ValueWords, model: str, dialect: str,
+               schema_hash: str, prompt_version: str) -> Optional[str]:
+        """SQL filled from a stored template with this question's literals, or None. Not yet validated."""
+        parts, lits = extract_literals(question, value_words)
+        if not lits:
+            return None
+        for inline in _inline_choices(lits):
+            key = self._key(skeleton(parts, lits, inline), model, dialect, schema_hash, prompt_version)
+            hit = self.store.get(key)
+            if hit is None:
+                continue
+            tpl = hit[0]
+            slots = [tuple(s) for s in tpl["slots"]]
+            # A status word fits the slot only if it is a value of the slot's column
+            # ("male" is a gender, not a kyc_status)
+            columns = tpl.get("columns")
+            if columns is None or any(col is not None and tuple(col) not in value_words.get(lits[i].value, ())
+                                      for (i, _), col in zip(slots, columns)):
+                continue
+            try:
+                sql = fill(self._parsed(key, tpl["sql"], dialect), slots, lits, dialect)
+            except Exception as e:
+                print(f"template fill failed: {e.__class__.__name__}: {e}")
+                return None
+            self.stats["hits"] += 1
+            return sql
+        return None
+
+    def prune(self, schema_hash: str) -> None:
+        self.store.prune(schema_hash)
+        with self._lock:
+            self._ast.clear()
+
+    def learn(self, question: str, value_words: ValueWords, sql: str, model: str, dialect: str,
+              schema_hash: str, prompt_version: str) -> bool:
+        """Store validated SQL as a template if the question's literals bind to it unambiguously."""
+        parts, lits = extract_literals(question, value_words)
+        if not lits:
+            return False
+        bound = bind_slots(sql, dialect, lits, value_words)
+        if bound is None:
+            self.stats["not_parameterizable"] += 1
+            return False
+        inline, slots, columns = bound
+        key = self._key(skeleton(parts, lits, inline), model, dialect, schema_hash, prompt_version)
+        self.store.put(key, schema_hash, {"sql": sql, "slots": slots, "columns": columns,
+                                          "kinds": [lits[i].kind for i, _ in slots]})
+        with self._lock:
+            self._ast.pop(key, None)
+        self.stats["learned"] += 1
+        return True
+
+    def info(self) -> Dict[str, Any]:
+        return {**self.stats, **{k: v for k, v in self.store.info().items() if k.endswith("entries")}}
@@ -22,6 +22,9 @@ def _get_limit_value(expr: exp.Expression):
             return None
     return None
 
+def sqlglot_dialect(dialect: str):
+    return {"postgres":"postgres", "postgresql":"postgres", "mysql":"mysql"}.get(dialect, None)
+
 def validate_sql(sql: str, dialect: str, allowed_tables: Set[str]) -> Dict[str, Any]:
     out: Dict[str, Any] = {
         "parse_ok": False,
@@ -32,8 +35,7 @@ def validate_sql(sql: str, dialect: str, allowed_tables: Set[str]) -> Dict[str,
         "tables_used": [],
     }
     try:
-        read = {"postgres":"postgres", "postgresql":"postgres", "mysql":"mysql"}.get(dialect, None)
-        expr = sqlglot.parse_one(sql, read=read)
+        expr = sqlglot.parse_one(sql, read=sqlglot_dialect(dialect))
         out["parse_ok"] = True
     except Exception:
         return out
@@ -0,0 +1,138 @@
+import time, threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+from ..core.config import ANSWER_CACHE_ENABLED, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_S
+
+def _unit(v: List[float]) -> np.ndarray:
+    a = np.asarray(v, dtype=np.float32)
+    n = float(np.linalg.norm(a))
+    return a / n if n else a
+
+class _ScopeBlock:
+    """Unit vectors of one scope's entries as rows of a matrix, scored with a single matmul."""
+
+    def __init__(self, dim: int):
+        self.mat = np.zeros((16, dim), dtype=np.float32)
+        self.ts = np.zeros(16, dtype=np.float64)
+        self.ids: List[int] = []
+        self.pos: Dict[int, int] = {}
+
+    def add(self, eid: int, vec: np.ndarray, ts: float):
+        n = len(self.ids)
+        if n == len(self.mat):
+            self.mat = np.concatenate([self.mat, np.zeros_like(self.mat)])
+            self.ts = np.concatenate([self.ts, np.zeros_like(self.ts)])
+        self.mat[n], self.ts[n] = vec, ts
+        self.ids.append(eid)
+        self.pos[eid] = n
+
+    def remove(self, eid: int):
+        # move the last row into the freed slot
+        row, last = self.pos.pop(eid), len(self.ids) - 1
+        if row != last:
+            moved = self.ids[last]
+            self.mat[row], self.ts[row] = self.mat[last], self.ts[last]
+            self.ids[row] = moved
+            self.pos[moved] = row
+        self.ids.pop()
+
+class AnswerCache:
+    """
+    Replies keyed by query-embedding similarity. Every entry is tagged with the
+    KB version-set scope it was answered against; entries from another scope never match,
+    and invalidate() drops everything when ingest/delete changes a KB.
+    """
+
+    def __init__(self, threshold: float, max_entries: int, ttl_s: float):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._entries: "OrderedDict[int, Dict]" = OrderedDict()  # LRU order: eid -> {"scope", "payload"}
+        self._blocks: Dict[str, _ScopeBlock] = {}
+        self._next_id = 0
+        self._scope: Optional[str] = None
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def _drop(self, eid: int):
+        e = self._entries.pop(eid)
+        block = self._blocks[e["scope"]]
+        block.remove(eid)
+        if not block.ids:
+            del self._blocks[e["scope"]]
+
+    def scope(self, compute: Callable[[], str]) -> str:
+        with self._lock:
+            if self._scope is None:
+                self._scope = compute()
+            return self._scope
+
+    def lookup(self, emb: List[float], scope: str) -> Optional[Tuple[Dict, float]]:
+        q = _unit(emb)
+        now = time.time()
+        with self._lock:
+            block = self._blocks.get(scope)
+            if block is not None:
+                n = len(block.ids)
+                for i in np.flatnonzero(now - block.ts[:n] > self.ttl_s)[::-1]:
+                    self._drop(block.ids[i])  # descending rows, so swaps never move an expired row
+                block = self._blocks.get(scope)
+            if block is not None and block.mat.shape[1] == len(q):
+                sims = block.mat[:len(block.ids)] @ q
+                i = int(np.argmax(sims))
+                if sims[i] >= self.threshold:
+                    eid = block.ids[i]
+                    self._entries.move_to_end(eid)
+                    self.stats["hits"] += 1
+                    return self._entries[eid]["payload"], float(sims[i])
+            self.stats["misses"] += 1
+            return None
+
+    def store(self, emb: List[float], scope: str, payload: Dict):
+        vec = _unit(emb)
+        with self._lock:
+            block = self._blocks.get(scope)
+            if block is not None and block.mat.shape[1] != len(vec):
+                for eid in list(block.ids):  # embedding model changed under this scope
+                    self._drop(eid)
+                block = None
+            if block is None:
+                block = self._blocks[scope] = _ScopeBlock(len(vec))
+            eid = self._next_id
+            self._next_id += 1
+            self._entries[eid] = {"scope": scope, "payload": payload}
+            block.add(eid, vec, time.time())
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._blocks.clear()
+            self._scope = None
+            self.stats["invalidations"] += 1
+
+    def info(self) -> Dict:
+        with self._lock:
+            return {**self.stats, "entries": len(self._entries), "threshold": self.threshold}
+
+answer_cache = AnswerCache(ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_S)
+
+def lookup(emb: List[float], scope: str):
+    if not ANSWER_CACHE_ENABLED or not emb:
+        return None
+    return answer_cache.lookup(emb, scope)
+
+def store(emb: List[float], scope: str, payload: Dict):
+    if ANSWER_CACHE_ENABLED and emb:
+        answer_cache.store(emb, scope, payload)
+
+def invalidate():
+    answer_cache.invalidate()
+
+def current_scope(compute: Callable[[], str]) -> str:
+    return answer_cache.scope(compute)
+
+def info() -> Dict:
+    return answer_cache.info()
@@ -0,0 +1,76 @@
+from typing import AbstractSet, Dict, List, Optional, Tuple
+from ..core.config import CONTEXT_TOKEN_BUDGET, CONTEXT_SCORE_GAP, CHARS_PER_TOKEN, OVERLAP_CHARS
+
+# Shortest shared run that counts as chunker overlap rather than a coincidence
+_MIN_OVERLAP = 32
+
+def approx_tokens(text: str) -> int:
+    """Cheap token estimate (~CHARS_PER_TOKEN chars per token for English under llama tokenizers)."""
+    return int(len(text) / CHARS_PER_TOKEN + 0.999)
+
+def _join_overlap(a: str, b: str) -> Optional[str]:
+    """a + b with b's leading overlap with a's tail removed, or None if they don't overlap."""
+    probe = b[:min(len(b), max(_MIN_OVERLAP, OVERLAP_CHARS // 2))]
+    if len(probe) < _MIN_OVERLAP:
+        return None
+    idx = a.rfind(probe, max(0, len(a) - OVERLAP_CHARS - len(probe)))
+    if idx < 0 or not b.startswith(a[idx:]):
+        return None
+    return a[:idx] + b
+
+def merge_adjacent(items: List[Dict]) -> List[Dict]:
+    """
+    Merge chunks of the same document section that were cut from neighbouring windows
+    (the chunker repeats OVERLAP_CHARS between them), keeping the first item's position
+    and the best score.
+    """
+    out: List[Dict] = []
+    for it in items:
+        cur, pos, i = dict(it), len(out), 0
+        while i < len(out):
+            prev = out[i]
+            text = None
+            if prev["doc"] == cur["doc"] and prev["title"] == cur["title"]:
+                text = _join_overlap(prev["text"], cur["text"]) or _join_overlap(cur["text"], prev["text"])
+            if text is None:
+                i += 1
+                continue
+            cur = {**prev, "text": text, "score": max(prev["score"], cur["score"])}
+            del out[i]
+            pos, i = min(pos, i), 0  # the longer text may now join another chunk
+        out.insert(pos, cur)
+    return out
+
+def pack_context(items: List[Dict], budget: int = CONTEXT_TOKEN_BUDGET,
+                 score_gap: float = CONTEXT_SCORE_GAP,
+                 skip_ids: AbstractSet[str] = frozenset()) -> Tuple[List[Dict], int]:
+    """
+    Select retrieved items for the prompt: drop those scoring more than score_gap below the
+    best hit (and those in skip_ids, e.g. already sent), merge overlapping neighbours, then
+    fill the token budget best score first, trimming the last item at a word boundary.
+    Returns (items, context tokens used).
+    """
+    if not items:
+        return [], 0
+    best = max(it["score"] for it in items)
+    kept = sorted((it for it in items if it["score"] >= best - score_gap and it["id"] not in skip_ids),
+                  key=lambda it: it["score"], reverse=True)
+    packed: List[Dict] = []
+    used = 0
+    for it in merge_adjacent(kept):
+        header = approx_tokens(f"[{len(packed) + 1}] {it['doc']} — {it['title']}\n") + 1
+        cost = header + approx_tokens(it["text"])
+        if used + cost <= budget:
+            packed.append(it)
+            used += cost
+            continue
+        room = int((budget - used - header) * CHARS_PER_TOKEN)
+        if room >= 200 or not packed:
+            text = it["text"][:max(room, 0)]
+            cut = text.rfind(" ")
+            text = text[:cut] if cut > room // 2 else text
+            if text:
+                packed.append({**it, "text": text})
+                used += header + approx_tokens(text)
+        break
+    return packed, used
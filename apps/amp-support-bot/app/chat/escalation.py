@@ -0,0 +1,94 @@
+import re, sys
+from typing import Dict, List, Optional, Tuple
+from ..core.config import ESCALATION_PHRASES_FILE, ESCALATION_THRESHOLD
+
+# Phrases that flag a message for a support ticket. Matching is case-insensitive substring
+# matching (as before), done by one compiled alternation in a single pass over the message.
+DEFAULT_PHRASES: List[Tuple[str, float]] = [
+    ("raise ticket", 1.0), ("open ticket", 1.0), ("contact support", 1.0), ("need support", 1.0),
+    ("connect me with agent", 1.0), ("talk to agent", 1.0), ("technical issue", 1.0),
+    ("customer care", 1.0), ("customer service", 1.0), ("help me", 1.0),
+    ("this isn't helpful", 1.0), ("doesn't work", 1.0), ("not what i asked", 1.0),
+    ("i'm confused", 1.0), ("not what i needed", 1.0), ("can't get it to work", 1.0),
+    ("this is wrong", 1.0),
+    # Broader related words
+    ("ticket", 1.0), ("support", 1.0), ("help", 1.0), ("assist", 1.0), ("problem", 1.0),
+    ("issue", 1.0), ("agent", 1.0), ("contact", 1.0),
+]
+
+_QUOTES = str.maketrans({"’": "'", "‘": "'", " ": " "})
+
+def _norm(text: str) -> str:
+    return " ".join((text or "").translate(_QUOTES).lower().split())
+
+def load_phrases(path: str) -> List[Tuple[str, float]]:
+    """One phrase per line, optionally "phrase | weight"; blank lines and # comments ignored."""
+    out = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            phrase, _, weight = line.partition("|")
+            out.append((phrase.strip(), float(weight) if weight.strip() else 1.0))
+    return out
+
+class PhraseMatcher:
+    """Weighted multi-phrase matcher: one regex, longest phrases first, O(len(message)) per scan."""
+
+    def __init__(self, phrases: List[Tuple[str, float]], threshold: float):
+        self.weights: Dict[str, float] = {}
+        for phrase, weight in phrases:
+            p = _norm(phrase)
+            if p:
+                self.weights[p] = max(weight, self.weights.get(p, 0.0))
+        alts = sorted(self.weights, key=len, reverse=True)
+        self._rx = re.compile("|".join(re.escape(p) for p in alts)) if alts else None
+        self.threshold = threshold
+
+    def score(self, message: str) -> float:
+        if self._rx is None:
+            return 0.0
+        found = {m.group(0) for m in self._rx.finditer(_norm(message))}
+        return sum(self.weights[p] for p in found)
+
+    def matches(self, message: str) -> bool:
+        return self.score(message) >= self.threshold
+
+_matcher: Optional[PhraseMatcher] = None
+
+def get_matcher() -> PhraseMatcher:
+    global _matcher
+    if _matcher is None:
+        phrases = load_phrases(ESCALATION_PHRASES_FILE) if ESCALATION_PHRASES_FILE else DEFAULT_PHRASES
+        _matcher = PhraseMatcher(phrases, ESCALATION_THRESHOLD)
+    return _matcher
+
+def detect_dissatisfaction(message: str) -> bool:
+    """True when the message asks for a human/ticket or signals the answer didn't help."""
+    return get_matcher().matches(message)
+
+def expand_synonyms(phrases: List[Tuple[str, float]], weight_factor: float = 0.8) -> List[Tuple[str, float]]:
+    """
+    Offline helper: add WordNet synonyms of single-word phrases at a reduced weight.
+    NLTK is only imported here, never by the server.
+    """
+    from nltk.corpus import wordnet
+    out = list(phrases)
+    known = {_norm(p) for p, _ in phrases}
+    for phrase, weight in phrases:
+        if " " in phrase.strip():
+            continue
+        for syn in wordnet.synsets(phrase.strip()):
+            for lemma in syn.lemmas():
+                name = _norm(lemma.name().replace("_", " "))
+                if name and name not in known:
+                    known.add(name)
+                    out.append((name, round(weight * weight_factor, 3)))
+    return out
+
+if __name__ == "__main__":
+    # python -m app.chat.escalation [phrases.txt] > expanded.txt
+    src = load_phrases(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PHRASES
+    for phrase, weight in expand_synonyms(src):
+        print(f"{phrase} | {weight}")
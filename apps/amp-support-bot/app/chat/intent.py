@@ -0,0 +1,82 @@
+import re, json
+from typing import Dict, List, Optional, Tuple
+from ..core.config import SMALLTALK_ENABLED, SMALLTALK_LANGUAGES, SMALLTALK_PATTERNS_FILE
+
+# Pre-retrieval fast path: a message that is *only* a greeting, thanks or goodbye is
+# answered from a template, without embedding, retrieval or the LLM.
+# Patterns match the whole normalized message (lowercase, punctuation/emoji stripped),
+# so "hi, how do I reset my PIN?" still goes through the normal pipeline.
+DEFAULT_INTENTS: Dict[str, Dict[str, Dict]] = {
+    "en": {
+        "greeting": {
+            "patterns": [r"(hi|hello|hey|hiya|heya|howdy|greetings|yo|good (morning|afternoon|evening|day))"
+                         r"( there| team| all| everyone| folks| bot)?"],
+            "reply": "Hello! How can I help you today?",
+        },
+        "thanks": {
+            "patterns": [r"(thanks|thank you|thank u|thx|ty|cheers|many thanks|much appreciated|appreciate it)"
+                         r"( so much| a lot| very much| again| for (the|your) help)?( that helped| that works)?"],
+            "reply": "You're welcome! Is there anything else I can help you with?",
+        },
+        "goodbye": {
+            "patterns": [r"(bye|bye bye|goodbye|good bye|see you|see ya|later|good night|"
+                         r"have a (good|nice|great) (day|one|evening))( then| now)?"],
+            "reply": "Goodbye! Feel free to come back if you have more questions.",
+        },
+    },
+    "es": {
+        "greeting": {"patterns": [r"(hola|buenos dias|buenas tardes|buenas noches|buenas)( a todos)?"],
+                     "reply": "¡Hola! ¿En qué puedo ayudarte hoy?"},
+        "thanks": {"patterns": [r"(gracias|muchas gracias|mil gracias)( por (tu|la) ayuda)?"],
+                   "reply": "¡De nada! ¿Hay algo más en lo que pueda ayudarte?"},
+        "goodbye": {"patterns": [r"(adios|hasta luego|hasta pronto|chao|nos vemos)"],
+                    "reply": "¡Hasta luego! Vuelve cuando quieras."},
+    },
+}
+
+_STRIP_RE = re.compile(r"[^\w\s']+", re.UNICODE)
+_ACCENTS = str.maketrans("áéíóúüñ", "aeiouun")
+
+def normalize(message: str) -> str:
+    t = _STRIP_RE.sub(" ", (message or "").lower().translate(_ACCENTS))
+    return " ".join(t.split())
+
+class IntentMatcher:
+    """One compiled alternation per (language, intent); a full match wins."""
+
+    def __init__(self, intents: Dict[str, Dict[str, Dict]], languages: List[str]):
+        self._rules: List[Tuple[str, str, "re.Pattern", str]] = []
+        for lang in languages:
+            for name, spec in (intents.get(lang) or {}).items():
+                rx = re.compile("(?:" + "|".join(f"(?:{p})" for p in spec["patterns"]) + r")(?: please)?")
+                self._rules.append((lang, name, rx, spec["reply"]))
+
+    def match(self, message: str) -> Optional[Dict]:
+        text = normalize(message)
+        # Anything long is a real question even if it starts with "hi"
+        if not text or len(text) > 60:
+            return None
+        for lang, name, rx, reply in self._rules:
+            if rx.fullmatch(text):
+                return {"intent": name, "language": lang, "reply": reply}
+        return None
+
+def _load_intents() -> Dict[str, Dict[str, Dict]]:
+    intents = {lang: dict(v) for lang, v in DEFAULT_INTENTS.items()}
+    if SMALLTALK_PATTERNS_FILE:
+        # {"<lang>": {"<intent>": {"patterns": [...], "reply": "..."}}}; overrides per intent
+        with open(SMALLTALK_PATTERNS_FILE, "r", encoding="utf-8") as f:
+            for lang, spec in json.load(f).items():
+                intents.setdefault(lang, {}).update(spec)
+    return intents
+
+_matcher: Optional[IntentMatcher] = None
+
+def match(message: str) -> Optional[Dict]:
+    """{"intent", "language", "reply"} when the message is pure small talk, else None."""
+    global _matcher
+    if not SMALLTALK_ENABLED:
+        return None
+    if _matcher is None:
+        _matcher = IntentMatcher(_load_intents(), SMALLTALK_LANGUAGES)
+    return _matcher.match(message)
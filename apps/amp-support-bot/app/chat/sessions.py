@@ -0,0 +1,96 @@
+import time, threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from ..core.config import CHAT_SESSIONS_ENABLED, CHAT_SESSION_TTL_S, CHAT_SESSION_MAX_TOKENS, CHAT_SESSION_MAX
+
+# Multi-turn prefix reuse. Ollama keeps the KV cache of the last prompt it evaluated for a
+# loaded model; a request whose messages start with exactly the same tokens only evaluates
+# the new suffix. A session is the message list sent for a chat so far (assistant turns
+# verbatim), so the next turn appends to it instead of rebuilding the prompt.
+# Sessions live in memory like the KV cache they mirror: a restart, TTL or KB change
+# just means the next turn starts fresh.
+
+class ChatSessions:
+    def __init__(self, ttl_s: float, max_tokens: int, max_sessions: int):
+        self.ttl_s = ttl_s
+        self.max_tokens = max_tokens
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"turns": 0, "reused": 0, "fresh": 0, "expired": 0, "scope_changed": 0, "full": 0,
+                      "prompt_eval_tokens_fresh": 0, "prompt_eval_tokens_reused": 0,
+                      "prompt_eval_ms_fresh": 0.0, "prompt_eval_ms_reused": 0.0}
+
+    def get(self, chat_id: str, scope: str) -> Optional[Dict]:
+        """The live session for chat_id, or None (and the reason counted) if it cannot be extended."""
+        now = time.time()
+        with self._lock:
+            s = self._sessions.get(chat_id)
+            if s is None:
+                return None
+            reason = None
+            if now - s["ts"] > self.ttl_s:
+                reason = "expired"
+            elif s["scope"] != scope:
+                reason = "scope_changed"
+            elif s["tokens"] >= self.max_tokens:
+                reason = "full"
+            if reason:
+                del self._sessions[chat_id]
+                self.stats[reason] += 1
+                return None
+            self._sessions.move_to_end(chat_id)
+            return {**s, "messages": list(s["messages"]), "ctx_items": list(s["ctx_items"])}
+
+    def put(self, chat_id: str, scope: str, messages: List[Dict], ctx_items: List[Dict], tokens: int):
+        with self._lock:
+            self._sessions[chat_id] = {"scope": scope, "messages": messages, "ctx_items": ctx_items,
+                                       "tokens": tokens, "ts": time.time()}
+            self._sessions.move_to_end(chat_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def drop(self, chat_id: str):
+        with self._lock:
+            self._sessions.pop(chat_id, None)
+
+    def record(self, reused: bool, stats: Dict):
+        """Count one LLM turn with Ollama's prompt_eval_count/duration for it."""
+        kind = "reused" if reused else "fresh"
+        with self._lock:
+            self.stats["turns"] += 1
+            self.stats[kind] += 1
+            self.stats[f"prompt_eval_tokens_{kind}"] += int(stats.get("prompt_eval_count") or 0)
+            self.stats[f"prompt_eval_ms_{kind}"] += (stats.get("prompt_eval_duration") or 0) / 1e6
+
+    def info(self) -> Dict:
+        with self._lock:
+            st = dict(self.stats)
+            live = len(self._sessions)
+        out = {**st, "sessions": live, "enabled": CHAT_SESSIONS_ENABLED,
+               "reuse_rate": round(st["reused"] / st["turns"], 4) if st["turns"] else 0.0}
+        for kind in ("fresh", "reused"):
+            n = st[kind]
+            out[f"avg_prompt_eval_tokens_{kind}"] = round(st[f"prompt_eval_tokens_{kind}"] / n, 1) if n else None
+            out[f"prompt_eval_ms_{kind}"] = round(st[f"prompt_eval_ms_{kind}"], 1)
+        return out
+
+chat_sessions = ChatSessions(CHAT_SESSION_TTL_S, CHAT_SESSION_MAX_TOKENS, CHAT_SESSION_MAX)
+
+def get(chat_id: Optional[str], scope: str) -> Optional[Dict]:
+    if not CHAT_SESSIONS_ENABLED or not chat_id:
+        return None
+    return chat_sessions.get(chat_id, scope)
+
+def put(chat_id: Optional[str], scope: str, messages: List[Dict], ctx_items: List[Dict], tokens: int):
+    if CHAT_SESSIONS_ENABLED and chat_id:
+        chat_sessions.put(chat_id, scope, messages, ctx_items, tokens)
+
+def drop(chat_id: str):
+    chat_sessions.drop(chat_id)
+
+def record(reused: bool, stats: Dict):
+    chat_sessions.record(reused, stats)
+
+def info() -> Dict:
+    return chat_sessions.info()
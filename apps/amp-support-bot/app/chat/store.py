@@ -1,27 +1,59 @@
-import os, sqlite3, json, time, random, string
-from typing import Dict, List
+import os, sqlite3, json, time, random, string, asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 from ..core.config import CHATS_DIR
 
 DB_PATH = os.path.join(CHATS_DIR, "sessions.sqlite")
 
+# One connection, owned by a single worker thread: every statement runs off the
+# event loop and writes are serialized without extra locking.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-store")
+_conn: Optional[sqlite3.Connection] = None
+
+def _db() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        os.makedirs(CHATS_DIR, exist_ok=True)
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        _conn = conn
+    return _conn
+
+def _ensure_db():
+    conn = _db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("""CREATE TABLE IF NOT EXISTS chats (
+            chat_id TEXT PRIMARY KEY,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            kb_ids TEXT
+        )""")
+        cols = {r[1] for r in conn.execute("PRAGMA table_info(chats)").fetchall()}
+        if "kb_ids" not in cols:
+            conn.execute("ALTER TABLE chats ADD COLUMN kb_ids TEXT")
+        conn.execute("""CREATE TABLE IF NOT EXISTS messages (
+            chat_id TEXT,
+            role TEXT,
+            text TEXT,
+            ts REAL
+        )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_chat_ts ON messages(chat_id, ts)")
+        conn.execute("CREATE TABLE IF NOT EXISTS seq (n INTEGER)")
+        conn.execute("INSERT INTO seq (n) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM seq)")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
 def ensure_db():
-    os.makedirs(CHATS_DIR, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""CREATE TABLE IF NOT EXISTS chats (
-        chat_id TEXT PRIMARY KEY,
-        created_at REAL NOT NULL,
-        updated_at REAL NOT NULL
-       
-    )""")
-    cur.execute("""CREATE TABLE IF NOT EXISTS messages (
-        chat_id TEXT,
-        role TEXT,
-        text TEXT,
-        ts REAL
-    )""")
-    conn.commit()
-    conn.close()
+    """Create tables/indexes once at startup (blocking)."""
+    _executor.submit(_ensure_db).result()
+
+async def _run(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
 
 def _rand_suffix(n=8):
     return "".join(random.choices(string.hexdigits.lower(), k=n))
@@ -29,43 +61,24 @@ def _rand_suffix(n=8):
 def new_chat_id(seq: int) -> str:
     return f"{seq:05d}-{_rand_suffix(8)}"
 
-def next_seq() -> int:
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("CREATE TABLE IF NOT EXISTS seq (n INTEGER)")
-    conn.commit()
-    cur.execute("SELECT n FROM seq")
-    row = cur.fetchone()
-    if not row:
-        cur.execute("INSERT INTO seq (n) VALUES (1)")
-        conn.commit()
-        n = 1
-    else:
-        n = row[0] + 1
-        cur.execute("UPDATE seq SET n=?", (n,))
-        conn.commit()
-    conn.close()
-    return n
-
-def create_chat() -> str:
-    ensure_db()
-    cid = new_chat_id(next_seq())
+def _create_chat(kb_ids: Optional[List[str]] = None) -> str:
+    conn = _db()
     now = time.time()
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("INSERT INTO chats (chat_id, created_at, updated_at) VALUES (?,?,?)",
-                (cid, now, now))
-    conn.commit()
-    conn.close()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("UPDATE seq SET n = n + 1")
+        (n,) = conn.execute("SELECT n FROM seq").fetchone()
+        cid = new_chat_id(n)
+        conn.execute("INSERT INTO chats (chat_id, created_at, updated_at, kb_ids) VALUES (?,?,?,?)",
+                     (cid, now, now, json.dumps(kb_ids) if kb_ids else None))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
     return cid
 
-def get_chat(chat_id: str):
-    ensure_db()
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT chat_id, created_at, updated_at FROM chats WHERE chat_id=?", (chat_id,))
-    row = cur.fetchone()
-    conn.close()
+def _get_chat(chat_id: str):
+    row = _db().execute("SELECT chat_id, created_at, updated_at, kb_ids FROM chats WHERE chat_id=?", (chat_id,)).fetchone()
     if not row:
         return None
     return {
@@ -73,24 +86,37 @@ def get_chat(chat_id: str):
         # "kb_bindings": json.loads(row[1]),
         "created_at": row[1],
         "updated_at": row[2],
+        "kb_ids": json.loads(row[3]) if row[3] else None,
     }
 
-def append_message(chat_id: str, role: str, text: str):
-    ensure_db()
+def _append_message(chat_id: str, role: str, text: str):
+    conn = _db()
     now = time.time()
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("INSERT INTO messages (chat_id, role, text, ts) VALUES (?,?,?,?)",
-                (chat_id, role, text, now))
-    cur.execute("UPDATE chats SET updated_at=? WHERE chat_id=?", (now, chat_id))
-    conn.commit()
-    conn.close()
-
-def get_messages(chat_id: str, limit: int = 10):
-    ensure_db()
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT role, text, ts FROM messages WHERE chat_id=? ORDER BY ts DESC LIMIT ?", (chat_id, limit))
-    rows = cur.fetchall()
-    conn.close()
+    conn.execute("BEGIN")
+    try:
+        conn.execute("INSERT INTO messages (chat_id, role, text, ts) VALUES (?,?,?,?)",
+                     (chat_id, role, text, now))
+        conn.execute("UPDATE chats SET updated_at=? WHERE chat_id=?", (now, chat_id))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def _get_messages(chat_id: str, limit: int = 10):
+    rows = _db().execute(
+        "SELECT role, text, ts FROM messages WHERE chat_id=? ORDER BY ts DESC LIMIT ?", (chat_id, limit)
+    ).fetchall()
     return list(reversed(rows))
+
+async def create_chat(kb_ids: Optional[List[str]] = None) -> str:
+    """Allocate the next sequence number and insert the chat (bound to kb_ids) in one transaction."""
+    return await _run(_create_chat, kb_ids)
+
+async def get_chat(chat_id: str):
+    return await _run(_get_chat, chat_id)
+
+async def append_message(chat_id: str, role: str, text: str):
+    await _run(_append_message, chat_id, role, text)
+
+async def get_messages(chat_id: str, limit: int = 10):
+    return await _run(_get_messages, chat_id, limit)
@@ -12,17 +12,92 @@ KB_DIR = os.path.join(DATA_ROOT, "kb")
 CHATS_DIR = os.path.join(DATA_ROOT, "chats")
 LOCKS_DIR = os.path.join(DATA_ROOT, "locks")
 LOGS_DIR = os.path.join(DATA_ROOT, "logs")
+JOBS_DIR = os.path.join(DATA_ROOT, "jobs")
+KB_CATALOG_PATH = os.path.join(KB_DIR, "catalog.sqlite")
+CHROMA_COLLECTION = os.getenv("CHROMA_COLLECTION", "chatbot")
+# Vector index engine for newly ingested KB versions ("chroma" or "numpy"); existing
+# versions keep the engine recorded in their meta. numpy stores float16 or int8 vectors.
+INDEX_ENGINE = os.getenv("INDEX_ENGINE", "chroma")
+NUMPY_INDEX_DTYPE = os.getenv("NUMPY_INDEX_DTYPE", "float16")
 
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://host.docker.internal:11434")
 EMBED_MODEL = os.getenv("EMBED_MODEL", "mxbai-embed-large")
 CHAT_MODEL = os.getenv("CHAT_MODEL", "llama3:8b")
+# How long Ollama keeps the chat model (and its prompt KV cache) loaded between requests,
+# and the context window; multi-turn reuse needs room for the history
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+CHAT_NUM_CTX = int(os.getenv("CHAT_NUM_CTX", "8192"))
+# Per-chat LLM sessions: follow-ups extend the previous turn's messages so the evaluated
+# prefix is reused; a session is dropped after CHAT_SESSION_TTL_S idle or once it grows past
+# CHAT_SESSION_MAX_TOKENS (approximate)
+CHAT_SESSIONS_ENABLED = os.getenv("CHAT_SESSIONS_ENABLED", "1") not in ("0", "false", "False")
+CHAT_SESSION_TTL_S = float(os.getenv("CHAT_SESSION_TTL_S", "1200"))
+CHAT_SESSION_MAX_TOKENS = int(os.getenv("CHAT_SESSION_MAX_TOKENS", "6000"))
+CHAT_SESSION_MAX = int(os.getenv("CHAT_SESSION_MAX", "1000"))
 
 # Chunking defaults
 MAX_CHARS = int(os.getenv("MAX_CHARS", "2200"))
 OVERLAP_CHARS = int(os.getenv("OVERLAP_CHARS", "220"))
 
 RETRIEVAL_K_PER_KB = int(os.getenv("RETRIEVAL_K_PER_KB", "8"))
-CONFIDENCE_THRESHOLD = float(os.getenv("CONFIDENCE_THRESHOLD", "0.20"))
+# Retrieval scores are cosine similarities whatever the index engine; 0.60 is the former
+# 0.20 on the old "1 - squared L2" Chroma scale (2·cos - 1)
+CONFIDENCE_THRESHOLD = float(os.getenv("CONFIDENCE_THRESHOLD", "0.60"))
+
+# Prompt context packing: approximate token budget for retrieved context, and how far below
+# the best hit's score an item may fall before it is left out
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_SCORE_GAP = float(os.getenv("CONTEXT_SCORE_GAP", "0.075"))
+CHARS_PER_TOKEN = float(os.getenv("CHARS_PER_TOKEN", "4"))
+
+# Small-talk fast path (greetings/thanks/goodbyes answered from templates); optional JSON
+# file with extra or overriding patterns per language
+SMALLTALK_ENABLED = os.getenv("SMALLTALK_ENABLED", "1") not in ("0", "false", "False")
+SMALLTALK_LANGUAGES = [l.strip() for l in os.getenv("SMALLTALK_LANGUAGES", "en").split(",") if l.strip()]
+SMALLTALK_PATTERNS_FILE = os.getenv("SMALLTALK_PATTERNS_FILE", "")
+
+# Ticket escalation phrases ("phrase | weight" per line; built-in list when unset) and the
+# summed weight that raises is_raise_ticket
+ESCALATION_PHRASES_FILE = os.getenv("ESCALATION_PHRASES_FILE", "")
+ESCALATION_THRESHOLD = float(os.getenv("ESCALATION_THRESHOLD", "1.0"))
+
+# Lexical (BM25) index kept next to the Chroma directory, fused with vector hits via RRF
+LEXICAL_DIR = os.getenv("LEXICAL_DIR", os.path.join(os.path.dirname(os.path.normpath(CHROMA_DIR)), "lexical"))
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+# Query terms found in more than this share of all chunks are skipped (no signal, long postings)
+LEXICAL_MAX_DF_RATIO = float(os.getenv("LEXICAL_MAX_DF_RATIO", "0.5"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# Semantic answer cache for /chat/start and /chat/reply
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") not in ("0", "false", "False")
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "512"))
+ANSWER_CACHE_TTL_S = float(os.getenv("ANSWER_CACHE_TTL_S", "86400"))
+
+# Uploads are streamed to disk in UPLOAD_CHUNK_BYTES blocks; larger than MAX_UPLOAD_MB is rejected
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1 << 20)))
+MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "512"))
+
+# Document parsing process pool; PDFs longer than PDF_PAGES_PER_TASK are split into page ranges
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "50"))
+
+# Background ingest workers (number of jobs ingested in parallel)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+
+# Embedding client
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_TIMEOUT = float(os.getenv("EMBED_TIMEOUT", "120"))
+
+# Streaming ingest: chunks flow parse -> embed -> upsert in batches of this size
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", str(EMBED_BATCH_SIZE * EMBED_CONCURRENCY)))
+
+# Persistent embedding cache
+CACHE_DIR = os.path.join(DATA_ROOT, "cache")
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", os.path.join(CACHE_DIR, "embeddings.sqlite"))
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "200000"))
 
 
 
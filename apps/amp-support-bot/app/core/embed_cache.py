@@ -0,0 +1,120 @@
+import os, sqlite3, threading, time, hashlib, unicodedata, asyncio
+from array import array
+from typing import Dict, List, Optional
+from .config import EMBED_MODEL, EMBED_CACHE_PATH, EMBED_CACHE_MAX_ENTRIES
+from .ollama import embed_many
+
+_lock = threading.Lock()
+_conn: Optional[sqlite3.Connection] = None
+_rows = 0  # row count, read once when the DB opens and tracked on every write
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+def _db() -> sqlite3.Connection:
+    global _conn, _rows
+    if _conn is None:
+        os.makedirs(os.path.dirname(EMBED_CACHE_PATH) or ".", exist_ok=True)
+        conn = sqlite3.connect(EMBED_CACHE_PATH, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS embeddings (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            dim INTEGER NOT NULL,
+            vec BLOB NOT NULL,
+            last_used REAL NOT NULL
+        )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        conn.commit()
+        (_rows,) = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        _conn = conn
+    return _conn
+
+def normalize_text(text: str) -> str:
+    t = unicodedata.normalize("NFC", text or "")
+    return " ".join(t.split())
+
+def cache_key(model: str, text: str) -> str:
+    h = hashlib.blake2b(normalize_text(text).encode("utf-8"), digest_size=16).hexdigest()
+    return f"{model}:{h}"
+
+def _pack(vec: List[float]) -> bytes:
+    return array("f", vec).tobytes()
+
+def _unpack(blob: bytes) -> List[float]:
+    a = array("f")
+    a.frombytes(blob)
+    return a.tolist()
+
+def get_many(model: str, texts: List[str]) -> List[Optional[List[float]]]:
+    keys = [cache_key(model, t) for t in texts]
+    found: Dict[str, bytes] = {}
+    with _lock:
+        conn = _db()
+        uniq = list(set(keys))
+        for i in range(0, len(uniq), 500):
+            part = uniq[i:i+500]
+            rows = conn.execute(
+                f"SELECT key, vec FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part
+            ).fetchall()
+            found.update(rows)
+        if found:
+            now = time.time()
+            conn.executemany("UPDATE embeddings SET last_used=? WHERE key=?", [(now, k) for k in found])
+            conn.commit()
+        hits = sum(1 for k in keys if k in found)
+        _stats["hits"] += hits
+        _stats["misses"] += len(keys) - hits
+    return [_unpack(found[k]) if k in found else None for k in keys]
+
+def put_many(model: str, texts: List[str], vectors: List[List[float]]) -> None:
+    global _rows
+    now = time.time()
+    rows = [(cache_key(model, t), model, len(v), _pack(v), now) for t, v in zip(texts, vectors) if v]
+    if not rows:
+        return
+    rows = list({r[0]: r for r in rows}.values())  # a repeated text counts once
+    with _lock:
+        conn = _db()
+        keys = [r[0] for r in rows]
+        existing = 0
+        for i in range(0, len(keys), 500):
+            part = keys[i:i+500]
+            (n,) = conn.execute(
+                f"SELECT COUNT(*) FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part
+            ).fetchone()
+            existing += n
+        conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, model, dim, vec, last_used) VALUES (?,?,?,?,?)", rows
+        )
+        _rows += len(rows) - existing
+        over = _rows - EMBED_CACHE_MAX_ENTRIES
+        if over > 0:
+            cur = conn.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (over,),
+            )
+            _rows -= cur.rowcount
+            _stats["evictions"] += cur.rowcount
+        conn.commit()
+
+def stats() -> Dict:
+    total = _stats["hits"] + _stats["misses"]
+    return {**_stats, "hit_rate": round(_stats["hits"] / total, 4) if total else 0.0}
+
+async def embed_texts_cached(texts: List[str]) -> List[List[float]]:
+    """
+    Same contract as ollama.embed_texts (input order, [] for failures), but
+    vectors already seen for EMBED_MODEL are served from the on-disk cache (SQLite calls run
+    in a worker thread, off the event loop).
+    """
+    out = await asyncio.to_thread(get_many, EMBED_MODEL, texts)
+    missing = [i for i, v in enumerate(out) if v is None]
+    if missing:
+        results = await embed_many([texts[i] for i in missing])
+        fresh_texts, fresh_vecs = [], []
+        for i, r in zip(missing, results):
+            out[i] = r["embedding"] or []
+            if r["embedding"]:
+                fresh_texts.append(texts[i])
+                fresh_vecs.append(r["embedding"])
+        await asyncio.to_thread(put_many, EMBED_MODEL, fresh_texts, fresh_vecs)
+    return out
@@ -7,15 +7,15 @@ class KBIngestBody(BaseModel):
     # file_names: List[UploadFile]
 
 class ChatStartBody(BaseModel):
-    # kb_ids: List[str] = Field(min_length=1)
+    kb_ids: Optional[List[str]] = None  # KBs to search for this chat; None searches all
     message: str
     # language: str = "en"
-    # stream: bool = False
+    stream: bool = False
 
 class ChatReplyBody(BaseModel):
     chat_id: str
     message: str
-    # stream: bool = False
+    stream: bool = False
 
 class Citation(BaseModel):
     doc: str
@@ -30,6 +30,12 @@ class ChatReply(BaseModel):
     abstained: bool
     latency_ms: int
     is_raise_ticket: bool  # New field added to flag whether a ticket is raised
+    cache_hit: bool = False
+    cache_similarity: Optional[float] = None
+    prompt_tokens: Optional[int] = None  # approximate; None when served from the answer cache
+    context_tokens: Optional[int] = None  # retrieved context packed into this turn (packer's count)
+    intent: Optional[str] = None  # "greeting" / "thanks" / "goodbye" when answered by the small-talk fast path
+    session_reused: bool = False  # follow-up sent as an extension of the chat's previous LLM turn
 
 
 
@@ -0,0 +1,110 @@
+import os, json, sqlite3, threading
+from typing import Dict, List, Optional
+from ..core.config import KB_CATALOG_PATH
+
+# Per-version rows plus one denormalized row per KB (active version, counts, total bytes),
+# maintained on every meta write so listing never touches the KB directories.
+_lock = threading.Lock()
+_conn: Optional[sqlite3.Connection] = None
+
+def _db() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        os.makedirs(os.path.dirname(KB_CATALOG_PATH) or ".", exist_ok=True)
+        conn = sqlite3.connect(KB_CATALOG_PATH, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS versions (
+            kb_id TEXT NOT NULL,
+            kb_version_id TEXT NOT NULL,
+            created_at TEXT,
+            archived INTEGER NOT NULL DEFAULT 0,
+            files INTEGER NOT NULL DEFAULT 0,
+            chunks INTEGER NOT NULL DEFAULT 0,
+            bytes INTEGER NOT NULL DEFAULT 0,
+            embedding TEXT,
+            index_engine TEXT,
+            source_files TEXT,
+            PRIMARY KEY (kb_id, kb_version_id)
+        )""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS kbs (
+            kb_id TEXT PRIMARY KEY,
+            active_version TEXT,
+            files INTEGER NOT NULL DEFAULT 0,
+            chunks INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT,
+            bytes INTEGER NOT NULL DEFAULT 0,
+            index_engine TEXT
+        )""")
+        cols = {r[1] for r in conn.execute("PRAGMA table_info(kbs)").fetchall()}
+        if "index_engine" not in cols:
+            # Older catalog layout: it is derived data, so start over and let ensure_catalog rebuild it
+            conn.execute("DROP TABLE kbs")
+            conn.execute("DELETE FROM versions")
+            conn.commit()
+            conn.close()
+            return _db()
+        conn.commit()
+        _conn = conn
+    return _conn
+
+def _refresh_kb(conn: sqlite3.Connection, kb_id: str):
+    total = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM versions WHERE kb_id=?", (kb_id,)).fetchone()[0]
+    # Active version = newest non-archived one (ties broken by version id, like a sorted directory scan)
+    act = conn.execute(
+        "SELECT kb_version_id, files, chunks, created_at, index_engine FROM versions WHERE kb_id=? AND archived=0 "
+        "ORDER BY created_at DESC, kb_version_id ASC LIMIT 1", (kb_id,)
+    ).fetchone()
+    row = (kb_id, act["kb_version_id"], act["files"], act["chunks"], act["created_at"], total, act["index_engine"]) \
+        if act else (kb_id, None, 0, 0, None, total, None)
+    conn.execute("INSERT OR REPLACE INTO kbs (kb_id, active_version, files, chunks, created_at, bytes, index_engine) "
+                 "VALUES (?,?,?,?,?,?,?)", row)
+
+def put_version(kb_id: str, kb_version_id: str, meta: Dict, size_bytes: int, source_files: List[str]):
+    row = (
+        kb_id, kb_version_id, meta.get("created_at"), int(bool(meta.get("archived"))),
+        meta.get("source_stats", {}).get("files", 0), meta.get("chunks", 0), size_bytes,
+        meta.get("embedding", {}).get("model", ""), meta.get("index", {}).get("engine", "chroma"),
+        json.dumps(source_files),
+    )
+    with _lock:
+        conn = _db()
+        conn.execute("INSERT OR REPLACE INTO versions (kb_id, kb_version_id, created_at, archived, files, chunks, "
+                     "bytes, embedding, index_engine, source_files) VALUES (?,?,?,?,?,?,?,?,?,?)", row)
+        _refresh_kb(conn, kb_id)
+        conn.commit()
+
+def is_empty() -> bool:
+    with _lock:
+        return _db().execute("SELECT 1 FROM kbs LIMIT 1").fetchone() is None
+
+def clear():
+    with _lock:
+        conn = _db()
+        conn.execute("DELETE FROM versions")
+        conn.execute("DELETE FROM kbs")
+        conn.commit()
+
+def list_kbs() -> List[Dict]:
+    with _lock:
+        rows = _db().execute("SELECT * FROM kbs ORDER BY kb_id").fetchall()
+    return [dict(r) for r in rows]
+
+def get_kb(kb_id: str) -> Optional[Dict]:
+    with _lock:
+        row = _db().execute("SELECT * FROM kbs WHERE kb_id=?", (kb_id,)).fetchone()
+    return dict(row) if row else None
+
+def active_version(kb_id: str) -> Optional[str]:
+    kb = get_kb(kb_id)
+    return kb["active_version"] if kb else None
+
+def list_versions(kb_id: str) -> List[Dict]:
+    with _lock:
+        rows = _db().execute("SELECT * FROM versions WHERE kb_id=? ORDER BY kb_version_id", (kb_id,)).fetchall()
+    out = []
+    for r in rows:
+        d = dict(r)
+        d["source_files"] = json.loads(d["source_files"] or "[]")
+        out.append(d)
+    return out
@@ -0,0 +1,209 @@
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from ..core.config import INDEX_ENGINE
+from . import vectordb
+
+# A KB version's vectors live in one index engine, named by meta["index"]["engine"].
+# Ingest writes through an IndexWriter; retrieval calls search()/fetch() per KB.
+
+class IndexWriter:
+    """
+    Builds one KB version. carry_ids are chunk ids of the previous version this engine can
+    keep without re-embedding; everything else arrives through add().
+    """
+    carry_ids: Set[str] = set()
+
+    def add(self, docs: List[Dict], embeddings: List[List[float]]):
+        raise NotImplementedError
+
+    def keep(self, docs: List[Dict]):
+        raise NotImplementedError
+
+    def commit(self, removed_ids: List[str]) -> Dict:
+        """Finish the version; returns the meta["index"] dict."""
+        raise NotImplementedError
+
+    def abort(self):
+        pass
+
+class IndexEngine:
+    name = ""
+
+    def reusable(self, index_meta: Dict) -> bool:
+        """Whether a version indexed as index_meta can be served as-is by this engine."""
+        return index_meta.get("engine", "chroma") == self.name
+
+    def writer(self, kb_id: str, kb_version_id: str, prev_version: Optional[str],
+               prev_meta: Optional[Dict], prev_ids: Set[str]) -> IndexWriter:
+        raise NotImplementedError
+
+    def search(self, kb_id: str, kb_version_id: str, q_emb: List[float], k: int) -> List[Dict]:
+        """
+        Top-k hits: [{"id", "kb_id", "doc", "title", "text", "score", "source"}], best first.
+        score is the cosine similarity for every engine, so hits from different KBs compare.
+        """
+        raise NotImplementedError
+
+    def fetch(self, kb_id: str, kb_version_id: str, ids: List[str], q_emb: List[float]) -> List[Dict]:
+        """The given chunks, scored against q_emb on the same scale as search()."""
+        raise NotImplementedError
+
+    def iter_chunks(self, kb_id: str, kb_version_id: str) -> Iterator[Dict]:
+        """Every chunk of the version as {"id", "kb_id", "doc", "title", "text"}."""
+        raise NotImplementedError
+
+    def drop(self, kb_id: str):
+        raise NotImplementedError
+
+    def warm_up(self, kbs: List[Tuple[str, str]]) -> Dict:
+        return {}
+
+def _distance(space: str, a: List[float], b: List[float]) -> float:
+    """Same distance Chroma reports for the collection's hnsw:space."""
+    dot = sum(x*y for x, y in zip(a, b))
+    if space == "ip":
+        return 1.0 - dot
+    if space == "cosine":
+        na = sum(x*x for x in a) ** 0.5
+        nb = sum(y*y for y in b) ** 0.5
+        return 1.0 - (dot / (na*nb) if na and nb else 0.0)
+    return sum((x-y)**2 for x, y in zip(a, b))
+
+def _similarity(space: str, distance: float) -> float:
+    """
+    Cosine similarity from a Chroma distance, the scale NumpyEngine scores on. Ollama's
+    /api/embed vectors are unit length, so squared L2 (the default space) is 2 - 2·cos.
+    """
+    if space in ("cosine", "ip"):
+        return 1.0 - distance
+    return 1.0 - distance / 2.0
+
+def _hit(kb_id: str, cid: str, meta: Optional[Dict], text: str, score: float, source: str) -> Dict:
+    meta = meta or {}
+    return {"id": cid, "kb_id": kb_id, "doc": meta.get("doc", ""), "title": meta.get("title", ""),
+            "text": text, "score": score, "source": source}
+
+class ChromaWriter(IndexWriter):
+    def __init__(self, kb_id: str, kb_version_id: str, prev_meta: Optional[Dict], prev_ids: Set[str]):
+        self.kb_id, self.kb_version_id = kb_id, kb_version_id
+        self.coll = vectordb.get_shard(kb_id, create=True, metadata={"kb_id": kb_id, "kb_version_id": kb_version_id})
+        prev_index = (prev_meta or {}).get("index", {})
+        # A KB still in the shared pre-shard collection is re-upserted in full (embeddings
+        # come from the cache) and then removed from the shared one.
+        self.legacy = bool(prev_meta) and prev_index.get("engine", "chroma") == "chroma" \
+            and not prev_index.get("collection")
+        self.carry_ids = set(prev_ids) if prev_index.get("engine", "chroma") == "chroma" and not self.legacy else set()
+        # Upserts land in the live shard; abort() takes back the ones the active version lacks
+        self.added: Set[str] = set()
+
+    def _metas(self, docs: List[Dict]) -> List[Dict]:
+        return [{"kb_id": self.kb_id, "version": self.kb_version_id, "doc": d["doc"], "title": d["title"]} for d in docs]
+
+    def add(self, docs: List[Dict], embeddings: List[List[float]]):
+        self.added.update(d["id"] for d in docs if d["id"] not in self.carry_ids)
+        self.coll.upsert(
+            ids=[d["id"] for d in docs],
+            embeddings=embeddings,
+            documents=[d["text"] for d in docs],
+            metadatas=self._metas(docs)
+        )
+
+    def keep(self, docs: List[Dict]):
+        # Re-point unchanged chunks at the new version without re-embedding them
+        self.coll.update(ids=[d["id"] for d in docs], metadatas=self._metas(docs))
+
+    def commit(self, removed_ids: List[str]) -> Dict:
+        if removed_ids and not self.legacy:
+            self.coll.delete(ids=removed_ids)
+        if self.legacy:
+            vectordb.get_collection().delete(where={"kb_id": self.kb_id})
+        vectordb.invalidate()
+        return {"engine": "chroma", "collection": vectordb.shard_name(self.kb_id)}
+
+    def abort(self):
+        ids = sorted(self.added)
+        for i in range(0, len(ids), 500):
+            self.coll.delete(ids=ids[i:i+500])
+        self.added.clear()
+        vectordb.invalidate()
+
+class ChromaEngine(IndexEngine):
+    """Chroma HNSW, one collection per KB (older KBs: the shared collection filtered by kb_id)."""
+    name = "chroma"
+
+    def reusable(self, index_meta: Dict) -> bool:
+        return super().reusable(index_meta) and bool(index_meta.get("collection"))
+
+    def writer(self, kb_id, kb_version_id, prev_version, prev_meta, prev_ids):
+        return ChromaWriter(kb_id, kb_version_id, prev_meta, prev_ids)
+
+    def _shard(self, kb_id: str):
+        """(collection, where filter) holding a KB's chunks."""
+        try:
+            return vectordb.get_shard(kb_id), None
+        except Exception:
+            return vectordb.get_collection(), {"kb_id": kb_id}
+
+    def search(self, kb_id, kb_version_id, q_emb, k):
+        coll, where = self._shard(kb_id)
+        # Chroma 0.5.x: ids are always returned, do NOT list them in include
+        res = coll.query(
+            query_embeddings=[q_emb],
+            n_results=k,
+            where=where,
+            include=["metadatas", "documents", "distances"]
+        )
+        space = (coll.metadata or {}).get("hnsw:space", "l2")
+        return [_hit(kb_id, cid, res["metadatas"][0][i], res["documents"][0][i],
+                     _similarity(space, float(res["distances"][0][i])), "vector")
+                for i, cid in enumerate(res["ids"][0])]
+
+    def fetch(self, kb_id, kb_version_id, ids, q_emb):
+        coll, _ = self._shard(kb_id)
+        space = (coll.metadata or {}).get("hnsw:space", "l2")
+        got = coll.get(ids=ids, include=["embeddings", "metadatas", "documents"])
+        return [_hit(kb_id, cid, meta, doc_text, _similarity(space, _distance(space, q_emb, list(emb))), "keyword")
+                for cid, emb, meta, doc_text in zip(got["ids"], got["embeddings"], got["metadatas"], got["documents"])]
+
+    def iter_chunks(self, kb_id, kb_version_id, page: int = 1000):
+        coll, where = self._shard(kb_id)
+        offset = 0
+        while True:
+            res = coll.get(where=where, include=["metadatas", "documents"], limit=page, offset=offset)
+            ids = res.get("ids") or []
+            if not ids:
+                break
+            for cid, doc, m in zip(ids, res["documents"], res["metadatas"]):
+                m = m or {}
+                yield {"id": cid, "kb_id": kb_id, "doc": m.get("doc", ""), "title": m.get("title", ""), "text": doc or ""}
+            offset += len(ids)
+
+    def drop(self, kb_id):
+        vectordb.drop_shard(kb_id)
+        try:
+            vectordb.get_collection().delete(where={"kb_id": kb_id})
+        except Exception:
+            pass
+        vectordb.invalidate()
+
+    def warm_up(self, kbs):
+        return {"collections": vectordb.warm_up_all()}
+
+_engines: Dict[str, IndexEngine] = {}
+
+def get_engine(name: Optional[str] = None) -> IndexEngine:
+    """Engine by meta["index"]["engine"] name; default is INDEX_ENGINE for new versions."""
+    name = name or INDEX_ENGINE
+    eng = _engines.get(name)
+    if eng is None:
+        if name == "chroma":
+            eng = ChromaEngine()
+        elif name == "numpy":
+            from .npindex import NumpyEngine  # needs numpy; only loaded when configured
+            eng = NumpyEngine()
+        else:
+            raise ValueError(f"Unknown index engine: {name}")
+        _engines[name] = eng
+    return eng
+
+def engine_names() -> List[str]:
+    return ["chroma", "numpy"]
@@ -1,10 +1,15 @@
-import os, json, time, hashlib
-from typing import Dict
-from ..core.config import UPLOADS_DIR, MAX_CHARS, OVERLAP_CHARS, EMBED_MODEL, CHROMA_DIR
-from ..utils.text import read_docx,read_pdf,read_markdown, normalize_markdown, split_heading_aware, file_digest,slugify_filename
-from ..core.ollama import embed_texts
-from .store import ensure_dir, version_path, write_meta
-import chromadb
+import os, json, time, hashlib, asyncio
+from typing import Callable, Dict, Iterator, List, Optional, Set, TextIO
+from ..core.config import UPLOADS_DIR, MAX_CHARS, OVERLAP_CHARS, EMBED_MODEL, INGEST_BATCH_SIZE
+from ..utils.text import file_digest,slugify_filename
+from ..utils.text import iter_normalized_lines, iter_heading_chunks
+from ..core.embed_cache import embed_texts_cached
+from .parsing import iter_file_text
+from .store import ensure_dir, version_path, write_meta, read_meta, active_version
+from .lexical import get_index
+from .index_engine import get_engine
+from . import vectordb
+from ..chat import answer_cache
 
 
 # def compute_manifest(upload_folder: str) -> Dict:
@@ -24,6 +29,17 @@ import chromadb
 #     src_manifest = hashlib.blake2b(json.dumps(files).encode("utf-8"), digest_size=16).hexdigest()
 #     return {"files": files, "bytes": total_bytes, "manifest": src_manifest}
 
+SUPPORTED_EXTS = (".md", ".pdf", ".docx")
+
+def file_manifest(file_name: str, digest: str, size: int) -> Dict:
+    """Manifest for one file from an already-computed blake2b digest and size."""
+    files = [{"path": file_name, "digest": digest, "size": size}]
+    
+    # Manifest hash for this single file
+    src_manifest = hashlib.blake2b(json.dumps(files).encode("utf-8"), digest_size=16).hexdigest()
+    
+    return {"files": files, "bytes": size, "manifest": src_manifest}
+
 def compute_file_manifest(file_path: str) -> Dict:
     """
     Compute the manifest for a single file instead of a folder.
@@ -32,37 +48,20 @@ def compute_file_manifest(file_path: str) -> Dict:
     if not os.path.isfile(file_path):
         raise FileNotFoundError(f"File not found: {file_path}")
     
-    if not file_path.lower().endswith((".md", ".pdf", ".docx")):
+    if not file_path.lower().endswith(SUPPORTED_EXTS):
         # Skip unsupported file types
         return {"files": [], "bytes": 0, "manifest": ""}
     
-    size = os.path.getsize(file_path)
-    # Compute digest of file content
+    # Compute digest of file content without holding it in memory
+    h = hashlib.blake2b(digest_size=16)
+    size = 0
     with open(file_path, "rb") as f:
-        content = f.read()
-        digest = hashlib.blake2b(content, digest_size=16).hexdigest()
-    
-    file_name = os.path.basename(file_path)
-    files = [{"path": file_name, "digest": digest, "size": size}]
+        for b in iter(lambda: f.read(1 << 20), b""):
+            h.update(b)
+            size += len(b)
     
-    # Manifest hash for this single file
-    src_manifest = hashlib.blake2b(json.dumps(files).encode("utf-8"), digest_size=16).hexdigest()
-    
-    return {"files": files, "bytes": size, "manifest": src_manifest}
-
+    return file_manifest(os.path.basename(file_path), h.hexdigest(), size)
 
-def read_file_by_type(file_path: str) -> str:
-    """Route file reading based on extension."""
-    ext = os.path.splitext(file_path)[1].lower()
-    if ext == ".md":
-        return read_markdown(file_path)
-    elif ext == ".pdf":
-        return read_pdf(file_path)
-    elif ext == ".docx":
-        return read_docx(file_path)
-    else:
-        raise ValueError(f"Unsupported file type: {ext}")
-    
 
 # async def ingest_folder(folder_name: str) -> Dict:
 #     upload_folder = os.path.join(UPLOADS_DIR, folder_name)
@@ -180,119 +179,269 @@ def read_file_by_type(file_path: str) -> str:
 #     }
 
 
-async def ingest_files(file_paths: list) -> Dict:
+def _report(progress: Optional[Callable], file_name: str, stage: str, **info):
+    if progress is not None:
+        progress(file_name, stage, info)
+
+def chunk_id(kb_id: str, title: str, text: str) -> str:
+    """Content-addressed chunk id: stable across re-ingests, independent of chunk position."""
+    h = hashlib.blake2b(f"{title}\0{text}".encode("utf-8"), digest_size=12).hexdigest()
+    return f"{kb_id}::{h}"
+
+def _chunks_manifest_path(kb_id: str, kb_version_id: str) -> str:
+    return os.path.join(version_path(kb_id, kb_version_id), "index", "chunks.json")
+
+def write_chunk_manifest(kb_id: str, kb_version_id: str, ids: List[str]):
+    path = _chunks_manifest_path(kb_id, kb_version_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"ids": sorted(ids)}, f)
+
+def read_chunk_manifest(kb_id: str, kb_version_id: str) -> Optional[List[str]]:
+    try:
+        with open(_chunks_manifest_path(kb_id, kb_version_id), "r", encoding="utf-8") as f:
+            return json.load(f).get("ids", [])
+    except FileNotFoundError:
+        return None
+
+def _previous_chunk_ids(kb_id: str, prev_version: Optional[str]) -> Set[str]:
+    if not prev_version:
+        return set()
+    ids = read_chunk_manifest(kb_id, prev_version)
+    if ids is not None:
+        return set(ids)
+    # Legacy versions (positional ids, shared Chroma collection) have no chunk manifest:
+    # ask the index what it holds.
+    got = vectordb.get_collection(create=True).get(where={"kb_id": kb_id}, include=[])
+    return set(got.get("ids") or [])
+
+def _same_build(prev_meta: Optional[Dict], manifest: Dict) -> bool:
+    if not prev_meta:
+        return False
+    return (
+        prev_meta.get("hashes", {}).get("source_manifest") == manifest["manifest"]
+        and prev_meta.get("embedding", {}).get("model") == EMBED_MODEL
+        and prev_meta.get("chunking", {}).get("max_chars") == MAX_CHARS
+        and prev_meta.get("chunking", {}).get("overlap_chars") == OVERLAP_CHARS
+        and prev_meta.get("chunk_ids") == "content_hash"
+        and not prev_meta.get("delta", {}).get("failed")
+        and get_engine().reusable(prev_meta.get("index", {}))
+    )
+
+def _tee_lines(lines: Iterator[str], w: TextIO, stats: Dict) -> Iterator[str]:
+    """Pass normalized lines through while writing them to the version's source copy."""
+    for i, line in enumerate(lines):
+        w.write(line if i == 0 else "\n" + line)
+        stats["chars"] += len(line) + (i > 0)
+        yield line
+
+def _iter_chunk_batches(file_path: str, out_path: str, kb_id: str, file_name: str,
+                        seen: Set[str], stats: Dict) -> Iterator[List[Dict]]:
+    """
+    Blocking generator: parse -> normalize -> chunk one file and yield lists of at most
+    INGEST_BATCH_SIZE new (deduped) chunks. Only one section window and one batch are held
+    in memory; chunk ids are recorded in seen.
+    """
+    batch: List[Dict] = []
+    with open(out_path, "w", encoding="utf-8") as w:
+        lines = _tee_lines(iter_normalized_lines(iter_file_text(file_path)), w, stats)
+        for ch in iter_heading_chunks(lines, MAX_CHARS, OVERLAP_CHARS):
+            text = (ch["text"] or "").strip()
+            if not text:
+                continue
+            cid = chunk_id(kb_id, ch["title"], text)
+            if cid in seen:
+                continue
+            seen.add(cid)
+            batch.append({"id": cid, "doc": file_name, "title": ch["title"], "text": text})
+            if len(batch) >= INGEST_BATCH_SIZE:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+async def ingest_files(file_paths: list, progress: Optional[Callable[[str, str, Dict], None]] = None,
+                       manifests: Optional[Dict[str, Dict]] = None) -> Dict:
+    """
+    Ingest each file as its own KB version, incrementally against the KB's active version:
+    an unchanged source is skipped, and otherwise only chunks whose content hash is new are
+    embedded/upserted while vanished ones are deleted. The file is streamed through
+    parse -> chunk -> embed -> upsert in INGEST_BATCH_SIZE batches (the next batch is parsed
+    while the current one embeds), so memory stays bounded for very large documents.
+    progress(file_name, stage, info) reports "parsed" once the first piece of the file has been
+    parsed, "chunked" and "embedded" once per batch with running counts, then "upserted" and
+    "done".
+    manifests maps file path -> manifest computed while the upload was written, so the
+    file is not re-read just to hash it.
+    """
     all_kb_data = []  # List to store each file's KB metadata
-    print("here")
     for file_path in file_paths:
-        print("here0")
-        documents = []  # Reset documents per file
         file_name = os.path.basename(file_path)
-        print(file_name)
         kb_id = slugify_filename(file_name)
-        print("here1")
         # Step 1: Compute manifest for this file
-        manifest = compute_file_manifest(file_path)
+        manifest = (manifests or {}).get(file_path) or await asyncio.to_thread(compute_file_manifest, file_path)
         if not manifest["files"]:
             raise ValueError(f"No valid files found for {file_name}")
 
+        prev_version = active_version(kb_id)
+        prev_meta = read_meta(kb_id, prev_version) if prev_version else None
+        if _same_build(prev_meta, manifest):
+            all_kb_data.append({
+                "kb_id": kb_id,
+                "kb_version_id": prev_version,
+                "files": 1,
+                "chunks": prev_meta.get("chunks", 0),
+                "created_at": prev_meta.get("created_at"),
+                "embedding": EMBED_MODEL,
+                "index_engine": prev_meta.get("index", {}).get("engine", "chroma"),
+                "skipped": True,
+                "added": 0,
+                "removed": 0,
+                "unchanged": prev_meta.get("chunks", 0),
+            })
+            _report(progress, file_name, "done", kb_id=kb_id, kb_version_id=prev_version, skipped=True)
+            continue
+
         ts = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
         ver_digest = hashlib.blake2b(
             (manifest["manifest"] + f"|max{MAX_CHARS}|ov{OVERLAP_CHARS}|embed:{EMBED_MODEL}")
             .encode("utf-8"), digest_size=6
         ).hexdigest()
-        kb_version_id = f"{ts[:10]}--b3_{ver_digest}"
+        kb_version_id = base_version_id = f"{ts[:10]}--b3_{ver_digest}"
+        # A same-day rebuild of the same manifest (e.g. after failed chunks) must not reuse the
+        # directory: the index writer clears its output, which may be the live version's
+        n = 1
+        while os.path.exists(version_path(kb_id, kb_version_id)):
+            n += 1
+            kb_version_id = f"{base_version_id}-{n}"
 
         # Step 2: Set up source directory
         src_dir = os.path.join(version_path(kb_id, kb_version_id), "source")
         ensure_dir(src_dir)
 
-        # Step 3: Read and normalize file content
-        raw_text = read_file_by_type(file_path)
-        norm = normalize_markdown(raw_text)
+        # Step 3: Diff target: the chunk ids of the active version. The index engine decides
+        # which of them it can carry over (same engine) and which must be re-added; re-adding
+        # is cheap since embeddings come from the cache.
+        # Index/disk calls below run in worker threads: ingest shares the event loop with chat traffic
+        prev_ids = await asyncio.to_thread(_previous_chunk_ids, kb_id, prev_version)
+        prev_engine = (prev_meta or {}).get("index", {}).get("engine", "chroma") if prev_version else None
+        engine = get_engine()
+        writer = await asyncio.to_thread(engine.writer, kb_id, kb_version_id, prev_version, prev_meta, prev_ids)
+        carry_ids = writer.carry_ids
+        lex = get_index()
+        lex_token = f"{kb_id}/{kb_version_id}"
 
-        # Save normalized content
+        # Step 4: Stream parse/chunk batches (worker thread + process pool) into embed/upsert.
+        # Ids are content hashes, duplicates collapse; unchanged chunks are only re-pointed.
         out_path = os.path.join(src_dir, file_name)
         os.makedirs(os.path.dirname(out_path), exist_ok=True)
-        with open(out_path, "w", encoding="utf-8") as w:
-            w.write(norm)
+        seen: Set[str] = set()
+        stats = {"chars": 0}
+        batches = _iter_chunk_batches(file_path, out_path, kb_id, file_name, seen, stats)
+        loop = asyncio.get_running_loop()
+        next_batch = lambda: next(batches, None)
+        current_ids: List[str] = []
+        added = unchanged = failed = 0
+        pending = loop.run_in_executor(None, next_batch)
+        committed = False
+        parsed = False
+        try:
+            while True:
+                batch = await pending
+                if not parsed:
+                    _report(progress, file_name, "parsed", chars=stats["chars"])
+                    parsed = True
+                if batch is None:
+                    break
+                pending = loop.run_in_executor(None, next_batch)
+                _report(progress, file_name, "chunked", chunks=len(seen), chars=stats["chars"])
 
-        # Step 4: Chunk text
-        chunks = split_heading_aware(norm, MAX_CHARS, OVERLAP_CHARS)
-        for i, ch in enumerate(chunks):
-            text = (ch["text"] or "").strip()
-            if not text:
-                continue
-            documents.append({
-                "id": f"{file_name}::chunk{i}",
-                "doc": file_name,
-                "title": ch["title"],
-                "text": text
-            })
+                new_docs = [d for d in batch if d["id"] not in carry_ids]
+                kept_docs = [d for d in batch if d["id"] in carry_ids]
+                docs, embeddings = [], []
+                embs = await embed_texts_cached([d["text"] for d in new_docs])
+                for d, e in zip(new_docs, embs):
+                    if not (isinstance(e, list) and len(e) > 0):
+                        continue
+                    docs.append(d)
+                    embeddings.append(e)
 
-        if not documents:
-            raise ValueError(f"No ingestible text chunks found for {file_name} (all files were empty/headers-only).")
+                if docs:
+                    await asyncio.to_thread(writer.add, docs, embeddings)
+                    # Staged only: the lexical index changes once the vector index has committed
+                    await asyncio.to_thread(lex.stage, lex_token, [{**d, "kb_id": kb_id} for d in docs])
+                if kept_docs:
+                    await asyncio.to_thread(writer.keep, kept_docs)
+                current_ids += [d["id"] for d in docs] + [d["id"] for d in kept_docs]
+                added += len(docs)
+                unchanged += len(kept_docs)
+                failed += len(new_docs) - len(docs)
+                _report(progress, file_name, "embedded", chunks=len(seen), embedded=added,
+                        failed=failed, unchanged=unchanged)
 
-        # Step 5: Chroma DB
-        client = chromadb.PersistentClient(path=CHROMA_DIR)
-        coll_name = "chatbot"
-        try:
-            coll = client.get_collection(name=coll_name)
-        except Exception:
-            coll = client.create_collection(name=coll_name, metadata={"kb_id": kb_id, "kb_version_id": kb_version_id})
-
-        # Step 6: Batch embeddings
-        batch = 64
-        ids, embeddings, metadatas, texts = [], [], [], []
-        for i in range(0, len(documents), batch):
-            batch_docs = [d for d in documents[i:i+batch] if d["text"].strip()]
-            if not batch_docs:
-                continue
-            btexts = [d["text"] for d in batch_docs]
-            embs = await embed_texts(btexts)
-            cleaned = [(d, e) for d, e in zip(batch_docs, embs) if isinstance(e, list) and len(e) > 0]
-            for d, e in cleaned:
-                ids.append(d["id"])
-                embeddings.append(e)
-                metadatas.append({"doc": d["doc"], "title": d["title"]})
-                texts.append(d["text"])
-
-        if not ids:
-            raise ValueError("Embedding failed or returned empty vectors. Check your Ollama embed model.")
-
-        # Step 7: Upsert into Chroma
-        coll.upsert(
-            ids=ids,
-            embeddings=embeddings,
-            documents=texts,
-            metadatas=[{"kb_id": kb_id, "version": kb_version_id, "doc": d["doc"]} for d in documents]
-        )
-
-        # Step 8: Write metadata
+            if not seen:
+                raise ValueError(f"No ingestible text chunks found for {file_name} (all files were empty/headers-only).")
+            if added == 0 and failed:
+                raise ValueError("Embedding failed or returned empty vectors. Check your Ollama embed model.")
+
+            # Step 5: Drop chunks that vanished from the source and finish the index
+            removed_ids = sorted(prev_ids - seen)
+            index_meta = await asyncio.to_thread(writer.commit, removed_ids)
+            committed = True
+        finally:
+            if not committed:
+                try:
+                    await asyncio.to_thread(writer.abort)
+                except Exception as e:  # keep the ingest error, not the cleanup one
+                    print(f"ingest {kb_id}: index abort failed: {e}")
+                await asyncio.to_thread(lex.discard, lex_token)
+            if not pending.done():
+                await asyncio.wait([pending])
+            try:
+                batches.close()
+            except ValueError:
+                pass  # still running in a cancelled executor call; it ends with the thread
+
+        if prev_engine and prev_engine != engine.name:
+            await asyncio.to_thread(get_engine(prev_engine).drop, kb_id)
+        await asyncio.to_thread(lex.apply, lex_token, removed_ids)
+        _report(progress, file_name, "upserted", chars=stats["chars"], upserted=added, removed=len(removed_ids))
+
+        # Step 6: Write chunk manifest and metadata
+        await asyncio.to_thread(write_chunk_manifest, kb_id, kb_version_id, current_ids)
         meta = {
             "kb_id": kb_id,
             "kb_version_id": kb_version_id,
             "created_at": ts,
             "source_stats": {"files": len(manifest["files"]), "bytes": manifest["bytes"]},
             "chunking": {"mode": "heading_aware", "max_chars": MAX_CHARS, "overlap_chars": OVERLAP_CHARS},
+            "chunk_ids": "content_hash",
             "embedding": {"model": EMBED_MODEL},
-            "index": {"engine": "chroma"},
-            "chunks": len(ids),
+            "index": index_meta,
+            "chunks": len(current_ids),
+            "delta": {"added": added, "removed": len(removed_ids), "unchanged": unchanged,
+                      "failed": failed, "base_version": prev_version},
             "hashes": {"source_manifest": manifest["manifest"], "full_version": ver_digest},
             "tags": []
         }
-        write_meta(kb_id, kb_version_id, meta)
+        await asyncio.to_thread(write_meta, kb_id, kb_version_id, meta)
+        answer_cache.invalidate()
 
-        # Step 9: Append to all KBs list
+        # Step 7: Append to all KBs list
         all_kb_data.append({
             "kb_id": kb_id,
             "kb_version_id": kb_version_id,
             "files": 1,
-            "chunks": len(ids),
+            "chunks": len(current_ids),
             "created_at": ts,
             "embedding": EMBED_MODEL,
-            "index_engine": "chroma",
-            # "success": true
+            "index_engine": engine.name,
+            "skipped": False,
+            "added": added,
+            "removed": len(removed_ids),
+            "unchanged": unchanged,
         })
+        _report(progress, file_name, "done", kb_id=kb_id, kb_version_id=kb_version_id)
 
-    # Step 10: Return all KBs
+    # Step 8: Return all KBs
     return {"kb_ids": all_kb_data}
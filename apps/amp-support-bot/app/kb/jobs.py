@@ -0,0 +1,178 @@
+import os, json, time, uuid, asyncio, threading
+from typing import Dict, List, Optional
+from ..core.config import JOBS_DIR, INGEST_WORKERS
+from .ingest import ingest_files
+from ..utils.text import slugify_filename
+
+# Job state lives in one JSON file per job under JOBS_DIR, rewritten atomically as the
+# job progresses, so a restart can pick up whatever was queued or running.
+_lock = threading.Lock()
+_jobs: Dict[str, Dict] = {}
+_queue: Optional[asyncio.Queue] = None
+_workers: List[asyncio.Task] = []
+# Jobs run in parallel across KBs but one at a time per KB: two ingests of the same file
+# would diff against the same active version and write the same index concurrently.
+_kb_locks: Dict[str, asyncio.Lock] = {}
+# Progress callbacks run on the event loop; their saves are coalesced into one write per
+# job every PROGRESS_SAVE_INTERVAL_S, done in a worker thread.
+PROGRESS_SAVE_INTERVAL_S = 0.5
+_flushes: Dict[str, asyncio.Task] = {}
+
+def _job_path(job_id: str) -> str:
+    return os.path.join(JOBS_DIR, f"{job_id}.json")
+
+def _now() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+def _write(job_id: str, text: str):
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    tmp = _job_path(job_id) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, _job_path(job_id))
+
+def _save(job: Dict):
+    job["updated_at"] = _now()
+    _write(job["job_id"], json.dumps(job, indent=2))
+
+def _save_snapshot(job: Dict):
+    """_save from a worker thread: serialize under the lock, write outside it."""
+    with _lock:
+        job["updated_at"] = _now()
+        text = json.dumps(job, indent=2)
+    _write(job["job_id"], text)
+
+async def _flush(job: Dict):
+    try:
+        await asyncio.sleep(PROGRESS_SAVE_INTERVAL_S)
+        await asyncio.to_thread(_save_snapshot, job)
+    except Exception as e:
+        print(f"ingest job {job['job_id']}: saving progress failed: {e}")
+    finally:
+        _flushes.pop(job["job_id"], None)
+
+def _schedule_save(job: Dict):
+    if job["job_id"] not in _flushes:
+        _flushes[job["job_id"]] = asyncio.get_running_loop().create_task(_flush(job))
+
+def get_job(job_id: str) -> Optional[Dict]:
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is not None:
+            return json.loads(json.dumps(job))
+    try:
+        with open(_job_path(job_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def list_jobs(limit: int = 50) -> List[Dict]:
+    if not os.path.isdir(JOBS_DIR):
+        return []
+    names = sorted((n for n in os.listdir(JOBS_DIR) if n.endswith(".json")),
+                   key=lambda n: os.path.getmtime(os.path.join(JOBS_DIR, n)), reverse=True)
+    return [j for j in (get_job(n[:-5]) for n in names[:limit]) if j]
+
+def submit(folder_name: str, file_paths: List[str], manifests: Optional[Dict[str, Dict]] = None) -> Dict:
+    """Persist a queued job and hand it to the worker pool."""
+    manifests = manifests or {}
+    job = {
+        "job_id": uuid.uuid4().hex[:12],
+        "folder_name": folder_name,
+        "status": "queued",
+        "created_at": _now(),
+        "files": [{"path": p, "name": os.path.basename(p), "stage": "queued", "info": {}, "manifest": manifests.get(p)}
+                  for p in file_paths],
+        "result": [],
+        "error": None,
+    }
+    with _lock:
+        _jobs[job["job_id"]] = job
+        _save(job)
+    _queue.put_nowait(job["job_id"])
+    return job
+
+def _progress(job: Dict, file_entry: Dict):
+    def cb(file_name: str, stage: str, info: Dict):
+        with _lock:
+            file_entry["stage"] = stage
+            file_entry["info"].update(info)
+        _schedule_save(job)
+    return cb
+
+async def _run_job(job_id: str):
+    with _lock:
+        job = _jobs[job_id]
+        job["status"] = "running"
+        job["started_at"] = _now()
+    await asyncio.to_thread(_save_snapshot, job)
+
+    async def run_file(entry: Dict) -> bool:
+        try:
+            manifests = {entry["path"]: entry["manifest"]} if entry.get("manifest") else None
+            kb_lock = _kb_locks.setdefault(slugify_filename(entry["name"]), asyncio.Lock())
+            async with kb_lock:
+                out = await ingest_files([entry["path"]], progress=_progress(job, entry), manifests=manifests)
+            with _lock:
+                job["result"].extend(out["kb_ids"])
+            return True
+        except Exception as e:
+            with _lock:
+                entry["stage"] = "failed"
+                entry["error"] = f"{e.__class__.__name__}: {e}"
+            _schedule_save(job)
+            return False
+
+    # Each file is its own KB, so a job's files are parsed and ingested concurrently.
+    pending = [e for e in job["files"] if e["stage"] != "done"]
+    ok = await asyncio.gather(*(run_file(e) for e in pending))
+    failed = sum(1 for x in ok if not x)
+    flush = _flushes.get(job_id)
+    if flush is not None:
+        await flush  # never two writers on the job file
+    with _lock:
+        job["status"] = "failed" if failed == len(job["files"]) else ("partial" if failed else "succeeded")
+        job["finished_at"] = _now()
+    await asyncio.to_thread(_save_snapshot, job)
+    with _lock:
+        _jobs.pop(job_id, None)
+
+async def _worker():
+    while True:
+        job_id = await _queue.get()
+        try:
+            await _run_job(job_id)
+        except Exception as e:
+            print(f"ingest job {job_id} crashed: {e}")
+        finally:
+            _queue.task_done()
+
+def _recover():
+    """Re-queue jobs left queued/running by a previous process; ingest is idempotent per chunk id."""
+    if not os.path.isdir(JOBS_DIR):
+        return
+    for n in os.listdir(JOBS_DIR):
+        if not n.endswith(".json"):
+            continue
+        job = get_job(n[:-5])
+        if not job or job.get("status") not in ("queued", "running"):
+            continue
+        job["status"] = "queued"
+        job["recovered"] = True
+        with _lock:
+            _jobs[job["job_id"]] = job
+            _save(job)
+        _queue.put_nowait(job["job_id"])
+
+async def start(workers: int = INGEST_WORKERS):
+    global _queue
+    _queue = asyncio.Queue()
+    _recover()
+    for i in range(max(1, workers)):
+        _workers.append(asyncio.create_task(_worker(), name=f"ingest-worker-{i}"))
+
+async def stop():
+    for t in _workers:
+        t.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
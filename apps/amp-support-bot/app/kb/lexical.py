@@ -0,0 +1,248 @@
+import os, re, json, math, heapq, sqlite3, threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from ..core.config import LEXICAL_DIR, BM25_K1, BM25_B, LEXICAL_MAX_DF_RATIO
+
+INDEX_PATH = os.path.join(LEXICAL_DIR, "bm25.sqlite")
+LEGACY_JSON_PATH = os.path.join(LEXICAL_DIR, "bm25.json")
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Function words carry no BM25 signal but have postings as long as the corpus
+STOPWORDS = frozenset("""
+a an the and or but if of in on at to for by with from into about as is are was were be been being
+am do does did have has had it its this that these those there here i me my we our you your he she
+him her they them their what which who whom whose when where why how not no so than then too very
+can could will would shall should may might must just also any all each some such only own same
+""".split())
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall((text or "").lower())
+
+class LexicalIndex:
+    """
+    Inverted index with BM25 statistics over KB chunks, in SQLite.
+    postings: (term, kb_id, chunk row) -> term frequency and chunk length, clustered by term and
+    KB, so a query reads only the postings of its terms within the requested KBs; terms keeps
+    each term's document frequency. Chunk text is not stored (hits are re-read from the index
+    engine). Writes are incremental; ingest stages a version's chunks and applies them together
+    with its removals once the vector index has committed.
+    """
+
+    def __init__(self, path: str = INDEX_PATH):
+        self.path = path
+        self._lock = threading.RLock()  # one writer at a time
+        self._rlock = threading.Lock()  # readers use their own connection (WAL)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = self._connect()
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (
+                row INTEGER PRIMARY KEY,
+                id TEXT UNIQUE NOT NULL,
+                kb_id TEXT NOT NULL,
+                len INTEGER NOT NULL,
+                terms TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_docs_kb ON docs(kb_id);
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                kb_id TEXT NOT NULL,
+                row INTEGER NOT NULL,
+                tf INTEGER NOT NULL,
+                len INTEGER NOT NULL,
+                PRIMARY KEY (term, kb_id, row)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS pending (token TEXT NOT NULL, id TEXT NOT NULL, kb_id TEXT NOT NULL,
+                                                len INTEGER NOT NULL, tf TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS idx_pending_token ON pending(token);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value) WITHOUT ROWID;
+            INSERT OR IGNORE INTO meta (key, value) VALUES ('docs', 0), ('total_len', 0);
+        """)
+        # Staged chunks of an ingest that never finished (crash/restart) are not applied
+        self._conn.execute("DELETE FROM pending")
+        self._conn.commit()
+        self._rconn = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def exists(self) -> bool:
+        """Whether the index has been built from the vector indexes (see rebuild)."""
+        with self._rlock:
+            return self._rconn.execute("SELECT 1 FROM meta WHERE key='built'").fetchone() is not None
+
+    @staticmethod
+    def _term_freqs(ch: Dict) -> Tuple[int, Dict[str, int]]:
+        toks = tokenize(ch.get("title", "") + " " + ch["text"])
+        tf: Dict[str, int] = {}
+        for t in toks:
+            tf[t] = tf.get(t, 0) + 1
+        return len(toks), tf
+
+    # --- write side (callers hold self._lock and commit) ---
+
+    def _remove(self, chunk_id: str) -> bool:
+        c = self._conn
+        row = c.execute("SELECT row, kb_id, len, terms FROM docs WHERE id=?", (chunk_id,)).fetchone()
+        if not row:
+            return False
+        r, kb_id, dl, terms = row
+        terms = terms.split(" ") if terms else []
+        c.executemany("DELETE FROM postings WHERE term=? AND kb_id=? AND row=?", [(t, kb_id, r) for t in terms])
+        c.executemany("UPDATE terms SET df = df - 1 WHERE term=?", [(t,) for t in terms])
+        c.execute("DELETE FROM docs WHERE row=?", (r,))
+        c.execute("UPDATE meta SET value = value - 1 WHERE key='docs'")
+        c.execute("UPDATE meta SET value = value - ? WHERE key='total_len'", (dl,))
+        return True
+
+    def _add(self, chunk_id: str, kb_id: str, dl: int, tf: Dict[str, int]):
+        c = self._conn
+        self._remove(chunk_id)
+        cur = c.execute("INSERT INTO docs (id, kb_id, len, terms) VALUES (?,?,?,?)",
+                        (chunk_id, kb_id, dl, " ".join(tf)))
+        r = cur.lastrowid
+        c.executemany("INSERT INTO postings (term, kb_id, row, tf, len) VALUES (?,?,?,?,?)",
+                      [(t, kb_id, r, n, dl) for t, n in tf.items()])
+        c.executemany("INSERT INTO terms (term, df) VALUES (?, 1) ON CONFLICT(term) DO UPDATE SET df = df + 1",
+                      [(t,) for t in tf])
+        c.execute("UPDATE meta SET value = value + 1 WHERE key='docs'")
+        c.execute("UPDATE meta SET value = value + ? WHERE key='total_len'", (dl,))
+
+    def _write(self, fn, *args):
+        with self._lock:
+            try:
+                out = fn(*args)
+                self._conn.commit()
+                return out
+            except BaseException:
+                self._conn.rollback()
+                raise
+
+    def add_chunks(self, chunks: List[Dict]):
+        """chunks: [{"id", "kb_id", "title", "text"}]; an existing id is replaced."""
+        def run():
+            for ch in chunks:
+                dl, tf = self._term_freqs(ch)
+                self._add(ch["id"], ch.get("kb_id", ""), dl, tf)
+        self._write(run)
+
+    def stage(self, token: str, chunks: List[Dict]):
+        """Tokenize chunks now but keep them out of the index until apply(token)."""
+        rows = []
+        for ch in chunks:
+            dl, tf = self._term_freqs(ch)
+            rows.append((token, ch["id"], ch.get("kb_id", ""), dl, json.dumps(tf)))
+        self._write(lambda: self._conn.executemany(
+            "INSERT INTO pending (token, id, kb_id, len, tf) VALUES (?,?,?,?,?)", rows))
+
+    def apply(self, token: str, removed_ids: Iterable[str] = ()):
+        """Add the chunks staged under token and remove removed_ids, in one transaction."""
+        def run():
+            staged = self._conn.execute("SELECT id, kb_id, len, tf FROM pending WHERE token=?", (token,)).fetchall()
+            for cid, kb_id, dl, tf in staged:
+                self._add(cid, kb_id, dl, json.loads(tf))
+            for cid in removed_ids:
+                self._remove(cid)
+            self._conn.execute("DELETE FROM pending WHERE token=?", (token,))
+        self._write(run)
+
+    def discard(self, token: str):
+        self._write(lambda: self._conn.execute("DELETE FROM pending WHERE token=?", (token,)))
+
+    def remove_ids(self, ids: List[str]):
+        self._write(lambda: [self._remove(cid) for cid in ids])
+
+    def remove_kb(self, kb_id: str) -> int:
+        def run():
+            ids = [r[0] for r in self._conn.execute("SELECT id FROM docs WHERE kb_id=?", (kb_id,)).fetchall()]
+            for cid in ids:
+                self._remove(cid)
+            return len(ids)
+        return self._write(run)
+
+    # --- read side ---
+
+    def kb_of(self, chunk_id: str) -> str:
+        with self._rlock:
+            row = self._rconn.execute("SELECT kb_id FROM docs WHERE id=?", (chunk_id,)).fetchone()
+        return row[0] if row else ""
+
+    def search(self, query: str, k: int, kb_ids: Optional[Set[str]] = None) -> List[Tuple[str, float]]:
+        """
+        BM25 top-k; kb_ids restricts candidates to those KBs (corpus statistics stay global).
+        Stopwords are ignored, as are terms in more than LEXICAL_MAX_DF_RATIO of all chunks
+        (unless nothing else is left), so no query walks a corpus-sized postings list.
+        """
+        terms = [t for t in set(tokenize(query)) if t not in STOPWORDS]
+        if not terms:
+            return []
+        kbs = sorted(kb_ids) if kb_ids is not None else None
+        if kbs is not None and not kbs:
+            return []
+        with self._rlock:
+            c = self._rconn
+            c.execute("BEGIN")  # one snapshot for stats and postings
+            try:
+                meta = dict(c.execute("SELECT key, value FROM meta WHERE key IN ('docs', 'total_len')").fetchall())
+                n = int(meta.get("docs") or 0)
+                if not n:
+                    return []
+                avgdl = (meta.get("total_len") or 0) / n or 1.0
+                dfs = dict(c.execute(
+                    f"SELECT term, df FROM terms WHERE df > 0 AND term IN ({','.join('?' * len(terms))})", terms
+                ).fetchall())
+                if not dfs:
+                    return []
+                use = [t for t in dfs if dfs[t] <= LEXICAL_MAX_DF_RATIO * n] or [min(dfs, key=dfs.get)]
+                scores: Dict[int, float] = {}
+                kb_sql = f" AND kb_id IN ({','.join('?' * len(kbs))})" if kbs is not None else ""
+                for term in use:
+                    df = dfs[term]
+                    idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+                    for r, tf, dl in c.execute(f"SELECT row, tf, len FROM postings WHERE term=?{kb_sql}",
+                                               [term] + (kbs or [])):
+                        denom = tf + BM25_K1 * (1.0 - BM25_B + BM25_B * dl / avgdl)
+                        scores[r] = scores.get(r, 0.0) + idf * tf * (BM25_K1 + 1.0) / denom
+                top = heapq.nlargest(k, scores.items(), key=lambda kv: kv[1])
+                if not top:
+                    return []
+                ids = dict(c.execute(
+                    f"SELECT row, id FROM docs WHERE row IN ({','.join('?' * len(top))})", [r for r, _ in top]
+                ).fetchall())
+            finally:
+                c.execute("COMMIT")
+        return [(ids[r], s) for r, s in top if r in ids]
+
+    def rebuild(self, chunks: Iterable[Dict]):
+        """One-off migration: index every chunk already stored in the vector indexes."""
+        with self._lock:
+            c = self._conn
+            try:
+                for table in ("docs", "postings", "terms"):
+                    c.execute(f"DELETE FROM {table}")
+                c.execute("UPDATE meta SET value = 0 WHERE key IN ('docs', 'total_len')")
+                for ch in chunks:
+                    dl, tf = self._term_freqs(ch)
+                    self._add(ch["id"], ch.get("kb_id", ""), dl, tf)
+                c.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('built', 1)")
+                c.commit()
+            except BaseException:
+                c.rollback()
+                raise
+        try:
+            os.remove(LEGACY_JSON_PATH)  # the former single-file index
+        except FileNotFoundError:
+            pass
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_index() -> LexicalIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = LexicalIndex()
+        return _index
@@ -0,0 +1,243 @@
+import os, sqlite3, threading
+from typing import Dict, List, Optional, Set, Tuple
+import numpy as np
+from ..core.config import NUMPY_INDEX_DTYPE
+from .index_engine import IndexEngine, IndexWriter
+from .store import version_path
+
+# Exact search over one memory-mapped matrix per KB version:
+#   index/vectors.npy   unit-normalized embeddings, float16 or int8 (row-scaled)
+#   index/scales.npy    per-row float32 scale (int8 only)
+#   index/chunks.sqlite row -> chunk id, doc, title, text
+# Scores are cosine similarities. Only the rows of a block are ever upcast to float32.
+_BLOCK_ROWS = 8192
+
+def _index_dir(kb_id: str, kb_version_id: str) -> str:
+    return os.path.join(version_path(kb_id, kb_version_id), "index")
+
+def _unit(a: np.ndarray) -> np.ndarray:
+    n = np.linalg.norm(a, axis=-1, keepdims=True)
+    return a / np.where(n == 0, 1.0, n)
+
+def _quantize(vecs: np.ndarray, dtype: str) -> Tuple[np.ndarray, np.ndarray]:
+    u = _unit(vecs.astype(np.float32))
+    if dtype == "int8":
+        scale = np.abs(u).max(axis=1) / 127.0
+        scale[scale == 0] = 1.0
+        return np.rint(u / scale[:, None]).astype(np.int8), scale.astype(np.float32)
+    return u.astype(np.float16), np.ones(len(u), dtype=np.float32)
+
+class _Version:
+    """Read side of one built version: the memmap plus its chunk side table."""
+
+    def __init__(self, path: str):
+        self.mat = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        scales = os.path.join(path, "scales.npy")
+        self.scales = np.load(scales) if os.path.exists(scales) else None
+        self._conn = sqlite3.connect(os.path.join(path, "chunks.sqlite"), check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.mat.shape[0]
+
+    def close(self):
+        self._conn.close()
+
+    def scores(self, q: List[float], rows: Optional[np.ndarray] = None) -> np.ndarray:
+        qv = _unit(np.asarray(q, dtype=np.float32))
+        if rows is not None:
+            out = self.mat[rows].astype(np.float32) @ qv
+            return out * self.scales[rows] if self.scales is not None else out
+        out = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), _BLOCK_ROWS):
+            end = min(len(self), start + _BLOCK_ROWS)
+            out[start:end] = self.mat[start:end].astype(np.float32) @ qv
+        return out * self.scales if self.scales is not None else out
+
+    def top(self, q: List[float], k: int) -> List[Tuple[int, float]]:
+        n = len(self)
+        if not n or k <= 0:
+            return []
+        s = self.scores(q)
+        k = min(k, n)
+        idx = np.argpartition(-s, k - 1)[:k]
+        idx = idx[np.argsort(-s[idx])]
+        return [(int(i), float(s[i])) for i in idx]
+
+    def chunks(self, rows: List[int]) -> Dict[int, Tuple[str, str, str, str]]:
+        """row -> (id, doc, title, text)"""
+        out = {}
+        with self._lock:
+            for i in range(0, len(rows), 500):
+                part = rows[i:i+500]
+                for r in self._conn.execute(
+                    f"SELECT row, id, doc, title, text FROM chunks WHERE row IN ({','.join('?' * len(part))})", part
+                ):
+                    out[r[0]] = r[1:]
+        return out
+
+    def rows_for(self, ids: List[str]) -> Dict[str, int]:
+        out = {}
+        with self._lock:
+            for i in range(0, len(ids), 500):
+                part = ids[i:i+500]
+                out.update(self._conn.execute(
+                    f"SELECT id, row FROM chunks WHERE id IN ({','.join('?' * len(part))})", part
+                ).fetchall())
+        return out
+
+    def iter_all(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT id, doc, title, text FROM chunks ORDER BY row").fetchall()
+        yield from rows
+
+class NumpyWriter(IndexWriter):
+    """Appends quantized rows to a raw temp file, then lays them out as vectors.npy on commit."""
+
+    def __init__(self, engine: "NumpyEngine", kb_id: str, kb_version_id: str,
+                 prev_version: Optional[str], prev_meta: Optional[Dict], prev_ids: Set[str]):
+        self.engine, self.kb_id, self.kb_version_id = engine, kb_id, kb_version_id
+        self.dir = _index_dir(kb_id, kb_version_id)
+        os.makedirs(self.dir, exist_ok=True)
+        self.dtype = NUMPY_INDEX_DTYPE
+        self.dim = 0
+        self.rows = 0
+        self.scales: List[np.ndarray] = []
+        self._tmp_path = os.path.join(self.dir, "vectors.tmp")
+        self._tmp = open(self._tmp_path, "wb")
+        db_path = os.path.join(self.dir, "chunks.sqlite")
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        # Used from whichever worker thread ingest runs the next step on, one call at a time
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE chunks (row INTEGER PRIMARY KEY, id TEXT UNIQUE, doc TEXT, title TEXT, text TEXT)")
+        # Unchanged chunks are copied row-for-row from the previous version's matrix
+        self.prev = None
+        prev_index = (prev_meta or {}).get("index", {})
+        if prev_version and prev_index.get("engine") == "numpy" and prev_index.get("dtype") == self.dtype:
+            self.prev = engine.open(kb_id, prev_version)
+        self.carry_ids = set(prev_ids) if self.prev is not None else set()
+
+    def _append(self, docs: List[Dict], q: np.ndarray, scale: np.ndarray):
+        if not self.dim:
+            self.dim = q.shape[1]
+        elif q.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension changed: {q.shape[1]} != {self.dim}")
+        self._tmp.write(np.ascontiguousarray(q).tobytes())
+        self.scales.append(scale)
+        self._conn.executemany(
+            "INSERT INTO chunks (row, id, doc, title, text) VALUES (?,?,?,?,?)",
+            [(self.rows + i, d["id"], d["doc"], d["title"], d["text"]) for i, d in enumerate(docs)]
+        )
+        self.rows += len(docs)
+
+    def add(self, docs, embeddings):
+        q, scale = _quantize(np.asarray(embeddings, dtype=np.float32), self.dtype)
+        self._append(docs, q, scale)
+
+    def keep(self, docs):
+        found = self.prev.rows_for([d["id"] for d in docs])
+        docs = [d for d in docs if d["id"] in found]
+        if not docs:
+            return
+        rows = np.array([found[d["id"]] for d in docs])
+        scale = self.prev.scales[rows] if self.prev.scales is not None else np.ones(len(rows), dtype=np.float32)
+        self._append(docs, np.asarray(self.prev.mat[rows]), scale)
+
+    def commit(self, removed_ids):
+        self._tmp.close()
+        dtype = np.int8 if self.dtype == "int8" else np.float16
+        out = np.lib.format.open_memmap(os.path.join(self.dir, "vectors.npy"), mode="w+",
+                                        dtype=dtype, shape=(self.rows, self.dim))
+        if self.rows:
+            src = np.memmap(self._tmp_path, dtype=dtype, mode="r", shape=(self.rows, self.dim))
+            for start in range(0, self.rows, _BLOCK_ROWS):
+                out[start:start + _BLOCK_ROWS] = src[start:start + _BLOCK_ROWS]
+            del src
+        out.flush()
+        del out
+        os.remove(self._tmp_path)
+        if self.dtype == "int8":
+            scales = np.concatenate(self.scales) if self.scales else np.zeros(0, dtype=np.float32)
+            np.save(os.path.join(self.dir, "scales.npy"), scales.astype(np.float32))
+        self._conn.commit()
+        self._conn.close()
+        self.engine.release_others(self.kb_id, self.kb_version_id)
+        return {"engine": "numpy", "dtype": self.dtype, "dim": self.dim, "rows": self.rows}
+
+    def abort(self):
+        try:
+            self._tmp.close()
+            self._conn.close()
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+
+class NumpyEngine(IndexEngine):
+    name = "numpy"
+
+    def __init__(self):
+        self._open: Dict[Tuple[str, str], _Version] = {}
+        self._lock = threading.Lock()
+
+    def open(self, kb_id: str, kb_version_id: str) -> _Version:
+        key = (kb_id, kb_version_id)
+        with self._lock:
+            v = self._open.get(key)
+            if v is None:
+                v = _Version(_index_dir(kb_id, kb_version_id))
+                self._open[key] = v
+            return v
+
+    def writer(self, kb_id, kb_version_id, prev_version, prev_meta, prev_ids):
+        return NumpyWriter(self, kb_id, kb_version_id, prev_version, prev_meta, prev_ids)
+
+    def _hits(self, kb_id: str, v: _Version, scored: List[Tuple[int, float]], source: str) -> List[Dict]:
+        meta = v.chunks([r for r, _ in scored])
+        out = []
+        for r, score in scored:
+            if r in meta:
+                cid, doc, title, text = meta[r]
+                out.append({"id": cid, "kb_id": kb_id, "doc": doc, "title": title, "text": text,
+                            "score": score, "source": source})
+        return out
+
+    def search(self, kb_id, kb_version_id, q_emb, k):
+        v = self.open(kb_id, kb_version_id)
+        return self._hits(kb_id, v, v.top(q_emb, k), "vector")
+
+    def fetch(self, kb_id, kb_version_id, ids, q_emb):
+        v = self.open(kb_id, kb_version_id)
+        rows = sorted(v.rows_for(ids).values())
+        if not rows:
+            return []
+        scores = v.scores(q_emb, np.array(rows))
+        return self._hits(kb_id, v, [(r, float(s)) for r, s in zip(rows, scores)], "keyword")
+
+    def iter_chunks(self, kb_id, kb_version_id):
+        for cid, doc, title, text in self.open(kb_id, kb_version_id).iter_all():
+            yield {"id": cid, "kb_id": kb_id, "doc": doc, "title": title, "text": text}
+
+    def drop(self, kb_id):
+        # Files stay with their (archived) versions; only the open handles go
+        with self._lock:
+            for key in [k for k in self._open if k[0] == kb_id]:
+                self._open.pop(key).close()
+
+    def release_others(self, kb_id: str, keep_version: str):
+        with self._lock:
+            for key in [k for k in self._open if k[0] == kb_id and k[1] != keep_version]:
+                self._open.pop(key).close()
+
+    def warm_up(self, kbs):
+        loaded = 0
+        for kb_id, kb_version_id in kbs:
+            try:
+                v = self.open(kb_id, kb_version_id)
+            except Exception as e:
+                print(f"numpy index warm-up: {kb_id}/{kb_version_id}: {e}")
+                continue
+            if len(v):
+                v.top(np.asarray(v.mat[0], dtype=np.float32).tolist(), 1)  # page the matrix in
+            loaded += 1
+        return {"versions": loaded}
@@ -0,0 +1,79 @@
+import os, multiprocessing, threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Deque, Iterator, Optional
+from ..core.config import PARSE_WORKERS, PDF_PAGES_PER_TASK
+from ..utils.text import read_docx, read_pdf, read_pdf_pages, pdf_page_count, read_markdown
+
+# Parsing is CPU-bound (PyMuPDF, python-docx), so it runs in a
+# process pool instead of on the event loop. "spawn" keeps workers clear of the
+# server's threads and open sockets.
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=max(1, PARSE_WORKERS),
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+def read_file_by_type(file_path: str) -> str:
+    """Route file reading based on extension."""
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext == ".md":
+        return read_markdown(file_path)
+    elif ext == ".pdf":
+        return read_pdf(file_path)
+    elif ext == ".docx":
+        return read_docx(file_path)
+    else:
+        raise ValueError(f"Unsupported file type: {ext}")
+
+def _iter_markdown(file_path: str, block: int = 1 << 20) -> Iterator[str]:
+    # newline="" keeps CR/CRLF intact; iter_normalized_lines folds them across block edges
+    with open(file_path, "r", encoding="utf-8", errors="ignore", newline="") as f:
+        for piece in iter(lambda: f.read(block), ""):
+            yield piece
+
+def _iter_pdf(file_path: str) -> Iterator[str]:
+    pool = _get_pool()
+    pages = pool.submit(pdf_page_count, file_path).result()
+    step = max(1, PDF_PAGES_PER_TASK)
+    ranges = iter(range(0, pages, step))
+    inflight: Deque[Future] = deque()
+    try:
+        # Keep at most PARSE_WORKERS page ranges parsed ahead of the consumer
+        for start in ranges:
+            inflight.append(pool.submit(read_pdf_pages, file_path, start, start + step))
+            if len(inflight) >= max(1, PARSE_WORKERS):
+                yield inflight.popleft().result()
+        while inflight:
+            yield inflight.popleft().result()
+    finally:
+        for fut in inflight:
+            fut.cancel()
+
+def iter_file_text(file_path: str) -> Iterator[str]:
+    """
+    Yield the raw text of one file in pieces, in document order, without materializing
+    the whole document: markdown in 1 MB blocks, PDFs in PDF_PAGES_PER_TASK page ranges
+    parsed in the process pool. Blocking; run it off the event loop.
+    """
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext == ".md":
+        yield from _iter_markdown(file_path)
+    elif ext == ".pdf":
+        yield from _iter_pdf(file_path)
+    elif ext == ".docx":
+        yield _get_pool().submit(read_docx, file_path).result()
+    else:
+        raise ValueError(f"Unsupported file type: {ext}")
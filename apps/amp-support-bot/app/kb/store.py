@@ -1,9 +1,10 @@
-import os, json, shutil
+import os, json, hashlib
 from typing import Dict, List
 from ..core.config import KB_DIR
-from chromadb import Client
-from ..core.config import CHROMA_DIR
-import chromadb
+from .lexical import get_index
+from . import catalog
+from .index_engine import get_engine, engine_names
+from ..chat import answer_cache
 
 
 
@@ -35,10 +36,45 @@ def read_meta(kb_id: str, kb_version_id: str):
     except FileNotFoundError:
         return None
 
+def _version_disk_usage(kb_id: str, kb_version_id: str):
+    """(total bytes, source file paths) of one version directory."""
+    vdir = version_path(kb_id, kb_version_id)
+    src_dir = os.path.join(vdir, "source")
+    size_bytes, sources = 0, []
+    for root, _, files_list in os.walk(vdir):
+        for fn in files_list:
+            path = os.path.join(root, fn)
+            try:
+                size_bytes += os.path.getsize(path)
+            except FileNotFoundError:
+                continue
+            if os.path.commonpath([path, src_dir]) == src_dir:
+                sources.append(os.path.relpath(path, src_dir))
+    return size_bytes, sorted(sources)
+
 def write_meta(kb_id: str, kb_version_id: str, meta: Dict):
     os.makedirs(version_path(kb_id, kb_version_id), exist_ok=True)
     with open(os.path.join(version_path(kb_id, kb_version_id), "meta.json"), "w", encoding="utf-8") as f:
         json.dump(meta, f, indent=2)
+    # Keep the catalog in step; only this version's directory is measured
+    catalog.put_version(kb_id, kb_version_id, meta, *_version_disk_usage(kb_id, kb_version_id))
+
+def rebuild_catalog() -> int:
+    """Re-index every KB version from meta.json files on disk. Returns the number of versions."""
+    catalog.clear()
+    n = 0
+    for kid in list_kbs():
+        for vid in list_versions(kid):
+            meta = read_meta(kid, vid)
+            if meta:
+                catalog.put_version(kid, vid, meta, *_version_disk_usage(kid, vid))
+                n += 1
+    return n
+
+def ensure_catalog():
+    """Build the catalog on first start (or after it was deleted) from the KB directories."""
+    if catalog.is_empty() and list_kbs():
+        print(f"kb catalog: indexed {rebuild_catalog()} versions")
 
 def list_kbs() -> List[str]:
     if not os.path.isdir(KB_DIR):
@@ -51,22 +87,21 @@ def list_versions(kb_id: str) -> List[str]:
     return sorted(os.listdir(vdir))
 
 def active_version(kb_id: str) -> str:
-    best = None
-    best_ts = 0
-    for vid in list_versions(kb_id):
-        meta = read_meta(kb_id, vid)
-        if not meta or meta.get("archived"): 
-            continue
-        ts = _iso_to_ts(meta.get("created_at",""))
-        if ts > best_ts:
-            best, best_ts = vid, ts
-    return best
+    return catalog.active_version(kb_id)
+
+def kb_version_fingerprint() -> str:
+    """Hash of every KB's active version; identifies the content a reply was grounded on."""
+    pairs = sorted((kb["kb_id"], kb["active_version"] or "") for kb in catalog.list_kbs())
+    return hashlib.blake2b(json.dumps(pairs).encode("utf-8"), digest_size=8).hexdigest()
 
 def soft_delete_kb(kb_id: str) -> bool:
     changed = False
-    client = chromadb.PersistentClient(path=CHROMA_DIR)
-    coll =client.get_collection("chatbot")  # your collection name
-    coll.delete(where={"kb_id": kb_id})
+    for name in engine_names():
+        try:
+            get_engine(name).drop(kb_id)
+        except Exception as e:
+            print(f"soft delete {kb_id}: {name} index: {e}")
+    get_index().remove_kb(kb_id)
 
     for vid in list_versions(kb_id):
         meta = read_meta(kb_id, vid)
@@ -74,14 +109,5 @@ def soft_delete_kb(kb_id: str) -> bool:
             meta["archived"] = True
             write_meta(kb_id, vid, meta)
             changed = True
+    answer_cache.invalidate()
     return changed
-
-# def hard_delete_kb(kb_id: str) -> bool:
-#     client = chromadb.PersistentClient(path=CHROMA_DIR)
-#     coll =client.get_collection("chatbot")  # your collection name
-#     coll.delete(where={"kb_id": kb_id})
-#     kdir = kb_path(kb_id)
-#     if os.path.isdir(kdir):
-#         shutil.rmtree(kdir, ignore_errors=True)
-#         return True
-#     return False
@@ -0,0 +1,95 @@
+import threading, hashlib
+from typing import Dict, List, Optional
+import chromadb
+from ..core.config import CHROMA_DIR, CHROMA_COLLECTION
+
+# One PersistentClient per process; collection handles are cached until a write invalidates them.
+_lock = threading.RLock()
+_client = None
+_collections: Dict[str, object] = {}
+
+def get_client():
+    global _client
+    with _lock:
+        if _client is None:
+            _client = chromadb.PersistentClient(path=CHROMA_DIR)
+        return _client
+
+def get_collection(name: str = CHROMA_COLLECTION, create: bool = False, metadata: Optional[Dict] = None):
+    """
+    Cached collection handle. Raises if the collection does not exist and create is False.
+    """
+    with _lock:
+        coll = _collections.get(name)
+        if coll is None:
+            client = get_client()
+            if create:
+                coll = client.get_or_create_collection(name=name, metadata=metadata)
+            else:
+                coll = client.get_collection(name=name)
+            _collections[name] = coll
+        return coll
+
+def shard_name(kb_id: str) -> str:
+    """
+    Collection holding one KB's chunks. Chroma names must be 3-63 chars of [a-zA-Z0-9._-]
+    with alphanumeric ends, so the (possibly truncated) KB id is followed by a short hash.
+    """
+    h = hashlib.blake2b(kb_id.encode("utf-8"), digest_size=4).hexdigest()
+    return f"{CHROMA_COLLECTION}-{kb_id[:40]}-{h}"
+
+def get_shard(kb_id: str, create: bool = False, metadata: Optional[Dict] = None):
+    return get_collection(shard_name(kb_id), create=create, metadata=metadata)
+
+def drop_shard(kb_id: str) -> bool:
+    name = shard_name(kb_id)
+    with _lock:
+        _collections.pop(name, None)
+        try:
+            get_client().delete_collection(name)
+        except Exception:
+            return False
+        return True
+
+def list_collection_names() -> List[str]:
+    # Chroma < 0.6 returns Collection objects, later versions return names
+    return [c if isinstance(c, str) else c.name for c in get_client().list_collections()]
+
+def invalidate(name: Optional[str] = None):
+    """Drop cached handle(s) so the next access reopens the collection after ingest/delete."""
+    with _lock:
+        if name is None:
+            _collections.clear()
+        else:
+            _collections.pop(name, None)
+
+def warm_up(name: str = CHROMA_COLLECTION) -> Dict:
+    """
+    Open the client and collection and run a 1-NN query so the HNSW segment is
+    loaded into memory before the first chat request.
+    """
+    try:
+        coll = get_collection(name)
+    except Exception as e:
+        return {"collection": name, "loaded": False, "error": str(e)}
+    count = coll.count()
+    if count:
+        peek = coll.peek(limit=1)
+        embs = peek.get("embeddings")
+        if embs is not None and len(embs):
+            coll.query(query_embeddings=[list(embs[0])], n_results=1, include=[])
+    return {"collection": name, "loaded": True, "count": count}
+
+def warm_up_all() -> List[Dict]:
+    """warm_up every collection (the shared legacy one and all KB shards)."""
+    try:
+        names = list_collection_names()
+    except Exception as e:
+        return [{"loaded": False, "error": str(e)}]
+    return [warm_up(name) for name in names]
+
+def reset():
+    global _client
+    with _lock:
+        _collections.clear()
+        _client = None
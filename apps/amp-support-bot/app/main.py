@@ -1,24 +1,52 @@
 # app/main.py
-import os, json, time
-from typing import List, Dict
+import os, json, time, asyncio, hashlib
+from contextlib import asynccontextmanager
+from typing import List, Dict, Optional
 from fastapi import FastAPI, HTTPException, Request,UploadFile,File,Form
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from app.core.config import VERSION, UPLOADS_DIR, KB_DIR, CHROMA_DIR, RETRIEVAL_K_PER_KB, CONFIDENCE_THRESHOLD
+from app.core.config import VERSION, UPLOADS_DIR, KB_DIR, CHROMA_DIR, RETRIEVAL_K_PER_KB, CONFIDENCE_THRESHOLD, RRF_K, UPLOAD_CHUNK_BYTES, MAX_UPLOAD_MB
 from app.core.models import *
-from app.kb.ingest import ingest_files
-from app.kb.store import list_kbs, list_versions, read_meta, active_version, soft_delete_kb, version_path
+from app.kb import jobs as ingest_jobs, parsing
+from app.kb.ingest import file_manifest, SUPPORTED_EXTS
+from app.kb.store import soft_delete_kb, kb_version_fingerprint, ensure_catalog
+from app.kb.lexical import get_index
+from app.kb import vectordb, catalog as kb_catalog
+from app.kb.index_engine import get_engine
 from app.chat.store import create_chat, get_chat, append_message, get_messages, ensure_db
-from app.core.ollama import embed_texts, chat_complete
-import chromadb
-import shutil
-from nltk.corpus import wordnet  # Import wordnet to get synonyms
+from app.chat import answer_cache, intent as smalltalk, sessions as chat_sessions
+from app.chat.escalation import detect_dissatisfaction
+from app.chat.context import pack_context, approx_tokens
+from app.core.ollama import chat_complete, chat_stream
+from app.core.embed_cache import embed_texts_cached, stats as embed_cache_stats
 # import nltk
 # import spacy
 # from scipy.spatial.distance import cosine
 
 
-app = FastAPI(title="AMP_Support_Bot", version=VERSION)
+def _warm_up_indexes() -> Dict:
+    """Open every engine in use and page its vectors in before serving traffic."""
+    by_engine: Dict[str, List] = {"chroma": []}
+    for kb in kb_catalog.list_kbs():
+        if kb["active_version"]:
+            by_engine.setdefault(kb["index_engine"] or "chroma", []).append((kb["kb_id"], kb["active_version"]))
+    return {name: get_engine(name).warm_up(kbs) for name, kbs in by_engine.items()}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(ensure_catalog)
+    # Open each KB's index once and page the vectors in before serving traffic
+    app.state.index_warm_up = await asyncio.to_thread(_warm_up_indexes)
+    print(f"index warm-up: {app.state.index_warm_up}")
+    # Build the BM25 index from the vector indexes once, before any search or ingest uses it
+    await asyncio.to_thread(_ensure_lexical)
+    await ingest_jobs.start()
+    yield
+    await ingest_jobs.stop()
+    parsing.shutdown()
+    vectordb.reset()
+
+app = FastAPI(title="AMP_Support_Bot", version=VERSION, lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -45,182 +73,131 @@ ensure_db()
 
 @app.get("/healthz")
 async def healthz():
-    return {"status": "ok", "uptime_s": round(time.time()-START_TIME, 2)}
+    return {"status": "ok", "uptime_s": round(time.time()-START_TIME, 2), "embed_cache": embed_cache_stats(), "answer_cache": answer_cache.info(),
+            "chat_sessions": chat_sessions.info()}
 
 @app.get("/version")
 async def version():
     return {"version": VERSION}
 
-# @app.post("/kb/ingest")
-# @app.post("/knowledge-base/document/add")
-# async def kb_ingest(body: KBIngestBody):
-#     lock_path = os.path.join(os.path.dirname(CHROMA_DIR), "locks", "ingest.lock")
-#     os.makedirs(os.path.dirname(lock_path), exist_ok=True)
-#     if os.path.exists(lock_path):
-#         raise HTTPException(status_code=409, detail="Another ingest is running")
-#     open(lock_path, "w").write(str(time.time()))
-#     try:
-#         out = await ingest_folder(body.KB_name)
-#         return out
-#     except FileNotFoundError as e:
-#         raise HTTPException(status_code=404, detail=str(e))
-#     except ValueError as e:
-#         raise HTTPException(status_code=400, detail=str(e))
-#     finally:
-#         try:
-#             os.remove(lock_path)
-#         except FileNotFoundError:
-#             pass
-
-@app.post("/knowledge-base/document/add")
-async def kb_ingest(folder_name: str = Form(...), files: List[UploadFile] = File(...)):
-    # folder_name = body.folder_name  # Folder name passed in the request
-    print(folder_name)
-    # print(files.filenames)
-    # Locking mechanism to avoid concurrent ingest operations
-    lock_path = os.path.join(os.path.dirname(CHROMA_DIR), "locks", "ingest.lock")
-    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
-    
-    if os.path.exists(lock_path):
-        raise HTTPException(status_code=409, detail="Another ingest is running")
-    
-    open(lock_path, "w").write(str(time.time()))  # Create a lock file
+async def _save_upload(file: UploadFile, file_path: str) -> Dict:
+    """
+    Stream an upload to disk in UPLOAD_CHUNK_BYTES blocks, hashing while writing.
+    Returns the file manifest; raises 413 (and removes the partial file) past MAX_UPLOAD_MB.
+    """
+    limit = MAX_UPLOAD_MB * 1_000_000
+    if file.size is not None and file.size > limit:
+        raise HTTPException(status_code=413, detail=f"{file.filename} exceeds {MAX_UPLOAD_MB} MB")
+    h = hashlib.blake2b(digest_size=16)
+    size = 0
+    try:
+        with open(file_path, "wb") as f:
+            while True:
+                block = await file.read(UPLOAD_CHUNK_BYTES)
+                if not block:
+                    break
+                size += len(block)
+                if size > limit:
+                    raise HTTPException(status_code=413, detail=f"{file.filename} exceeds {MAX_UPLOAD_MB} MB")
+                h.update(block)
+                await asyncio.to_thread(f.write, block)
+    except BaseException:
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return file_manifest(os.path.basename(file_path), h.hexdigest(), size)
 
+@app.post("/knowledge-base/document/add", status_code=202)
+async def kb_ingest(folder_name: str = Form(...), files: List[UploadFile] = File(...)):
+    # Save the uploads and queue a background ingest job; poll /knowledge-base/jobs/{job_id}
+    for file in files:
+        if not (file.filename or "").lower().endswith(SUPPORTED_EXTS):
+            raise HTTPException(status_code=400, detail=f"Unsupported file type: {file.filename}")
     try:
         # Step 1: Create the folder to save files
         save_path = os.path.join(UPLOADS_DIR, folder_name)
-        print(f"Saving files to: {save_path}")
         os.makedirs(save_path, exist_ok=True)
 
         saved_files = []  # List to store saved file paths
+        manifests = {}
 
-        # Step 2: Save files from the request to the specified folder
+        # Step 2: Stream files from the request to the specified folder, hashing as we go
         for file in files:
-            file_path = os.path.join(save_path, file.filename)  # Full path to save the file
-            
-            # Save the file content to disk
-            with open(file_path, "wb") as f:
-                shutil.copyfileobj(file.file, f)  # Write the file content
+            file_path = os.path.join(save_path, os.path.basename(file.filename))  # Full path to save the file
+            manifests[file_path] = await _save_upload(file, file_path)
             saved_files.append(file_path)  # Add the file path to the list
             print(f"File saved: {file_path}")
-        
-        # Step 3: Process the saved files (implement your ingest function)
-        out = await ingest_files(saved_files)  # Assuming ingest_files is defined elsewhere
-
-        return {"message": "Files uploaded and ingested successfully", "result": out}  # Return the result of ingestion
-
-    except FileNotFoundError as e:
-        raise HTTPException(status_code=404, detail=f"File not found: {str(e)}")
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=f"Value error: {str(e)}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
-    finally:
-        # Cleanup the lock file
-        try:
-            os.remove(lock_path)
-        except FileNotFoundError:
-            pass
+    except OSError as e:
+        raise HTTPException(status_code=500, detail=f"Could not save upload: {str(e)}")
+
+    # Step 3: Queue ingestion
+    job = ingest_jobs.submit(folder_name, saved_files, manifests)
+    return {
+        "message": "Files uploaded and queued for ingestion",
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "status_url": f"/knowledge-base/jobs/{job['job_id']}",
+    }
+
+@app.get("/knowledge-base/jobs")
+async def kb_jobs(limit: int = 50):
+    return await asyncio.to_thread(ingest_jobs.list_jobs, limit)
+
+@app.get("/knowledge-base/jobs/{job_id}")
+async def kb_job(job_id: str):
+    job = ingest_jobs.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Unknown job_id")
+    return job
 
 # @app.get("/kb")
 @app.get("/knowledge-base/list")
 async def kb_list():
-    items = []
-    for kid in list_kbs():
-        av = active_version(kid)
-        files=chunks=0
-        created=None
-        if av:
-            meta = read_meta(kid, av)
-            files = meta.get("source_stats",{}).get("files",0)
-            chunks = meta.get("chunks",0)
-            created = meta.get("created_at")
-        size_bytes = 0
-        vdir = os.path.join(KB_DIR, kid, "versions")
-        for root, _, files_list in os.walk(vdir):
-            for fn in files_list:
-                try:
-                    size_bytes += os.path.getsize(os.path.join(root, fn))
-                except FileNotFoundError:
-                    pass
-        items.append({
-            "kb_id": kid,
-            "active_version": av,
-            "files": files,
-            "chunks": chunks,
-            "created_at": created,
-            "size_mb": round(size_bytes/1_000_000, 3),
-        })
-    return items
+    # Served from the KB catalog, kept current by write_meta; no per-request directory walk
+    return [{
+        "kb_id": kb["kb_id"],
+        "active_version": kb["active_version"],
+        "files": kb["files"],
+        "chunks": kb["chunks"],
+        "created_at": kb["created_at"],
+        "size_mb": round(kb["bytes"]/1_000_000, 3),
+    } for kb in await asyncio.to_thread(kb_catalog.list_kbs)]
 
 # @app.get("/kb/{kb_id}")
 @app.get("/knowledge-base/list-by-id/{kb_id}")
 async def kb_detail(kb_id: str):
-    vers = list_versions(kb_id)
+    vers = await asyncio.to_thread(kb_catalog.list_versions, kb_id)
     if not vers:
         raise HTTPException(status_code=404, detail="KB not found")
     versions = []
     for v in vers:
-        meta = read_meta(kb_id, v)
-        if not meta: 
-            continue
         versions.append({
-            "kb_version_id": meta["kb_version_id"],
-            "created_at": meta["created_at"],
-            "files": meta.get("source_stats",{}).get("files",0),
-            "chunks": meta.get("chunks",0),
-            "embedding": meta.get("embedding",{}).get("model",""),
-            "index_engine": meta.get("index",{}).get("engine","chroma"),
+            "kb_version_id": v["kb_version_id"],
+            "created_at": v["created_at"],
+            "files": v["files"],
+            "chunks": v["chunks"],
+            "embedding": v["embedding"] or "",
+            "index_engine": v["index_engine"] or "chroma",
             # "tags": meta.get("tags",[])
         })
-    av = active_version(kb_id)
+    av = kb_catalog.active_version(kb_id)
     sample = []
-    if av:
-        src_dir = os.path.join(version_path(kb_id, av), "source")
-        for root, _, files in os.walk(src_dir):
-            for fn in files:
-                if fn.lower().endswith(".md"):
-                    rel = os.path.relpath(os.path.join(root, fn), src_dir)
-                    sample.append({"path": rel})
-                    if len(sample)>=5:
-                        break
-            if len(sample)>=5: break
+    for v in vers:
+        if v["kb_version_id"] == av:
+            sample = [{"path": p} for p in v["source_files"] if p.lower().endswith(".md")][:5]
     return {"kb_id": kb_id, "versions": versions, "active_version": av, "sample_docs": sample}
 
 # @app.delete("/kb/{kb_id}")
 @app.post("/knowledge-base/delete/{kb_id}")
 # async def kb_delete(kb_id: str, force: bool=False):
 async def kb_delete(kb_id: str):
-    if not list_versions(kb_id):
+    if not kb_catalog.get_kb(kb_id):
         raise HTTPException(status_code=404, detail="KB not found")
    
     changed = soft_delete_kb(kb_id)
     return {"kb_id": kb_id, "deleted": True, "mode": "soft", "changed": changed}
-    # else:
-    #     ok = hard_delete_kb(kb_id)
-    #     return {"kb_id": kb_id, "deleted": ok, "mode": "hard"}
-
-# from fastapi import Body - further use 
-
-# @app.delete("/kb/{kb_id}")
-# async def kb_delete(kb_id: str, body: Optional[TicketDeleteBody] = Body(None)):
-#     if kb_id == "tickets":
-#         if not body or not body.ticket_ids:
-#             raise HTTPException(status_code=400, detail="ticket_ids required for deleting tickets")
-        
-#         # Delete only these tickets from vector DB
-#         client = chromadb.PersistentClient(path=CHROMA_DIR)
-#         coll = client.get_collection("chatbot")
-#         coll.delete(where={"kb_id": "tickets", "ticket_id": {"$in": body.ticket_ids}})
-        
-#         return {"kb_id": kb_id, "deleted_tickets": body.ticket_ids}
-    
-#     # For document KBs
-#     if not list_versions(kb_id):
-#         raise HTTPException(status_code=404, detail="KB not found")
-    
-#     changed = soft_delete_kb(kb_id)
-#     return {"kb_id": kb_id, "deleted": True, "mode": "soft", "changed": changed}
 
 # def _resolve_bindings(kb_ids: List[str]) -> List[Dict[str,str]]:
 #     bindings = []
@@ -231,97 +208,115 @@ async def kb_delete(kb_id: str):
 #         bindings.append({"kb_id": kid, "kb_version_id": av})
 #     return bindings
 
-async def _retrieve( query: str, k_per_kb: int):
-    print(f"235 {CHROMA_DIR}")
-    client = chromadb.PersistentClient(path=CHROMA_DIR)
-    print("237")
-
-    print(client.list_collections())
-
-
-    print("242")
-
-    q_emb = (await embed_texts([query]))[0]
-    print("245")
+def _resolve_kb_ids(kb_ids: Optional[List[str]]) -> Optional[List[str]]:
+    """Validate requested KBs; None means "search every KB"."""
+    if not kb_ids:
+        return None
+    out = []
+    for kid in dict.fromkeys(kb_ids):
+        if not kb_catalog.active_version(kid):
+            raise HTTPException(status_code=404, detail=f"No active version for KB '{kid}'")
+        out.append(kid)
+    return out
 
-    pooled = []
-    # for b in kb_bindings:
-        # name = f"{b['kb_id']}__{b['kb_version_id']}"
-    name="chatbot"
+def _query_kb(kb: Dict, q_emb: List[float], k: int) -> List[Dict]:
+    """Vector search in one KB through its index engine (runs in a worker thread)."""
     try:
-        print("252")
-
-        coll = client.get_collection(name)
-        print("255")
+        return get_engine(kb["index_engine"] or "chroma").search(kb["kb_id"], kb["active_version"], q_emb, k)
+    except Exception as e:
+        print(f"retrieve: KB {kb['kb_id']} unavailable: {e}")
+        return []
 
+def _score_keyword_hits(kb: Dict, ids: List[str], q_emb: List[float]) -> List[Dict]:
+    # Score keyword-only chunks on the same scale as vector hits so
+    # CONFIDENCE_THRESHOLD and citation scores stay meaningful.
+    try:
+        return get_engine(kb["index_engine"] or "chroma").fetch(kb["kb_id"], kb["active_version"], ids, q_emb)
     except Exception as e:
-        print("254")
-        print(e)
-        pass
-    # Chroma 0.5.x: do NOT include "ids" here
-    # --- Vector search ---
-    res = coll.query(
-        query_embeddings=[q_emb],
-        n_results=k_per_kb,
-        include=["metadatas", "documents", "distances"]
-    )
-    print("264")
-
-    # Safe row count regardless of ids presence
-    row_count = len(res["documents"][0]) if "documents" in res else 0
-    print("268")
-
-    for i in range(row_count):
-        pooled.append({
-            "id": (res.get("ids", [[""]])[0][i] if "ids" in res else ""),
-            "doc": res["metadatas"][0][i].get("doc",""),
-            "title": res["metadatas"][0][i].get("title",""),
-            "text": res["documents"][0][i],
-            "score": 1.0 - float(res["distances"][0][i])
-        })
+        print(f"retrieve: KB {kb['kb_id']} unavailable: {e}")
+        return []
+
+def _ensure_lexical():
+    """Open the BM25 index; a missing one is rebuilt from every active KB version (one-off migration)."""
+    lex = get_index()
+    if lex.exists():
+        return
+    kbs = [kb for kb in kb_catalog.list_kbs() if kb["active_version"]]
+    def chunks():
+        for kb in kbs:
+            yield from get_engine(kb["index_engine"] or "chroma").iter_chunks(kb["kb_id"], kb["active_version"])
+    try:
+        lex.rebuild(chunks())
+        print(f"lexical index: rebuilt from {len(kbs)} KB(s)")
+    except Exception as e:
+        print(f"lexical index: rebuild failed, keyword search stays empty until a restart: {e}")
+
+def _keyword_search(lex, query: str, limit: int, kb_ids) -> List:
+    """[(chunk id, kb_id)] best first (SQLite reads, run in a worker thread)."""
+    return [(cid, lex.kb_of(cid)) for cid, _ in lex.search(query, limit, kb_ids=kb_ids)]
 
-        #--- Keyword search ---
-        all_docs = coll.get(include=["metadatas", "documents"])
-        for doc_text, meta in zip(all_docs["documents"], all_docs["metadatas"]):
-            if query.lower() in doc_text.lower() or query.lower() in meta.get("title","").lower():
-                pooled.append({
-                    "id": meta.get("doc","") + "_kw",
-                    "doc": meta.get("doc",""),
-                    "title": meta.get("title",""),
-                    "text": doc_text,
-                    "score": 0.8,   # keyword match score, lower than vector
-                    "source": "keyword"
-                })
-    # --- Deduplicate and sort ---
-    pooled.sort(key=lambda x: x["score"], reverse=True)
-    top, seen = [], set()
-    for item in pooled:
-        key = item["doc"]
-        if key in seen:
-            continue
-        top.append(item)
-        seen.add(key)
-        if len(top) >= max(12, k_per_kb):
-            break
-    print("302")
-    return top
-
-def _build_prompt(query: str, ctx_items: List[Dict]) -> str:
+async def _retrieve(query: str, k_per_kb: int, q_emb: List[float] = None, kb_ids: Optional[List[str]] = None):
+    """
+    Hybrid search over the given KBs (default: every KB with an active version). Each KB's
+    index is queried concurrently and hits are merged by score, then fused with BM25 via RRF.
+    """
+    active = {kb["kb_id"]: kb for kb in kb_catalog.list_kbs() if kb["active_version"]}
+    kbs = [active[kid] for kid in kb_ids if kid in active] if kb_ids else list(active.values())
+    if not kbs:
+        return []
+    if q_emb is None:
+        q_emb = (await embed_texts_cached([query]))[0]
+    limit = max(12, k_per_kb)
+
+    lex = await asyncio.to_thread(get_index)
+
+    # --- Vector search, one index per KB in parallel ---
+    per_kb = await asyncio.gather(*(asyncio.to_thread(_query_kb, kb, q_emb, k_per_kb) for kb in kbs))
+    hits = sorted((h for kb_hits in per_kb for h in kb_hits), key=lambda h: h["score"], reverse=True)[:limit]
+    items: Dict[str, Dict] = {h["id"]: h for h in hits}
+    vec_rank: Dict[str, int] = {h["id"]: i + 1 for i, h in enumerate(hits)}
+
+    # --- Keyword search (BM25 postings restricted to the KBs, no collection scan) ---
+    kw_hits = await asyncio.to_thread(_keyword_search, lex, query, limit, {kb["kb_id"] for kb in kbs})
+    kw_rank: Dict[str, int] = {cid: i + 1 for i, (cid, _) in enumerate(kw_hits)}
+    kw_only: Dict[str, List[str]] = {}
+    for cid, kid in kw_hits:
+        if cid not in items:
+            kw_only.setdefault(kid, []).append(cid)
+    if kw_only:
+        scored = await asyncio.gather(*(asyncio.to_thread(_score_keyword_hits, active[kid], ids, q_emb)
+                                        for kid, ids in kw_only.items() if kid in active))
+        for it in (it for group in scored for it in group):
+            items[it["id"]] = it
+    for cid in kw_rank:
+        if cid in vec_rank and cid in items:
+            items[cid]["source"] = "hybrid"
+
+    # --- Reciprocal-rank fusion ---
+    for cid, it in items.items():
+        it["rrf"] = sum(1.0 / (RRF_K + r[cid]) for r in (vec_rank, kw_rank) if cid in r)
+    fused = sorted(items.values(), key=lambda x: x["rrf"], reverse=True)
+    return fused[:limit]
+
+def _build_prompt(query: str, ctx_items: List[Dict], start: int = 1, followup: bool = False) -> str:
+    # Layout stays fixed (context, question, instructions) so a follow-up turn appended to a
+    # chat session adds tokens after an unchanged prefix; it only lists context items not
+    # already sent in the session, numbered after them.
     lines = []
-    for i, it in enumerate(ctx_items, start=1):
-        snippet = it["text"][:800]
-        lines.append(f"[{i}] {it['doc']} — {it['title']}\n{snippet}")
-    ctx = "\n\n".join(lines) if lines else "(no relevant context found)"
+    for i, it in enumerate(ctx_items, start=start):
+        lines.append(f"[{i}] {it['doc']} — {it['title']}\n{it['text']}")
+    if followup:
+        ctx = "\n\n".join(lines) if lines else "(nothing new; use the Context given earlier)"
+    else:
+        ctx = "\n\n".join(lines) if lines else "(no relevant context found)"
     return f"""
-    Context:
+    {"Additional Context" if followup else "Context"}:
     {ctx}
 
     User Question:
     {query}
 
     Instructions:
-    **EXCEPTION FOR GREETINGS: If the user sends a greeting (like "hi", "hello", "hey", "good morning", etc.) or casual conversational message that doesn't require context information, respond briefly and warmly (e.g., "Hello! How can I help you today?").**
-    -Strictly don't give other answer when user greet give them greet and ask just "how can i help you?"
     -Answer the user question ONLY using the information in the Context above.
     -If the Context does not contain enough information, clearly say:
      "I do not have enough information to answer that."
@@ -354,139 +349,157 @@ def _extract_citations(ctx_items: List[Dict], text: str):
     return out
 # 
 
-def get_synonyms(word):
-    synonyms = set()
-    for syn in wordnet.synsets(word):
-        for lemma in syn.lemmas():
-            synonyms.add(lemma.name())  # Add the synonym to the set
-    return synonyms
-
-def detect_dissatisfaction(message: str) -> bool:
-    dissatisfaction_keywords = [
-        "raise ticket", "contact support", "need support", "connect me with agent",
-        "talk to agent", "open ticket", "technical issue", "customer care", "help me",
-        "this isn't helpful", "doesn't work", "not what I asked", "I'm confused", 
-        "not what I needed", "can't get it to work", "this is wrong","raise ticket",
-        "contact support",
-        "need support",
-        "connect me with agent",
-        "talk to agent",
-        "open ticket",
-        "technical issue",
-        "customer care",
-        "help me",
-        "this isn't helpful",
-        "doesn't work",
-        "not what I asked",
-        "I'm confused",
-        "not what I needed",
-        "help me",
-        "can't get it to work",
-        "this is wrong"
-    ]
-    
-    # Additional keywords for more flexible matching
-    additional_keywords = ["ticket", "support", "help", "assist", "problem", "issue", "agent", "customer service", "contact"]
-
-    message_lower = message.lower()
-
-    # First, check if any dissatisfaction keyword is in the user's message
-    for word in dissatisfaction_keywords:
-        if word in message_lower:
-            return True
-    
-    # Second, check for additional related words (using basic keyword matching)
-    if any(keyword in message_lower for keyword in additional_keywords):
-        return True
-
-    # If no dissatisfaction keyword or related keyword is found, return False
-    return False
-# Convert dissatisfaction-related phrases to vectors
-    # dissatisfaction_vectors = [nlp(keyword).vector for keyword in dissatisfaction_keywords]
-    # message_vector = nlp(message).vector  # Get vector for the user's message
-    # max_similarity = 0  # Track the maximum similarity score
-
-    # # Calculate similarity with each predefined dissatisfaction phrase
-    # for vector in dissatisfaction_vectors:
-    #     similarity = 1 - cosine(message_vector, vector)
-    #     max_similarity = max(max_similarity, similarity)  # Update max similarity
-        
-    #     # If the similarity surpasses the threshold, break early for better performance
-    #     if max_similarity > 0.85:  # Adjust the threshold as needed (e.g., 0.85)
-    #         return True
-
-    # # If no similarity exceeds the threshold, return False
-    # return False
-    # Calculate similarity with each predefined dissatisfaction phrase
-    # for vector in dissatisfaction_vectors:
-    #     similarity = 1 - cosine(message_vector, vector)
-    #     if similarity > 0.7:  # You can adjust the threshold (0.7 in this case)
-    #         return True
-    
-    # return False
-    # Alternatively, use OpenAI to detect frustration/satisfaction using sentiment or keywords
-    # response = openai.Completion.create(
-    #     model="text-davinci-003",
-    #     prompt=f"Detect if the following message expresses dissatisfaction or frustration: '{message}'",
-    #     max_tokens=10
-    # )
-    
-    # result = response.choices[0].text.strip().lower()
-    # return "yes" in result
+async def _prepare(message: str, kb_ids: Optional[List[str]] = None, chat_id: Optional[str] = None) -> Dict:
+    """
+    Small talk -> embed -> semantic answer cache -> retrieve. Returns {"ready": fields} when
+    the reply needs no LLM call, otherwise everything needed to run the LLM and finish the reply.
+    With a live session for chat_id the turn extends the session's messages instead.
+    """
+    start = time.time()
+    fast = smalltalk.match(message)
+    if fast:
+        return {"ready": {"reply": fast["reply"], "citations": [], "abstained": False,
+                          "latency_ms": int((time.time()-start)*1000), "intent": fast["intent"]}}
+
+    q_emb = (await embed_texts_cached([message]))[0]
+    scope = answer_cache.current_scope(kb_version_fingerprint)
+    if kb_ids:
+        scope += "|" + ",".join(sorted(kb_ids))
+    start = time.time()
+    # A follow-up answered from the session's history depends on that history, so it neither
+    # reads nor feeds the answer cache, which is keyed on the message alone
+    session = chat_sessions.get(chat_id, scope)
+    hit = None if session else answer_cache.lookup(q_emb, scope)
+    if hit:
+        payload, sim = hit
+        latency_ms = int((time.time()-start)*1000)
+        return {"ready": {**payload, "latency_ms": latency_ms, "cache_hit": True, "cache_similarity": round(sim, 4)}}
+
+    ctx_items = await _retrieve(message, RETRIEVAL_K_PER_KB, q_emb=q_emb, kb_ids=kb_ids)
+    conf = max([x["score"] for x in ctx_items], default=0.0)
+    # Fill the context token budget best score first; citations index into the packed items.
+    # A follow-up only packs chunks not sent earlier in the session.
+    sent = {it["id"] for it in session["ctx_items"]} if session else frozenset()
+    ctx_items, context_tokens = pack_context(ctx_items, skip_ids=sent)
+    prep = {"q_emb": q_emb, "scope": scope, "conf": conf, "chat_id": chat_id, "context_tokens": context_tokens}
+    if session:
+        new_items = ctx_items
+        prompt = _build_prompt(message, new_items, start=len(session["ctx_items"]) + 1, followup=True)
+        # Citation numbers refer to everything sent in the session so far
+        ctx_items = session["ctx_items"] + new_items
+        messages = session["messages"] + [{"role": "user", "content": prompt}]
+        tokens = session["tokens"] + approx_tokens(prompt)
+    else:
+        prompt = _build_prompt(message, ctx_items)
+        messages = [{"role": "user", "content": prompt}]
+        tokens = approx_tokens(prompt)
+    return {**prep, "ctx_items": ctx_items, "prompt": prompt, "messages": messages,
+            "session_reused": bool(session), "prompt_tokens": tokens, "llm_stats": {}}
+
+def _finalize(prep: Dict, text: str, latency_ms: int) -> Dict:
+    abstained = (prep["conf"] < CONFIDENCE_THRESHOLD) or ("do not have enough" in text.lower())
+    citations = _extract_citations(prep["ctx_items"], text)
+    payload = {"reply": text, "citations": citations, "abstained": bool(abstained)}
+    if not abstained and not prep["session_reused"]:
+        answer_cache.store(prep["q_emb"], prep["scope"], payload)
+    # The assistant turn goes into the session verbatim so the next prompt shares its prefix
+    chat_sessions.put(prep["chat_id"], prep["scope"], prep["messages"] + [{"role": "assistant", "content": text}],
+                      prep["ctx_items"], prep["prompt_tokens"] + approx_tokens(text))
+    chat_sessions.record(prep["session_reused"], prep["llm_stats"])
+    return {**payload, "latency_ms": latency_ms, "cache_hit": False, "cache_similarity": None,
+            "prompt_tokens": prep["prompt_tokens"], "context_tokens": prep["context_tokens"],
+            "session_reused": prep["session_reused"]}
+
+async def _answer(message: str, kb_ids: Optional[List[str]] = None, chat_id: Optional[str] = None) -> Dict:
+    """ChatReply fields shared by /chat/start and /chat/reply (non-streaming)."""
+    prep = await _prepare(message, kb_ids, chat_id)
+    if "ready" in prep:
+        return prep["ready"]
+    start = time.time()
+    text = await chat_complete(prep["prompt"], stream=False, messages=prep["messages"], stats=prep["llm_stats"])
+    return _finalize(prep, text, int((time.time()-start)*1000))
+
+def _sse(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _stream_answer(chat_id: str, message: str, kb_ids: Optional[List[str]] = None) -> StreamingResponse:
+    """
+    Server-Sent Events: "token" events while the model generates, then one "done" event
+    with citations and flags. The assistant message is stored only after the stream ends.
+    """
+    async def events():
+        start = time.time()
+        try:
+            prep = await _prepare(message, kb_ids, chat_id)
+            if "ready" in prep:
+                out = prep["ready"]
+                yield _sse("token", {"content": out["reply"]})
+                first_token_ms = int((time.time()-start)*1000)
+            else:
+                parts: List[str] = []
+                first_token_ms = None
+                gen_start = time.time()
+                async for delta in chat_stream(prep["prompt"], messages=prep["messages"], stats=prep["llm_stats"]):
+                    if first_token_ms is None:
+                        first_token_ms = int((time.time()-start)*1000)
+                    parts.append(delta)
+                    yield _sse("token", {"content": delta})
+                out = _finalize(prep, "".join(parts), int((time.time()-gen_start)*1000))
+        except Exception as e:
+            yield _sse("error", {"type": e.__class__.__name__, "detail": str(e)})
+            return
+        await append_message(chat_id, "assistant", out["reply"])
+        flag = detect_dissatisfaction(message)
+        done = ChatReply(chat_id=chat_id, is_raise_ticket=flag, **out).model_dump()
+        done["first_token_ms"] = first_token_ms
+        yield _sse("done", done)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.post("/chat/start", response_model=ChatReply)
 async def chat_start(body: ChatStartBody):
 
     # bindings = _resolve_bindings(body.kb_ids)
     # chat_id = create_chat(bindings)
-    chat_id = create_chat()
-
-    append_message(chat_id, "user", body.message)
-    print("line no 427")
-    ctx_items = await _retrieve(body.message, RETRIEVAL_K_PER_KB)
-    print("line no 428")
-    conf = max([x["score"] for x in ctx_items], default=0.0)
-    prompt = _build_prompt(body.message, ctx_items)
-    start = time.time()
-    text = await chat_complete(prompt, stream=False)
-    latency_ms = int((time.time()-start)*1000)
-    abstained = (conf < CONFIDENCE_THRESHOLD) or ("do not have enough" in text.lower())
-    citations = _extract_citations(ctx_items, text)
-    append_message(chat_id, "assistant", text)
+    kb_ids = _resolve_kb_ids(body.kb_ids)
+    chat_id = await create_chat(kb_ids)
+
+    await append_message(chat_id, "user", body.message)
+    if body.stream:
+        return _stream_answer(chat_id, body.message, kb_ids)
+    out = await _answer(body.message, kb_ids, chat_id)
+    await append_message(chat_id, "assistant", out["reply"])
     flag=detect_dissatisfaction(body.message)
     # return ChatReply(chat_id=chat_id, kb_bindings=bindings, reply=text, citations=citations, abstained=bool(abstained), latency_ms=latency_ms)
-    return ChatReply(chat_id=chat_id, reply=text, citations=citations, abstained=bool(abstained), latency_ms=latency_ms,is_raise_ticket=flag)
+    return ChatReply(chat_id=chat_id, is_raise_ticket=flag, **out)
 
 
 
 @app.post("/chat/reply", response_model=ChatReply)
 async def chat_reply(body: ChatReplyBody):
-    chat = get_chat(body.chat_id)
+    chat = await get_chat(body.chat_id)
     if not chat:
         raise HTTPException(status_code=404, detail="Unknown chat_id")
     # bindings = chat["kb_bindings"]
-    append_message(body.chat_id, "user", body.message)
-    ctx_items = await _retrieve( body.message, RETRIEVAL_K_PER_KB)
-    conf = max([x["score"] for x in ctx_items], default=0.0)
-    prompt = _build_prompt(body.message, ctx_items)
-    start = time.time()
-    text = await chat_complete(prompt, stream=False)
-    latency_ms = int((time.time()-start)*1000)
-    abstained = (conf < CONFIDENCE_THRESHOLD) or ("do not have enough" in text.lower())
-    citations = _extract_citations(ctx_items, text)
-    append_message(body.chat_id, "assistant", text)
+    kb_ids = chat["kb_ids"]
+    await append_message(body.chat_id, "user", body.message)
+    if body.stream:
+        return _stream_answer(body.chat_id, body.message, kb_ids)
+    out = await _answer(body.message, kb_ids, body.chat_id)
+    await append_message(body.chat_id, "assistant", out["reply"])
     flag=detect_dissatisfaction(body.message)
-    return ChatReply(chat_id=body.chat_id, reply=text, citations=citations, abstained=bool(abstained), latency_ms=latency_ms,is_raise_ticket=flag)
+    return ChatReply(chat_id=body.chat_id, is_raise_ticket=flag, **out)
     # return ChatReply(chat_id=body.chat_id, kb_bindings=bindings, reply=text, citations=citations, abstained=bool(abstained), latency_ms=latency_ms)
 
 
 
 @app.get("/chat/{chat_id}")
 async def chat_get(chat_id: str):
-    chat = get_chat(chat_id)
+    chat = await get_chat(chat_id)
     if not chat:
         raise HTTPException(status_code=404, detail="Unknown chat_id")
-    msgs = [{"role": r, "text": t, "ts": ts} for (r, t, ts) in get_messages(chat_id, limit=50)]
-    return {"chat_id": chat_id, "messages": msgs}
+    msgs = [{"role": r, "text": t, "ts": ts} for (r, t, ts) in await get_messages(chat_id, limit=50)]
+    return {"chat_id": chat_id, "kb_ids": chat["kb_ids"], "messages": msgs}
     # return {"chat_id": chat_id, "kb_bindings": chat["kb_bindings"], "messages": msgs, "rolling_summary": chat["rolling_summary"]}
 
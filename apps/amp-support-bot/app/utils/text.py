@@ -1,10 +1,11 @@
 import re, hashlib
-from typing import List, Dict
+from typing import Dict, Iterable, Iterator, List
 import fitz
 from docx import Document
 import os
 
 HEADER_RE = re.compile(r'^(#{1,6})\s+(.*)', re.M)
+HEADER_LINE_RE = re.compile(r'(#{1,6})\s+(.*)')
 
 def slugify(text: str) -> str:
     """
@@ -68,6 +69,87 @@ def split_heading_aware(md: str, max_chars: int, overlap: int) -> List[Dict]:
             start = max(0, end - overlap)
     return chunks
 
+def iter_normalized_lines(pieces: Iterable[str]) -> Iterator[str]:
+    """
+    Streaming counterpart of normalize_markdown over arbitrary text pieces: yields lines
+    (without newline) with CRLF/CR folded to LF, the BOM and leading blank lines dropped,
+    runs of empty lines collapsed to one and trailing empty lines removed.
+    """
+    pending = ""
+    started = False
+    blanks = 0
+    first = True
+    for piece in pieces:
+        if first:
+            piece = piece.lstrip('\ufeff')
+            first = False
+        pending += piece
+        carry = ""
+        if pending.endswith("\r"):
+            pending, carry = pending[:-1], "\r"
+        pending = pending.replace('\r\n', '\n').replace('\r', '\n')
+        lines = pending.split("\n")
+        pending = lines.pop() + carry
+        for line in lines:
+            if not started:
+                line = line.lstrip()
+                if not line:
+                    continue
+                started = True
+            elif not line:
+                blanks += 1
+                continue
+            if blanks:
+                yield ""
+                blanks = 0
+            yield line
+    pending = pending.replace('\r', '\n')
+    for line in pending.split("\n"):
+        if not started:
+            line = line.lstrip()
+            if not line:
+                continue
+            started = True
+        elif not line:
+            blanks += 1
+            continue
+        if blanks:
+            yield ""
+            blanks = 0
+        yield line
+
+def iter_heading_chunks(lines: Iterable[str], max_chars: int, overlap: int) -> Iterator[Dict]:
+    """
+    Streaming counterpart of split_heading_aware: holds at most one window of the current
+    section in memory. Text before the first heading is kept as a "document" section.
+    """
+    step = max(1, max_chars - overlap)
+    title = "document"
+    buf = ""
+
+    def windows(final: bool):
+        nonlocal buf
+        while len(buf.rstrip()) > max_chars:
+            chunk = buf[:max_chars].strip()
+            if chunk:
+                yield {"title": title, "text": chunk}
+            buf = buf[step:]
+        if final:
+            chunk = buf.strip()
+            if chunk:
+                yield {"title": title, "text": chunk}
+            buf = ""
+
+    for line in lines:
+        m = HEADER_LINE_RE.match(line)
+        if m:
+            yield from windows(final=True)
+            title = (m.group(2) or "").strip() or "section"
+            continue
+        buf = (buf + "\n" + line) if buf else line.lstrip()
+        yield from windows(final=False)
+    yield from windows(final=True)
+
 def file_digest(path: str) -> str:
     h = hashlib.sha256()
     with open(path, 'rb') as f:
@@ -75,13 +157,20 @@ def file_digest(path: str) -> str:
             h.update(b)
     return h.hexdigest()
 
+def pdf_page_count(file_path: str) -> int:
+    with fitz.open(file_path) as pdf:
+        return pdf.page_count
+
+def read_pdf_pages(file_path: str, start: int, end: int) -> str:
+    """Extract text of pages [start, end) using PyMuPDF."""
+    with fitz.open(file_path) as pdf:
+        return "".join(pdf[i].get_text("text") + "\n" for i in range(start, min(end, pdf.page_count)))
+
 def read_pdf(file_path: str) -> str:
     """Extract text from PDF using PyMuPDF."""
-    text = ""
     with fitz.open(file_path) as pdf:
-        for page in pdf:
-            text += page.get_text("text") + "\n"
-    return text.strip()
+        parts = [page.get_text("text") + "\n" for page in pdf]
+    return "".join(parts).strip()
 
 def read_docx(file_path: str) -> str:
     """Extract text from DOCX using python-docx."""